@@ -10,8 +10,10 @@ import os, logging, bcrypt
 from dotenv import load_dotenv
 
 # Custom imports
-from utils.database import get_db_connection
+from utils.database import get_db_connection, init_app as init_db
 from utils.errors import unauthorized
+from utils.image_utils import cover_srcset, serve_upload
+from utils.user_cache import get_user
 from blueprints.auth import auth_blueprint
 from blueprints.base import base_blueprint
 from blueprints.books import books_blueprint
@@ -24,7 +26,6 @@ from blueprints.feed import feed_blueprint
 from blueprints.wishlist import wishlist_blueprint
 from blueprints.friends import friends_blueprint
 from config import DevelopmentConfig, ProductionConfig
-from models import User
 
 def create_app():
     # Create the Flask app instance
@@ -43,6 +44,9 @@ def create_app():
     else:
         app.config.from_object(DevelopmentConfig)
 
+    # Request-scoped, pooled database connections
+    init_db(app)
+
     # Initialize CSRF Protection
     csrf = CSRFProtect(app)
 
@@ -81,24 +85,8 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        logging.debug(f"Loading user with ID: {user_id}")
-        conn = get_db_connection()
-        logging.debug("Database connections successful")
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        conn.close()
-        if user:
-            user_dict = dict(user)
-            return User(
-                id=user_dict['id'],
-                username=user_dict['username'],
-                email=user_dict['email'],
-                is_active=user_dict.get('is_active', 0) == 1,
-                is_admin=user_dict.get('is_admin', 0) == 1,
-                avatar_url=user_dict.get('avatar_url'),
-                email_verified=user_dict.get('email_verified', 1) == 1,
-                bio=user_dict.get('bio')
-            )
-        return None
+        # Served from a per-worker cache (see utils/user_cache.py)
+        return get_user(user_id)
 
     # FOR HOME PAGE LANDING & REDIRECTS
     @app.route("/")
@@ -132,6 +120,14 @@ def create_app():
     app.register_blueprint(wishlist_blueprint, url_prefix='/wishlist')
     app.register_blueprint(friends_blueprint, url_prefix='/friends')
     
+    # Templates pick cover thumbnail sizes with cover_srcset()
+    app.add_template_global(cover_srcset)
+
+    # Uploaded images are served as WebP/AVIF when the browser accepts them;
+    # this rule is more specific than the static route, so url_for('static')
+    # links to uploads land here
+    app.add_url_rule(f"{app.static_url_path}/uploads/<path:filename>", 'uploads', serve_upload)
+
     # Register Error Handlers
     app.register_error_handler(401, unauthorized)
     
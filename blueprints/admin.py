@@ -1,16 +1,48 @@
 from flask import render_template, redirect, url_for, request, flash, Blueprint, current_app, jsonify
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 import bcrypt
+import click
 import os
 from datetime import datetime
-from utils.database import get_db_connection
+from utils.database import get_db_connection, checkpoint_wal
+from utils.stats_utils import get_library_stats
+from utils.isbn_cache_utils import get_isbn_cache_summary, purge_isbn_cache
+from utils.jobs import (create_job, start_job, get_job, get_latest_job, requeue_job, request_cancel,
+                        add_job_items, count_items)
+from utils.image_utils import delete_image_file, reencode_uploads
+from utils.image_processing import save_image_upload, queue_avatar_processing
+from utils.user_cache import invalidate_user
+from utils.social_graph import invalidate_social_graph
+from utils.upload_index import (get_orphan_report, rescan_uploads, run_upload_rescan,
+                                run_orphan_cleanup, image_key, RESCAN_JOB_TYPE, CLEANUP_JOB_TYPE)
+from utils.cover_utils import JOB_TYPE as COVER_JOB_TYPE, missing_cover_book_ids, run_bulk_cover_fetch
 from models import admin_required
-from PIL import Image
 
 admin_blueprint = Blueprint('admin', __name__, template_folder='templates')
 
 
+@admin_blueprint.cli.command('reencode-images')
+@click.option('--force', is_flag=True, help='Re-encode variants that already exist')
+def reencode_images_command(force):
+    """Write WebP/AVIF copies of existing uploads (flask admin reencode-images)"""
+    stats = reencode_uploads(force=force)
+    click.echo(f"Checked {stats['images']} images: wrote {stats['written']} variants, "
+               f"{stats['failed']} failed")
+
+
+@admin_blueprint.cli.command('rescan-uploads')
+@click.option('--full', is_flag=True, help='Stat every file, not just new ones in changed directories')
+def rescan_uploads_command(full):
+    """Update the uploads file index (flask admin rescan-uploads)"""
+    conn = get_db_connection()
+    try:
+        stats = rescan_uploads(conn, full=full)
+    finally:
+        conn.close()
+    click.echo(f"Scanned {stats['dirs_scanned']} directories ({stats['dirs_skipped']} unchanged): "
+               f"{stats['files_added']} files added, {stats['files_removed']} removed")
+
+
 @admin_blueprint.route("/settings")
 @login_required
 @admin_required
@@ -36,11 +68,12 @@ def settings():
             ORDER BY u.username ASC
         """).fetchall()
 
-        # Get system stats
+        # Get system stats (book stats come from the library stats cache)
+        library_stats = get_library_stats(conn)
         stats = {
             'total_users': conn.execute('SELECT COUNT(*) FROM users').fetchone()[0],
             'active_users': conn.execute('SELECT COUNT(*) FROM users WHERE is_active = 1').fetchone()[0],
-            'total_books': conn.execute('SELECT COUNT(*) FROM books').fetchone()[0],
+            'total_books': library_stats['total_books'],
             'admin_users': conn.execute('SELECT COUNT(*) FROM users WHERE is_admin = 1').fetchone()[0]
         }
 
@@ -72,6 +105,8 @@ def settings():
         return render_template('admin_settings.html',
                              users=users,
                              stats=stats,
+                             library_stats=library_stats,
+                             isbn_cache=get_isbn_cache_summary(conn),
                              libraries=libraries)
     finally:
         conn.close()
@@ -159,6 +194,7 @@ def toggle_user():
         new_status = 0 if user['is_active'] else 1
         conn.execute('UPDATE users SET is_active = ? WHERE id = ?', (new_status, user_id))
         conn.commit()
+        invalidate_user(user_id)
 
         status_text = "activated" if new_status else "deactivated"
         flash(f"User '{user['username']}' {status_text}", "success")
@@ -205,7 +241,6 @@ def delete_user():
 
         # Delete user's avatar file if it exists
         if user['avatar_url']:
-            from utils.image_utils import delete_image_file
             delete_image_file(user['avatar_url'])
 
         # Delete user's data (cascading delete)
@@ -217,6 +252,7 @@ def delete_user():
         conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
 
         conn.commit()
+        invalidate_user(user_id)
         flash(f"User '{username}' and all associated data deleted", "success")
         current_app.logger.warning(f"Admin {current_user.username} deleted user: {username}")
 
@@ -259,6 +295,7 @@ def toggle_admin():
         new_status = 0 if user['is_admin'] else 1
         conn.execute('UPDATE users SET is_admin = ? WHERE id = ?', (new_status, user_id))
         conn.commit()
+        invalidate_user(user_id)
 
         status_text = "granted admin privileges to" if new_status else "revoked admin privileges from"
         flash(f"{status_text.capitalize()} user '{user['username']}'", "success")
@@ -302,6 +339,7 @@ def update_user_email():
         # Update email
         conn.execute('UPDATE users SET email = ? WHERE id = ?', (new_email, user_id))
         conn.commit()
+        invalidate_user(user_id)
 
         flash(f"Email updated for user '{user['username']}'", "success")
         current_app.logger.info(f"Admin {current_user.username} updated email for user: {user['username']}")
@@ -396,85 +434,25 @@ def upload_user_avatar():
         if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
             return jsonify({'success': False, 'message': 'Invalid file type'}), 400
 
-        if file:
-            # Secure the filename and create a unique name
-            filename = secure_filename(file.filename)
-            file_ext = filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"user_{user_id}_{int(os.urandom(4).hex(), 16)}.{file_ext}"
-
-            # Create uploads/avatars directory if it doesn't exist
-            avatar_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'avatars')
-            os.makedirs(avatar_folder, exist_ok=True)
-
-            filepath = os.path.join(avatar_folder, unique_filename)
-
-            # Process and resize image
-            try:
-                img = Image.open(file)
-
-                # Fix orientation based on EXIF data
-                try:
-                    from PIL import ImageOps
-                    img = ImageOps.exif_transpose(img)
-                    logger.info(f"Applied EXIF orientation correction")
-                except Exception as e:
-                    logger.warning(f"Could not apply EXIF orientation: {str(e)}")
-
-                # Convert RGBA to RGB if necessary
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-
-                # Resize to a reasonable size (400x400) while maintaining aspect ratio
-                img.thumbnail((400, 400), Image.Resampling.LANCZOS)
-
-                # Save the image
-                img.save(filepath, quality=85, optimize=True)
-                logger.info(f"Image saved to: {filepath}")
-
-            except Exception as e:
-                logger.error(f"Error processing image: {str(e)}")
-                return jsonify({'success': False, 'message': f'Error processing image: {str(e)}'}), 500
-
-            # Get relative path for database storage (use forward slashes for URLs)
-            relative_path = f'uploads/avatars/{unique_filename}'
-
-            conn = get_db_connection()
-            try:
-                # Get old avatar URL to delete old file
-                old_avatar = conn.execute('SELECT avatar_url, username FROM users WHERE id = ?', (user_id,)).fetchone()
-
-                if not old_avatar:
-                    return jsonify({'success': False, 'message': 'User not found'}), 404
-
-                # Update database with new avatar URL
-                conn.execute('UPDATE users SET avatar_url = ? WHERE id = ?', (relative_path, user_id))
-                conn.commit()
-                logger.info(f"Database updated for user {old_avatar['username']}")
-
-                # Delete old avatar file if it exists
-                if old_avatar['avatar_url']:
-                    old_file_path = os.path.join(current_app.root_path, 'static', old_avatar['avatar_url'])
-                    if os.path.exists(old_file_path):
-                        try:
-                            os.remove(old_file_path)
-                            logger.info(f"Deleted old avatar: {old_file_path}")
-                        except Exception as e:
-                            logger.warning(f"Could not delete old avatar: {str(e)}")
-
-                current_app.logger.info(f"Admin {current_user.username} uploaded avatar for user: {old_avatar['username']}")
-
-                return jsonify({
-                    'success': True,
-                    'message': 'Avatar uploaded successfully',
-                    'avatar_url': url_for('static', filename=relative_path)
-                })
-
-            finally:
-                conn.close()
+        conn = get_db_connection()
+        try:
+            user = conn.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if not user:
+            return jsonify({'success': False, 'message': 'User not found'}), 404
+
+        # Resized in the background; the page polls status_url for the result
+        raw_path = save_image_upload(file)
+        job_id = queue_avatar_processing(user_id, raw_path, requested_by=current_user.id)
+        current_app.logger.info(f"Admin {current_user.username} uploaded avatar for user: {user['username']} (job {job_id})")
+
+        return jsonify({
+            'success': True,
+            'message': 'Avatar uploaded, processing...',
+            'job_id': job_id,
+            'status_url': url_for('user.image_status', job_id=job_id)
+        }), 202
 
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
@@ -509,17 +487,13 @@ def remove_user_avatar():
 
             # Delete avatar file if it exists
             if user['avatar_url']:
-                old_file_path = os.path.join(current_app.root_path, 'static', user['avatar_url'])
-                if os.path.exists(old_file_path):
-                    try:
-                        os.remove(old_file_path)
-                        current_app.logger.info(f"Deleted avatar file: {old_file_path}")
-                    except Exception as e:
-                        current_app.logger.warning(f"Could not delete avatar file: {str(e)}")
+                # Removes its WebP/AVIF copies too
+                delete_image_file(user['avatar_url'])
 
             # Update database to remove avatar URL
             conn.execute('UPDATE users SET avatar_url = NULL WHERE id = ?', (user_id,))
             conn.commit()
+            invalidate_user(user_id)
 
             current_app.logger.info(f"Admin {current_user.username} removed avatar for user: {user['username']}")
 
@@ -540,27 +514,56 @@ def remove_user_avatar():
 @login_required
 @admin_required
 def orphaned_images():
-    """Display orphaned images that can be cleaned up"""
+    """Display orphaned images that can be cleaned up (read from the uploads index)"""
     conn = get_db_connection()
     try:
-        from utils.image_utils import find_orphaned_images
-        orphaned_data = find_orphaned_images(conn)
+        orphaned_data = get_orphan_report(conn)
+        rescan_job = get_latest_job(conn, RESCAN_JOB_TYPE)
+        cleanup_job = get_latest_job(conn, CLEANUP_JOB_TYPE)
+
+        # Build the index the first time the page is opened
+        if orphaned_data['last_scan'] is None and not (rescan_job and rescan_job['status'] in ('queued', 'running')):
+            job_id = create_job(conn, RESCAN_JOB_TYPE, user_id=current_user.id)
+            start_job(job_id, run_upload_rescan)
+            rescan_job = get_job(conn, job_id)
 
         return render_template(
             'admin/orphaned_images.html',
             orphaned_files=orphaned_data['orphaned_files'],
             total_size_mb=orphaned_data['total_size_mb'],
-            count=orphaned_data['count']
+            count=orphaned_data['count'],
+            last_scan=orphaned_data['last_scan'],
+            rescan_job=rescan_job,
+            cleanup_job=cleanup_job
         )
     finally:
         conn.close()
 
 
+@admin_blueprint.route("/rescan_uploads", methods=["POST"])
+@login_required
+@admin_required
+def rescan_uploads_route():
+    """Start a background rescan of static/uploads"""
+    conn = get_db_connection()
+    try:
+        job = get_latest_job(conn, RESCAN_JOB_TYPE)
+        if job and job['status'] in ('queued', 'running'):
+            flash("A rescan is already running", "info")
+        else:
+            job_id = create_job(conn, RESCAN_JOB_TYPE, user_id=current_user.id)
+            start_job(job_id, run_upload_rescan, request.form.get('full') == '1')
+            flash("Rescan started", "success")
+    finally:
+        conn.close()
+    return redirect(url_for('admin.orphaned_images'))
+
+
 @admin_blueprint.route("/cleanup_orphaned_images", methods=["POST"])
 @login_required
 @admin_required
 def cleanup_orphaned_images():
-    """Delete selected orphaned image files"""
+    """Delete selected orphaned images in a background job"""
     try:
         # Get list of files to delete from form
         files_to_delete = request.form.getlist('files[]')
@@ -569,18 +572,17 @@ def cleanup_orphaned_images():
             flash("No files selected for deletion", "warning")
             return redirect(url_for('admin.orphaned_images'))
 
-        from utils.image_utils import cleanup_orphaned_images
-        result = cleanup_orphaned_images(files_to_delete)
-
-        if result['deleted'] > 0:
-            flash(f"Successfully deleted {result['deleted']} orphaned image(s)", "success")
+        keys = list(dict.fromkeys(image_key(path) for path in files_to_delete))
 
-        if result['failed'] > 0:
-            flash(f"Failed to delete {result['failed']} file(s)", "error")
-            for error in result['errors']:
-                current_app.logger.error(error)
+        conn = get_db_connection()
+        try:
+            job_id = create_job(conn, CLEANUP_JOB_TYPE, user_id=current_user.id, total=len(keys))
+        finally:
+            conn.close()
+        start_job(job_id, run_orphan_cleanup, keys)
 
-        current_app.logger.info(f"Admin {current_user.username} cleaned up {result['deleted']} orphaned images")
+        current_app.logger.info(f"Admin {current_user.username} started cleanup of {len(keys)} orphaned images")
+        flash(f"Deleting {len(keys)} orphaned image(s) in the background", "success")
 
         return redirect(url_for('admin.orphaned_images'))
 
@@ -590,6 +592,51 @@ def cleanup_orphaned_images():
         return redirect(url_for('admin.orphaned_images'))
 
 
+@admin_blueprint.route("/checkpoint_database", methods=["POST"])
+@login_required
+@admin_required
+def checkpoint_database():
+    """Fold the SQLite write-ahead log back into the main database file"""
+    try:
+        result = checkpoint_wal('TRUNCATE')
+
+        if result['busy']:
+            flash("Checkpoint partially completed; the database was busy. Try again shortly.", "warning")
+        else:
+            flash(f"Database checkpoint complete ({result['checkpointed_pages']} pages written)", "success")
+
+        current_app.logger.info(f"Admin {current_user.username} ran WAL checkpoint: {result}")
+
+    except Exception as e:
+        current_app.logger.error(f"Error running WAL checkpoint: {str(e)}")
+        flash("Error running database checkpoint", "error")
+
+    return redirect(url_for('admin.settings'))
+
+
+@admin_blueprint.route("/purge_isbn_cache", methods=["POST"])
+@login_required
+@admin_required
+def purge_isbn_cache_route():
+    """Clear cached ISBN lookups so they are fetched from the providers again"""
+    expired_only = request.form.get('expired_only') == '1'
+    conn = get_db_connection()
+    try:
+        deleted = purge_isbn_cache(conn, expired_only=expired_only)
+        flash(f"Removed {deleted} cached ISBN lookup(s)", "success")
+        current_app.logger.info(
+            f"Admin {current_user.username} purged {'expired ' if expired_only else ''}ISBN cache: {deleted} entries"
+        )
+
+    except Exception as e:
+        current_app.logger.error(f"Error purging ISBN cache: {str(e)}")
+        flash("Error purging ISBN cache", "error")
+    finally:
+        conn.close()
+
+    return redirect(url_for('admin.settings'))
+
+
 @admin_blueprint.route("/missing_covers_count")
 @login_required
 @admin_required
@@ -615,69 +662,84 @@ def missing_covers_count():
 @login_required
 @admin_required
 def bulk_fetch_covers():
-    """Bulk fetch missing book covers from Google Books API"""
-    import logging
-    logger = logging.getLogger(__name__)
-
+    """Start (or resume) a background job fetching covers for every book missing one"""
     conn = get_db_connection()
     try:
-        # Get all books without covers (limit to 50 at a time to avoid timeout)
-        books = conn.execute("""
-            SELECT id, title, author, isbn
-            FROM books
-            WHERE (cover_image_url IS NULL OR cover_image_url = '')
-            AND isbn IS NOT NULL AND isbn != ''
-            LIMIT 50
-        """).fetchall()
-
-        stats = {
-            'books_processed': 0,
-            'covers_found': 0,
-            'covers_failed': 0
-        }
+        job = get_latest_job(conn, COVER_JOB_TYPE)
+
+        if job and job['status'] in ('queued', 'running'):
+            # Only one bulk fetch at a time; report the one in progress
+            job_id = job['id']
+        elif job and job['status'] == 'failed' and count_items(conn, job['id'])['pending']:
+            # The last run was interrupted (e.g. a restart); carry on where it stopped
+            job_id = job['id']
+            requeue_job(conn, job_id)
+            start_job(job_id, run_bulk_cover_fetch)
+            current_app.logger.info(f"Admin {current_user.username} resumed bulk cover job {job_id}")
+        else:
+            book_ids = missing_cover_book_ids(conn)
+            if not book_ids:
+                return jsonify({'success': True, 'job_id': None, 'message': 'No books need covers'})
 
-        from utils.book_utils import fetch_book_details_from_isbn
+            job_id = create_job(conn, COVER_JOB_TYPE, user_id=current_user.id)
+            add_job_items(conn, job_id, book_ids)
+            start_job(job_id, run_bulk_cover_fetch)
+            current_app.logger.info(
+                f"Admin {current_user.username} started bulk cover job {job_id} for {len(book_ids)} books"
+            )
 
-        for book in books:
-            stats['books_processed'] += 1
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('admin.bulk_fetch_covers_status', job_id=job_id),
+            'cancel_url': url_for('admin.cancel_bulk_fetch_covers', job_id=job_id)
+        }), 202
 
-            try:
-                logger.info(f"Fetching cover for: {book['title']} (ISBN: {book['isbn']})")
+    except Exception as e:
+        current_app.logger.error(f"Bulk cover fetch error: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        conn.close()
 
-                # Fetch book data from API
-                book_data = fetch_book_details_from_isbn(book['isbn'])
 
-                if book_data and book_data.get('local_cover_url'):
-                    # Update book with new cover URL
-                    conn.execute(
-                        'UPDATE books SET cover_image_url = ? WHERE id = ?',
-                        (book_data['local_cover_url'], book['id'])
-                    )
-                    stats['covers_found'] += 1
-                    logger.info(f"✓ Cover found for: {book['title']}")
-                else:
-                    stats['covers_failed'] += 1
-                    logger.warning(f"✗ No cover found for: {book['title']}")
+@admin_blueprint.route("/bulk_fetch_covers/<int:job_id>")
+@login_required
+@admin_required
+def bulk_fetch_covers_status(job_id):
+    """Report the progress of a bulk cover job"""
+    conn = get_db_connection()
+    try:
+        job = get_job(conn, job_id)
+    finally:
+        conn.close()
 
-            except Exception as e:
-                stats['covers_failed'] += 1
-                logger.error(f"Error fetching cover for '{book['title']}': {str(e)}")
-                continue
+    if not job or job['job_type'] != COVER_JOB_TYPE:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
 
-        conn.commit()
+    return jsonify({
+        'success': job['status'] != 'failed',
+        'status': job['status'],
+        'processed': job['processed'],
+        'total': job['total'],
+        'stats': job['result'],
+        'message': job['message']
+    })
 
-        logger.info(f"Bulk cover fetch complete: {stats}")
-        current_app.logger.info(f"Admin {current_user.username} fetched {stats['covers_found']} covers")
 
-        return jsonify({
-            'success': True,
-            **stats
-        })
+@admin_blueprint.route("/bulk_fetch_covers/<int:job_id>/cancel", methods=["POST"])
+@login_required
+@admin_required
+def cancel_bulk_fetch_covers(job_id):
+    """Ask a running bulk cover job to stop after the books in flight"""
+    conn = get_db_connection()
+    try:
+        job = get_job(conn, job_id)
+        if not job or job['job_type'] != COVER_JOB_TYPE:
+            return jsonify({'success': False, 'message': 'Job not found'}), 404
 
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Bulk cover fetch error: {str(e)}", exc_info=True)
-        return jsonify({'success': False, 'message': str(e)}), 500
+        request_cancel(conn, job_id)
+        current_app.logger.info(f"Admin {current_user.username} cancelled bulk cover job {job_id}")
+        return jsonify({'success': True})
     finally:
         conn.close()
 
@@ -724,6 +786,7 @@ def add_library_member():
         """, (library_id, user_id, current_user.id))
 
         conn.commit()
+        invalidate_social_graph()
         flash(f"User '{user['username']}' added to library group {library_id}", "success")
         current_app.logger.info(
             f"Admin {current_user.username} added user {user['username']} to library {library_id}"
@@ -767,6 +830,7 @@ def remove_library_member():
 
         if result.rowcount > 0:
             conn.commit()
+            invalidate_social_graph()
             flash(f"User '{user['username']}' removed from library group", "success")
             current_app.logger.info(
                 f"Admin {current_user.username} removed user {user['username']} from library"
@@ -5,6 +5,7 @@ import bcrypt
 import sqlite3
 from utils.database import get_db_connection
 from utils.email_utils import send_verification_email, verify_token, resend_verification_email
+from utils.notification_utils import publish_counts
 from models import admin_required, User
 
 auth_blueprint = Blueprint('auth', __name__, template_folder='templates')
@@ -141,13 +142,20 @@ def login():
                     for notif in unread_notifications:
                         flash(notif['message'], 'info')
 
-                    # Mark all as read
+                    # Mark all as read (badge-counted ones first, so the
+                    # badge can be adjusted by how many there were)
                     if unread_notifications:
+                        counted = conn.execute("""
+                            UPDATE notifications
+                            SET is_read = 1
+                            WHERE user_id = ? AND is_read = 0 AND type != 'friend_request'
+                        """, (user_obj.id,)).rowcount
                         conn.execute("""
                             UPDATE notifications
                             SET is_read = 1
                             WHERE user_id = ? AND is_read = 0
                         """, (user_obj.id,))
+                        publish_counts(conn, user_obj.id, notifications=-counted)
                         conn.commit()
                 finally:
                     conn.close()
@@ -1,59 +1,14 @@
 from flask import render_template, redirect, url_for, request, Blueprint, jsonify
 from flask_login import login_required, current_user
 from utils.database import get_db_connection
+from utils.pagination_utils import paginate_books
 from datetime import datetime
-from utils.book_utils import get_filter_options
+from utils.facet_utils import get_filter_facets
+from utils.image_utils import cover_srcset
 from models import get_library_members, is_friends_with, can_view_content
 
 base_blueprint = Blueprint('base', __name__, template_folder='templates')
 
-def get_filter_options():
-    """Get all filter options from the database"""
-    conn = get_db_connection()
-    try:
-        # Get unique genres (case-insensitive)
-        genres = conn.execute('''
-            SELECT genre
-            FROM books
-            WHERE genre IS NOT NULL
-            GROUP BY LOWER(genre)
-            ORDER BY LOWER(genre)
-        ''').fetchall()
-        
-        # Get unique read statuses
-        read_statuses = conn.execute('''
-            SELECT DISTINCT status 
-            FROM collections 
-            WHERE status IS NOT NULL 
-            ORDER BY status
-        ''').fetchall()
-        
-        # Get all tags
-        tags = conn.execute('''
-            SELECT DISTINCT tag_name 
-            FROM book_tags 
-            WHERE tag_name IS NOT NULL 
-            ORDER BY tag_name
-        ''').fetchall()
-
-        # Create date range options
-        date_ranges = [
-            {"value": "all", "label": "All Time"},
-            {"value": "this_year", "label": "This Year"},
-            {"value": "last_year", "label": "Last Year"},
-            {"value": "older", "label": "Older"}
-        ]
-
-        return {
-            "genres": [genre[0] for genre in genres],
-            "read_statuses": [status[0] for status in read_statuses],
-            "tags": [tag[0] for tag in tags],
-            "date_ranges": date_ranges,
-            "ratings": list(range(1, 6))  # 1 to 5 stars
-        }
-    finally:
-        conn.close()
-
 @base_blueprint.route("/")
 def home():
     if current_user.is_authenticated:
@@ -119,18 +74,10 @@ def index():
                 params.append(current_user.id)
                 params.extend(valid_tags_in_request)
 
-        # Get total count before pagination
-        count_query = query.replace("SELECT b.*", "SELECT COUNT(b.id)")
-        total_count = conn.execute(count_query, params).fetchone()[0]
-
-        # Add sorting and pagination
-        query += f" ORDER BY b.{sort_by} {sort_order} LIMIT ? OFFSET ?"
-        offset = (page - 1) * per_page
-        params.extend([per_page, offset])
-
-        # Get paginated books
-        books = conn.execute(query, params).fetchall()
-        has_more = (offset + len(books)) < total_count
+        # Sort and paginate; infinite scroll pages continue from a cursor
+        books, total_count, has_more, next_cursor, page = paginate_books(
+            conn, query, params, f"b.{sort_by}", sort_order, per_page,
+            page=page, cursor=request.args.get("cursor"))
 
         # Handle AJAX requests for infinite scroll
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -138,18 +85,20 @@ def index():
                 'id': book['id'],
                 'title': book['title'],
                 'author': book['author'],
-                'cover_image_url': book['cover_image_url']
+                'cover_image_url': book['cover_image_url'],
+                'cover_srcset': cover_srcset(book['cover_image_url'])
             } for book in books]
 
             return jsonify({
                 'books': books_data,
                 'total_count': total_count,
                 'has_more': has_more,
-                'current_page': page
+                'current_page': page,
+                'next_cursor': next_cursor
             })
 
         # Get filter options for the template
-        filter_options = get_filter_options()
+        filter_options = get_filter_facets(conn, current_user.id, [current_user.id])
 
         return render_template("index.html",
                              books=books,
@@ -158,7 +107,8 @@ def index():
                              sort_order=sort_order,
                              total_count=total_count,
                              has_more=has_more,
-                             current_page=page)
+                             current_page=page,
+                             next_cursor=next_cursor)
     finally:
         conn.close()
 
@@ -233,17 +183,10 @@ def shared_library():
                 params.append(current_user.id)
                 params.extend(valid_tags_in_request)
 
-        # Get total count
-        count_query = query.replace("SELECT b.*", "SELECT COUNT(b.id)")
-        total_count = conn.execute(count_query, params).fetchone()[0]
-
-        # Add sorting and pagination
-        query += f" ORDER BY b.{sort_by} {sort_order} LIMIT ? OFFSET ?"
-        offset = (page - 1) * per_page
-        params.extend([per_page, offset])
-
-        books = conn.execute(query, params).fetchall()
-        has_more = (offset + len(books)) < total_count
+        # Sort and paginate; infinite scroll pages continue from a cursor
+        books, total_count, has_more, next_cursor, page = paginate_books(
+            conn, query, params, f"b.{sort_by}", sort_order, per_page,
+            page=page, cursor=request.args.get("cursor"))
 
         # Handle AJAX requests
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -251,14 +194,16 @@ def shared_library():
                 'id': book['id'],
                 'title': book['title'],
                 'author': book['author'],
-                'cover_image_url': book['cover_image_url']
+                'cover_image_url': book['cover_image_url'],
+                'cover_srcset': cover_srcset(book['cover_image_url'])
             } for book in books]
 
             return jsonify({
                 'books': books_data,
                 'total_count': total_count,
                 'has_more': has_more,
-                'current_page': page
+                'current_page': page,
+                'next_cursor': next_cursor
             })
 
         # Get shared library members for display (always get all members, not filtered)
@@ -271,7 +216,7 @@ def shared_library():
                 all_library_members
             ).fetchall()
 
-        filter_options = get_filter_options()
+        filter_options = get_filter_facets(conn, current_user.id, shared_user_ids)
 
         return render_template("shared_library.html",
                              books=books,
@@ -281,6 +226,7 @@ def shared_library():
                              total_count=total_count,
                              has_more=has_more,
                              current_page=page,
+                             next_cursor=next_cursor,
                              shared_members=shared_members,
                              member_filter=member_filter)
     finally:
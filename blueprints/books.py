@@ -2,10 +2,17 @@ from flask import render_template, redirect, url_for, request, flash, Blueprint,
 from flask_login import login_required, current_user
 from typing import Optional, Dict, Any
 from utils.database import get_db_connection
+from utils.search_utils import build_fts_query, BM25_RANK
+from utils.pagination_utils import paginate_books
+from utils.activity_utils import record_activity
+from utils.stats_utils import invalidate_library_stats
+from utils.image_utils import cover_srcset, create_thumbnails, delete_image_file
+from utils.cover_store import discard_cover, import_cover_file, is_stored_cover
+from utils.image_processing import queue_cover_processing
+from utils.facet_utils import get_filter_facets
 from utils.book_utils import (
-    get_filter_options,
     fetch_book_details_from_isbn,
-    process_image,
+    save_cover_upload,
     download_and_save_cover,
     search_google_books,
     search_covers_multiple_sources,
@@ -13,10 +20,67 @@ from utils.book_utils import (
     MAX_IMAGE_SIZE
 )
 from models import admin_required, shares_library_with, get_library_members
+import click
 
 books_blueprint = Blueprint('books', __name__, template_folder='templates')
 
 
+@books_blueprint.cli.command('backfill-thumbnails')
+@click.option('--force', is_flag=True, help='Regenerate thumbnails that already exist')
+def backfill_thumbnails_command(force):
+    """Generate cover thumbnails for existing uploads (flask books backfill-thumbnails)"""
+    conn = get_db_connection()
+    try:
+        covers = [row['cover_image_url'] for row in conn.execute(
+            "SELECT DISTINCT cover_image_url FROM books WHERE cover_image_url LIKE 'uploads/%'"
+        )]
+    finally:
+        conn.close()
+
+    written = failed = 0
+    for cover in covers:
+        try:
+            written += create_thumbnails(cover, force=force)
+        except Exception as e:
+            failed += 1
+            click.echo(f"Failed: {cover}: {e}", err=True)
+    click.echo(f"Checked {len(covers)} covers: wrote {written} thumbnails, {failed} failed")
+
+
+@books_blueprint.cli.command('dedupe-covers')
+def dedupe_covers_command():
+    """Move per-book cover files into the shared cover store (flask books dedupe-covers)"""
+    conn = get_db_connection()
+    try:
+        legacy = [row[0] for row in conn.execute("""
+            SELECT cover_image_url FROM books WHERE cover_image_url LIKE 'uploads/%'
+            UNION
+            SELECT local_cover_url FROM isbn_cache WHERE local_cover_url LIKE 'uploads/%'
+        """) if not is_stored_cover(row[0])]
+
+        moved = missing = 0
+        for old_path in legacy:
+            try:
+                new_path = import_cover_file(old_path)
+            except Exception as e:
+                click.echo(f"Failed: {old_path}: {e}", err=True)
+                continue
+            if not new_path:
+                missing += 1
+                continue
+
+            conn.execute('UPDATE books SET cover_image_url = ? WHERE cover_image_url = ?', (new_path, old_path))
+            conn.execute('UPDATE isbn_cache SET local_cover_url = ? WHERE local_cover_url = ?', (new_path, old_path))
+            conn.commit()
+            delete_image_file(old_path)
+            moved += 1
+
+        stored = conn.execute('SELECT COUNT(*) FROM cover_files').fetchone()[0]
+    finally:
+        conn.close()
+    click.echo(f"Moved {moved} covers into the store ({stored} distinct files), {missing} missing on disk")
+
+
 @books_blueprint.route("/add", methods=["GET", "POST"])
 @login_required
 def add_book():
@@ -53,11 +117,14 @@ def add_book():
                     flash("Book not found. Please enter details manually.", "error")
                     
         elif "submit_book" in request.form:
-            # Process uploaded image or use downloaded cover
-            cover_image_url = process_image(
-                request.files.get("image"),
-                request.form.get("existing_cover_url")
-            )
+            # Uploaded images are processed in the background and replace
+            # the downloaded cover (if any) when done
+            try:
+                cover_upload = save_cover_upload(request.files.get("image"))
+            except ValueError as e:
+                cover_upload = None
+                flash(f"{e}; the book was saved without it.", "error")
+            cover_image_url = request.form.get("existing_cover_url")
 
             # Sanitize page_count: convert to integer or default to 0 if invalid
             page_count_raw = request.form.get("page_count", "").strip()
@@ -70,7 +137,7 @@ def add_book():
                 page_count = 0
 
             with get_db_connection() as conn:
-                conn.execute("""
+                cursor = conn.execute("""
                     INSERT INTO books (title, author, publisher, publish_year, isbn,
                                      page_count, cover_image_url, description, subtitle, genre, added_by)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -87,8 +154,14 @@ def add_book():
                     request.form["genre"],
                     current_user.id
                 ))
+                book_id = cursor.lastrowid
+                record_activity(conn, current_user.id, 'book_added', book_id)
+                invalidate_library_stats(conn)
 
             flash("Book added successfully!", "success")
+            if cover_upload:
+                queue_cover_processing(book_id, cover_upload, user_id=current_user.id)
+                flash("The cover is being processed and will appear shortly.", "info")
             return redirect(url_for("base.index"))
 
     return render_template(
@@ -383,18 +456,20 @@ def edit_book(id):
                 # Check if a cover was fetched via the fetch cover button
                 fetched_cover = request.form.get("fetched_cover_url")
 
-                # Priority: uploaded image > fetched cover > existing cover
-                if request.files.get("image") and request.files.get("image").filename != '':
-                    # User uploaded a new image - delete old cover first
-                    if current_cover:
-                        from utils.image_utils import delete_image_file
-                        delete_image_file(current_cover)
-                    cover_image_url = process_image(request.files.get("image"), current_cover)
+                # Priority: uploaded image > fetched cover > existing cover.
+                # An uploaded image is processed in the background, which
+                # lets go of the old cover once the new one is set
+                try:
+                    cover_upload = save_cover_upload(request.files.get("image"))
+                except ValueError as e:
+                    cover_upload = None
+                    flash(f"{e}; the other changes were saved.", "error")
+                if cover_upload:
+                    cover_image_url = current_cover
                 elif fetched_cover:
-                    # User fetched a new cover - delete old cover first
+                    # User fetched a new cover - let go of the old cover first
                     if current_cover and current_cover != fetched_cover:
-                        from utils.image_utils import delete_image_file
-                        delete_image_file(current_cover)
+                        discard_cover(current_cover)
                     cover_image_url = fetched_cover
                 else:
                     # Keep existing cover
@@ -427,8 +502,13 @@ def edit_book(id):
                     request.form["genre"],
                     id
                 ))
+                invalidate_library_stats(conn)
+                conn.commit()
 
                 flash("Book updated successfully!", "success")
+                if cover_upload:
+                    queue_cover_processing(id, cover_upload, user_id=current_user.id)
+                    flash("The new cover is being processed and will appear shortly.", "info")
                 return redirect(url_for("base.index"))
 
     return render_template("edit_book.html", book=book, book_details=book_details)
@@ -609,12 +689,13 @@ def delete_book(id):
 
         # Allow deletion if user is admin or if they added the book
         if current_user.is_admin or book['added_by'] == current_user.id:
-            # Delete the cover image file if it exists
+            # Delete the cover image file if no other book shares it
             if book['cover_image_url']:
-                from utils.image_utils import delete_image_file
-                delete_image_file(book['cover_image_url'])
+                discard_cover(book['cover_image_url'])
 
             conn.execute("DELETE FROM books WHERE id = ?", (id,))
+            conn.execute("DELETE FROM activities WHERE book_id = ?", (id,))
+            invalidate_library_stats(conn)
             flash("Book deleted successfully.", "success")
         else:
             flash("You don't have permission to delete this book.", "error")
@@ -631,13 +712,18 @@ def search():
     # Get search term
     search_term = request.args.get("search_term", "").strip()
 
-    # Get sort parameters with validation
-    sort_by = request.args.get("sort_by", "title")
+    # Turn the search box input into an FTS5 query (None when there's nothing to match)
+    fts_query = build_fts_query(search_term)
+
+    # Get sort parameters with validation; text searches default to best match first
+    sort_by = request.args.get("sort_by", "relevance" if fts_query else "title")
     sort_order = request.args.get("sort_order", "asc")
 
     valid_columns = {"title", "author", "publish_year", "created_at"}
     valid_orders = {"asc", "desc"}
 
+    if fts_query:
+        valid_columns.add("relevance")
     if sort_by not in valid_columns:
         sort_by = "title"
     if sort_order not in valid_orders:
@@ -653,14 +739,23 @@ def search():
 
         # Search only books from current user or their library members
         placeholders = ','.join(['?' for _ in library_member_ids])
-        query = f'''
-            SELECT b.* FROM books b
-            WHERE b.added_by IN ({placeholders})
-            AND NOT EXISTS (SELECT 1 FROM wishlist w WHERE w.book_id = b.id)
-            AND (LOWER(b.title) LIKE LOWER(?) OR LOWER(b.author) LIKE LOWER(?) OR CAST(b.publish_year AS TEXT) LIKE ?)
-        '''
-        search_like = f"%{search_term}%"
-        params = library_member_ids + [search_like, search_like, search_like]
+        if fts_query:
+            # Matching rows come straight from the books_fts index
+            query = f'''
+                SELECT b.* FROM books_fts
+                JOIN books b ON b.id = books_fts.rowid
+                WHERE books_fts MATCH ?
+                AND b.added_by IN ({placeholders})
+                AND NOT EXISTS (SELECT 1 FROM wishlist w WHERE w.book_id = b.id)
+            '''
+            params = [fts_query] + library_member_ids
+        else:
+            query = f'''
+                SELECT b.* FROM books b
+                WHERE b.added_by IN ({placeholders})
+                AND NOT EXISTS (SELECT 1 FROM wishlist w WHERE w.book_id = b.id)
+            '''
+            params = list(library_member_ids)
 
         # Apply filters if they exist (simplified)
         if request.args.get('genre'):
@@ -689,18 +784,12 @@ def search():
                 params.append(current_user.id)
                 params.extend(valid_tags_in_request)
 
-        # Get total count before pagination
-        count_query = query.replace("SELECT b.*", "SELECT COUNT(b.id)")
-        total_count = conn.execute(count_query, params).fetchone()[0]
-
-        # Add sorting and pagination
-        query += f" ORDER BY b.{sort_by} {sort_order} LIMIT ? OFFSET ?"
-        offset = (page - 1) * per_page
-        params.extend([per_page, offset])
-
-        # Get paginated books
-        books = conn.execute(query, params).fetchall()
-        has_more = (offset + len(books)) < total_count
+        # Sort and paginate (bm25 scores are lower for better matches);
+        # infinite scroll pages continue from a cursor
+        sort_expr = BM25_RANK if sort_by == "relevance" else f"b.{sort_by}"
+        books, total_count, has_more, next_cursor, page = paginate_books(
+            conn, query, params, sort_expr, sort_order, per_page,
+            page=page, cursor=request.args.get("cursor"))
 
         # Handle AJAX requests for infinite scroll
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -708,18 +797,20 @@ def search():
                 'id': book['id'],
                 'title': book['title'],
                 'author': book['author'],
-                'cover_image_url': book['cover_image_url']
+                'cover_image_url': book['cover_image_url'],
+                'cover_srcset': cover_srcset(book['cover_image_url'])
             } for book in books]
 
             return jsonify({
                 'books': books_data,
                 'total_count': total_count,
                 'has_more': has_more,
-                'current_page': page
+                'current_page': page,
+                'next_cursor': next_cursor
             })
 
         # Get filter options for the template
-        filter_options = get_filter_options()
+        filter_options = get_filter_facets(conn, current_user.id, library_member_ids, any_wishlist=True)
 
         return render_template("search.html",
                              books=books,
@@ -729,7 +820,8 @@ def search():
                              search_term=search_term,
                              total_count=total_count,
                              has_more=has_more,
-                             current_page=page)
+                             current_page=page,
+                             next_cursor=next_cursor)
     finally:
         conn.close()
 
@@ -1,5 +1,7 @@
 from flask import Blueprint, request, redirect, url_for, flash, render_template, g, jsonify
 from utils.database import get_db_connection
+from utils.activity_utils import record_collection_status
+from models import visible_sql
 from flask_login import login_required, current_user
 
 collections_blueprint = Blueprint('collections', __name__, template_folder='templates')
@@ -230,7 +232,8 @@ def add_to_status_collection():
                 INSERT INTO collections (user_id, book_id, status, created_at, updated_at)
                 VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
             ''', (current_user.id, book_id, status))
-        
+
+        record_collection_status(conn, current_user.id, book_id, status)
         conn.commit()
         flash('Collection updated successfully!', 'success')
         
@@ -272,13 +275,14 @@ def view_by_status(status):
                 flash('You must be friends to view this shelf!', 'warning')
                 return redirect(url_for('user.profile', username=username))
 
-        # Fetch books for the target user
-        cursor = conn.execute('''
+        # Fetch books for the target user, leaving out the ones they keep private
+        visible, visible_params = visible_sql(current_user.id, 'c.user_id', 'c.privacy')
+        cursor = conn.execute(f'''
             SELECT b.id, b.title, b.author, b.cover_image_url
             FROM collections c
             JOIN books b ON c.book_id = b.id
-            WHERE c.user_id = ? AND c.status = ?
-        ''', (target_user_id, status))
+            WHERE c.user_id = ? AND c.status = ? AND {visible}
+        ''', [target_user_id, status] + visible_params)
         books = cursor.fetchall()
 
         return render_template('collection_status.html',
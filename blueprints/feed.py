@@ -1,246 +1,158 @@
 from flask import render_template, Blueprint, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from utils.database import get_db_connection
-from models import is_friends_with
+from utils.activity_utils import remove_activity
+from utils.pagination_utils import encode_cursor, decode_cursor
+from utils.notification_utils import publish_counts
+from models import get_friend_ids, visible_sql
 
 feed_blueprint = Blueprint('feed', __name__, template_folder='templates')
 
+# Activities shown per page of the feed
+FEED_PAGE_SIZE = 30
+
 
 @feed_blueprint.route("/activity")
 @login_required
 def activity_feed():
     """Display a social feed of recent book additions and reviews"""
+    # Only show activities from friends or own activities; resolve the friend
+    # set once and filter in SQL rather than checking each activity
+    visible_user_ids = [current_user.id] + get_friend_ids(current_user.id)
+    placeholders = ','.join(['?' for _ in visible_user_ids])
+    # Wishlist and shelf activities follow the privacy of the entry behind them
+    wishlist_visible, wishlist_params = visible_sql(current_user.id, 'w.user_id', 'w.privacy')
+    shelf_visible, shelf_params = visible_sql(current_user.id, 'c.user_id', 'c.privacy')
+
     conn = get_db_connection()
     try:
-        # Fetch recent book additions to main library (last 20)
-        # Only show books added directly to library (not through wishlist)
-        # Exclude dismissed activities
-        recent_books = conn.execute("""
+        # Activities are written as they happen (utils.activity_utils), so the
+        # feed is one range read over the activities table; dismissed
+        # activities are removed from it when they are dismissed
+        query = f"""
             SELECT
-                b.id,
+                a.id,
+                a.activity_type,
+                a.book_id,
+                a.user_id,
+                a.status,
+                a.created_at,
                 b.title,
                 b.author,
                 b.cover_image_url,
-                b.created_at,
                 b.genre,
-                b.added_by,
-                u.username,
-                'book_added' as activity_type
-            FROM books b
-            LEFT JOIN users u ON b.added_by = u.id
-            WHERE b.id NOT IN (
-                SELECT book_id FROM wishlist
-            )
-            AND NOT EXISTS (
-                SELECT 1 FROM dismissed_activities da
-                WHERE da.activity_type = 'book_added'
-                AND da.book_id = b.id
-                AND da.user_id = b.added_by
-            )
-            ORDER BY b.created_at DESC
-            LIMIT 20
-        """).fetchall()
-
-        # Fetch recent wishlist additions (last 20)
-        # Exclude dismissed activities
-        recent_wishlist = conn.execute("""
-            SELECT
-                w.book_id,
-                w.user_id,
-                w.added_at,
-                b.title,
-                b.author,
-                b.cover_image_url,
-                b.genre,
-                u.username,
-                'wishlist_added' as activity_type
-            FROM wishlist w
-            JOIN books b ON w.book_id = b.id
-            JOIN users u ON w.user_id = u.id
-            WHERE NOT EXISTS (
-                SELECT 1 FROM dismissed_activities da
-                WHERE da.activity_type = 'wishlist_added'
-                AND da.book_id = w.book_id
-                AND da.user_id = w.user_id
-            )
-            ORDER BY w.added_at DESC
-            LIMIT 20
-        """).fetchall()
-
-        # Fetch recent collections additions (books moved to library from wishlist or status changes)
-        # Exclude dismissed activities
-        recent_collections = conn.execute("""
-            SELECT
-                c.collection_id,
-                c.user_id,
-                c.book_id,
-                c.status,
-                c.created_at,
-                b.title,
-                b.author,
-                b.cover_image_url,
                 u.username,
-                'collection_added' as activity_type
-            FROM collections c
-            JOIN books b ON c.book_id = b.id
-            JOIN users u ON c.user_id = u.id
-            WHERE c.status IN ('currently reading', 'want to read')
-            AND NOT EXISTS (
-                SELECT 1 FROM dismissed_activities da
-                WHERE da.activity_type = 'collection_added'
-                AND da.book_id = c.book_id
-                AND da.user_id = c.user_id
-            )
-            ORDER BY c.created_at DESC
-            LIMIT 20
-        """).fetchall()
-
-        # Fetch recent reviews/ratings (last 20)
-        # Exclude dismissed activities
-        recent_reviews = conn.execute("""
-            SELECT
-                r.user_id,
-                r.book_id,
-                (SELECT MAX(date_completed) FROM reading_sessions
-                 WHERE book_id = r.book_id AND user_id = r.user_id) as date_read,
                 r.rating,
-                r.comment,
-                b.title,
-                b.author,
-                b.cover_image_url,
-                u.username,
-                'review_added' as activity_type
-            FROM read_data r
-            JOIN books b ON r.book_id = b.id
-            JOIN users u ON r.user_id = u.id
-            WHERE (r.rating IS NOT NULL OR r.comment IS NOT NULL)
-            AND NOT EXISTS (
-                SELECT 1 FROM dismissed_activities da
-                WHERE da.activity_type = 'review_added'
-                AND da.book_id = r.book_id
-                AND da.user_id = r.user_id
-            )
-            ORDER BY date_read DESC
-            LIMIT 20
-        """).fetchall()
-
-        # Combine and sort all activities by date
-        activities = []
-
-        for book in recent_books:
-            # Get like count for this activity
-            like_data = conn.execute("""
-                SELECT COUNT(*) as like_count,
-                       COALESCE(SUM(CASE WHEN liker_user_id = ? THEN 1 ELSE 0 END), 0) as user_liked
-                FROM activity_likes
-                WHERE activity_type = 'book_added' AND book_id = ? AND activity_user_id = ?
-            """, (current_user.id, book['id'], book['added_by'])).fetchone()
-
-            activities.append({
-                'type': 'book_added',
-                'date': book['created_at'],
-                'book_id': book['id'],
-                'title': book['title'],
-                'author': book['author'],
-                'cover_image_url': book['cover_image_url'],
-                'genre': book['genre'],
-                'username': book['username'],
-                'user_id': book['added_by'],
-                'like_count': like_data['like_count'],
-                'user_liked': like_data['user_liked'] > 0
+                r.comment
+            FROM activities a
+            JOIN books b ON a.book_id = b.id
+            JOIN users u ON a.user_id = u.id
+            LEFT JOIN read_data r ON a.activity_type = 'review_added'
+                AND r.user_id = a.user_id
+                AND r.book_id = a.book_id
+            WHERE a.user_id IN ({placeholders})
+              AND NOT (a.activity_type = 'wishlist_added' AND EXISTS (
+                  SELECT 1 FROM wishlist w
+                  WHERE w.user_id = a.user_id AND w.book_id = a.book_id AND NOT {wishlist_visible}))
+              AND NOT (a.activity_type = 'collection_added' AND EXISTS (
+                  SELECT 1 FROM collections c
+                  WHERE c.user_id = a.user_id AND c.book_id = a.book_id AND NOT {shelf_visible}))
+        """
+        params = list(visible_user_ids) + wishlist_params + shelf_params
+
+        # "Load more" continues below the last activity already shown
+        cursor = decode_cursor(request.args.get('cursor'))
+        if cursor and {'v', 'id'} <= cursor.keys():
+            query += " AND (a.created_at, a.id) < (?, ?)"
+            params.extend([cursor['v'], cursor['id']])
+
+        # Fetch one extra row to find out whether there is more
+        query += " ORDER BY a.created_at DESC, a.id DESC LIMIT ?"
+        params.append(FEED_PAGE_SIZE + 1)
+
+        rows = conn.execute(query, params).fetchall()
+        next_cursor = None
+        if len(rows) > FEED_PAGE_SIZE:
+            rows = rows[:FEED_PAGE_SIZE]
+            next_cursor = encode_cursor({'v': rows[-1]['created_at'], 'id': rows[-1]['id']})
+
+        activities = [{
+            'type': row['activity_type'],
+            'date': row['created_at'],
+            'book_id': row['book_id'],
+            'title': row['title'],
+            'author': row['author'],
+            'cover_image_url': row['cover_image_url'],
+            'genre': row['genre'],
+            'username': row['username'],
+            'user_id': row['user_id'],
+            'status': row['status'],
+            'rating': row['rating'],
+            'comment': row['comment']
+        } for row in rows]
+
+        # Attach like counts for the page in one grouped query
+        attach_like_counts(conn, activities, current_user.id)
+
+        # Handle AJAX requests for "load more"
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            html = ''.join(render_template("_activity_item.html", activity=activity)
+                           for activity in activities)
+            return jsonify({
+                'html': html,
+                'next_cursor': next_cursor
             })
 
-        for wishlist_item in recent_wishlist:
-            # Get like count for this activity
-            like_data = conn.execute("""
-                SELECT COUNT(*) as like_count,
-                       COALESCE(SUM(CASE WHEN liker_user_id = ? THEN 1 ELSE 0 END), 0) as user_liked
-                FROM activity_likes
-                WHERE activity_type = 'wishlist_added' AND book_id = ? AND activity_user_id = ?
-            """, (current_user.id, wishlist_item['book_id'], wishlist_item['user_id'])).fetchone()
-
-            activities.append({
-                'type': 'wishlist_added',
-                'date': wishlist_item['added_at'],
-                'book_id': wishlist_item['book_id'],
-                'title': wishlist_item['title'],
-                'author': wishlist_item['author'],
-                'cover_image_url': wishlist_item['cover_image_url'],
-                'genre': wishlist_item['genre'],
-                'username': wishlist_item['username'],
-                'user_id': wishlist_item['user_id'],
-                'like_count': like_data['like_count'],
-                'user_liked': like_data['user_liked'] > 0
-            })
-
-        for collection in recent_collections:
-            # Get like count for this activity
-            like_data = conn.execute("""
-                SELECT COUNT(*) as like_count,
-                       COALESCE(SUM(CASE WHEN liker_user_id = ? THEN 1 ELSE 0 END), 0) as user_liked
-                FROM activity_likes
-                WHERE activity_type = 'collection_added' AND book_id = ? AND activity_user_id = ?
-            """, (current_user.id, collection['book_id'], collection['user_id'])).fetchone()
-
-            activities.append({
-                'type': 'collection_added',
-                'date': collection['created_at'],
-                'book_id': collection['book_id'],
-                'collection_id': collection['collection_id'],
-                'title': collection['title'],
-                'author': collection['author'],
-                'cover_image_url': collection['cover_image_url'],
-                'username': collection['username'],
-                'user_id': collection['user_id'],
-                'status': collection['status'],
-                'like_count': like_data['like_count'],
-                'user_liked': like_data['user_liked'] > 0
-            })
-
-        for review in recent_reviews:
-            # Get like count for this activity
-            like_data = conn.execute("""
-                SELECT COUNT(*) as like_count,
-                       COALESCE(SUM(CASE WHEN liker_user_id = ? THEN 1 ELSE 0 END), 0) as user_liked
-                FROM activity_likes
-                WHERE activity_type = 'review_added' AND book_id = ? AND activity_user_id = ?
-            """, (current_user.id, review['book_id'], review['user_id'])).fetchone()
-
-            activities.append({
-                'type': 'review_added',
-                'date': review['date_read'],
-                'book_id': review['book_id'],
-                'title': review['title'],
-                'author': review['author'],
-                'cover_image_url': review['cover_image_url'],
-                'username': review['username'],
-                'user_id': review['user_id'],
-                'rating': review['rating'],
-                'comment': review['comment'],
-                'like_count': like_data['like_count'],
-                'user_liked': like_data['user_liked'] > 0
-            })
-
-        # Filter to only show activities from friends or own activities
-        friend_activities = []
-        for activity in activities:
-            activity_user_id = activity.get('user_id')
-            # Show if it's your own activity or if you're friends with the user
-            if activity_user_id == current_user.id or is_friends_with(current_user.id, activity_user_id):
-                friend_activities.append(activity)
-
-        # Sort by date, most recent first
-        friend_activities.sort(key=lambda x: x['date'] if x['date'] else '', reverse=True)
-
-        # Limit to 30 most recent activities
-        friend_activities = friend_activities[:30]
-
-        return render_template("activity_feed.html", activities=friend_activities)
+        return render_template("activity_feed.html", activities=activities, next_cursor=next_cursor)
 
     finally:
         conn.close()
 
 
+def attach_like_counts(conn, activities, viewer_id):
+    """
+    Set 'like_count' and 'user_liked' on each activity dict.
+
+    All activity keys are sent as one VALUES list and joined against
+    activity_likes, so this costs a single query however long the feed is.
+    """
+    for activity in activities:
+        activity['like_count'] = 0
+        activity['user_liked'] = False
+
+    if not activities:
+        return
+
+    keys = ','.join(['(?, ?, ?)' for _ in activities])
+    params = []
+    for activity in activities:
+        params.extend([activity['type'], activity['book_id'], activity['user_id']])
+    params.append(viewer_id)
+
+    like_rows = conn.execute(f"""
+        WITH feed_keys (activity_type, book_id, activity_user_id) AS (VALUES {keys})
+        SELECT
+            l.activity_type,
+            l.book_id,
+            l.activity_user_id,
+            COUNT(*) as like_count,
+            SUM(CASE WHEN l.liker_user_id = ? THEN 1 ELSE 0 END) as user_liked
+        FROM feed_keys k
+        JOIN activity_likes l
+            ON l.activity_type = k.activity_type
+            AND l.book_id = k.book_id
+            AND l.activity_user_id = k.activity_user_id
+        GROUP BY l.activity_type, l.book_id, l.activity_user_id
+    """, params).fetchall()
+
+    likes = {(row['activity_type'], row['book_id'], row['activity_user_id']): row for row in like_rows}
+    for activity in activities:
+        row = likes.get((activity['type'], activity['book_id'], activity['user_id']))
+        if row:
+            activity['like_count'] = row['like_count']
+            activity['user_liked'] = row['user_liked'] > 0
+
+
 @feed_blueprint.route("/dismiss_activity", methods=["POST"])
 @login_required
 def dismiss_activity():
@@ -261,6 +173,7 @@ def dismiss_activity():
             INSERT OR IGNORE INTO dismissed_activities (activity_type, book_id, user_id)
             VALUES (?, ?, ?)
         """, (activity_type, book_id, user_id))
+        remove_activity(conn, user_id, activity_type, book_id)
 
         conn.commit()
         flash('Activity dismissed from feed', 'success')
@@ -323,6 +236,7 @@ def like_activity():
                 INSERT INTO notifications (user_id, type, message, related_activity_type, related_book_id, from_user_id)
                 VALUES (?, 'like', ?, ?, ?, ?)
             """, (activity_user_id, message, activity_type, book_id, current_user.id))
+            publish_counts(conn, int(activity_user_id), notifications=1)
 
         conn.commit()
 
@@ -361,7 +275,17 @@ def unlike_activity():
             WHERE activity_type = ? AND book_id = ? AND activity_user_id = ? AND liker_user_id = ?
         """, (activity_type, book_id, activity_user_id, current_user.id))
 
-        # Also delete the notification for this like
+        # Also delete the notification for this like (unread first, so the
+        # badge count can be adjusted by what was removed)
+        unread = conn.execute("""
+            DELETE FROM notifications
+            WHERE type = 'like'
+            AND related_activity_type = ?
+            AND related_book_id = ?
+            AND user_id = ?
+            AND from_user_id = ?
+            AND is_read = 0
+        """, (activity_type, book_id, activity_user_id, current_user.id)).rowcount
         conn.execute("""
             DELETE FROM notifications
             WHERE type = 'like'
@@ -370,6 +294,7 @@ def unlike_activity():
             AND user_id = ?
             AND from_user_id = ?
         """, (activity_type, book_id, activity_user_id, current_user.id))
+        publish_counts(conn, int(activity_user_id), notifications=-unread)
 
         conn.commit()
 
@@ -1,7 +1,12 @@
-from flask import Blueprint, request, jsonify, flash, redirect, url_for, render_template, current_app
+from flask import Blueprint, request, jsonify, flash, redirect, url_for, render_template, current_app, Response
 from flask_login import login_required, current_user
 from functools import wraps
 from utils.database import get_db_connection
+from utils.notification_utils import (publish_counts, get_notification_counts, open_notification_stream,
+                                      rebuild_notification_counters, DEFAULT_STREAM_POLL,
+                                      DEFAULT_STREAM_LIFETIME, DEFAULT_STREAM_MAX)
+from utils.social_graph import invalidate_social_graph
+import click
 import sqlite3
 
 friends_blueprint = Blueprint('friends', __name__, url_prefix='/friends')
@@ -74,6 +79,7 @@ def send_request(username):
             if existing_request['sender_id'] == target_user_id and existing_request['status'] == 'pending':
                 # Delete the request
                 conn.execute('DELETE FROM friend_requests WHERE id = ?', (existing_request['id'],))
+                publish_counts(conn, current_user.id, friend_requests=-1)
 
                 # Create friendship
                 conn.execute('''
@@ -86,8 +92,10 @@ def send_request(username):
                     INSERT INTO notifications (user_id, type, message, from_user_id)
                     VALUES (?, 'friend_accept', ?, ?)
                 ''', (target_user_id, f'{current_user.username} accepted your friend request!', current_user.id))
+                publish_counts(conn, target_user_id, notifications=1)
 
                 conn.commit()
+                invalidate_social_graph()
                 flash(f'You are now friends with {username}!', 'success')
                 return redirect(url_for('user.profile', username=username))
             elif existing_request['status'] == 'pending':
@@ -104,8 +112,10 @@ def send_request(username):
             INSERT INTO friend_requests (sender_id, receiver_id, status)
             VALUES (?, ?, 'pending')
         ''', (current_user.id, target_user_id))
+        publish_counts(conn, target_user_id, friend_requests=1)
 
         conn.commit()
+        invalidate_social_graph()
         flash(f'Friend request sent to {username}!', 'success')
 
     except sqlite3.IntegrityError:
@@ -140,6 +150,7 @@ def accept_request(request_id):
 
         # Delete the friend request
         conn.execute('DELETE FROM friend_requests WHERE id = ?', (request_id,))
+        publish_counts(conn, current_user.id, friend_requests=-1)
 
         # Create the friendship
         conn.execute('''
@@ -152,8 +163,10 @@ def accept_request(request_id):
             INSERT INTO notifications (user_id, type, message, from_user_id)
             VALUES (?, 'friend_accept', ?, ?)
         ''', (sender_id, f'{current_user.username} accepted your friend request!', current_user.id))
+        publish_counts(conn, sender_id, notifications=1)
 
         conn.commit()
+        invalidate_social_graph()
         flash(f'You are now friends with {sender_username}!', 'success')
 
     except sqlite3.IntegrityError:
@@ -186,8 +199,10 @@ def decline_request(request_id):
             SET status = 'declined', updated_at = CURRENT_TIMESTAMP
             WHERE id = ?
         ''', (request_id,))
+        publish_counts(conn, current_user.id, friend_requests=-1)
 
         conn.commit()
+        invalidate_social_graph()
         flash('Friend request declined.', 'info')
 
     finally:
@@ -222,6 +237,7 @@ def remove_friend(friend_id):
 
         if result.rowcount > 0:
             conn.commit()
+            invalidate_social_graph()
             flash(f'Removed {friend["username"]} from friends.', 'info')
         else:
             flash('Friendship not found!', 'danger')
@@ -331,30 +347,54 @@ def notification_count():
     """Get count of unread notifications and pending friend requests (JSON API)"""
     conn = get_db_connection()
     try:
-        # Count pending friend requests
-        friend_request_count = conn.execute('''
-            SELECT COUNT(*) as count
-            FROM friend_requests
-            WHERE receiver_id = ? AND status = 'pending'
-        ''', (current_user.id,)).fetchone()['count']
-
-        # Count unread notifications (excluding friend_request type)
-        notification_count = conn.execute('''
-            SELECT COUNT(*) as count
-            FROM notifications
-            WHERE user_id = ? AND is_read = 0 AND type != 'friend_request'
-        ''', (current_user.id,)).fetchone()['count']
+        counts = get_notification_counts(conn, current_user.id)
+        del counts['last_event']
+    finally:
+        conn.close()
 
-        total_count = friend_request_count + notification_count
+    # Polled every 30 seconds by pages without the stream; unchanged counts get a bodiless 304
+    response = jsonify(counts)
+    response.set_etag(f"{current_user.id}-{counts['friend_requests']}-{counts['notifications']}")
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
-        return jsonify({
-            'count': total_count,
-            'friend_requests': friend_request_count,
-            'notifications': notification_count
-        })
 
+@friends_blueprint.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Recount every user's notification badge counters (flask friends rebuild-counters)"""
+    conn = get_db_connection()
+    try:
+        count = rebuild_notification_counters(conn)
     finally:
         conn.close()
+    click.echo(f"Corrected notification counters for {count} users")
+
+
+@friends_blueprint.route('/notification_stream', methods=['GET'])
+@login_required
+def notification_stream():
+    """Push notification and friend request counts as Server-Sent Events"""
+    conn = get_db_connection()
+    try:
+        stream = open_notification_stream(
+            conn, current_user.id,
+            poll_interval=current_app.config.get('NOTIFICATION_STREAM_POLL', DEFAULT_STREAM_POLL),
+            lifetime=current_app.config.get('NOTIFICATION_STREAM_LIFETIME', DEFAULT_STREAM_LIFETIME),
+            max_streams=current_app.config.get('NOTIFICATION_STREAM_MAX', DEFAULT_STREAM_MAX)
+        )
+    finally:
+        conn.close()
+
+    if stream is None:
+        # Too many streams open in this worker; EventSource gives up on a
+        # refused stream and notification_badge.js falls back to polling
+        return Response('Too many notification streams', status=503, mimetype='text/plain')
+
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @friends_blueprint.route('/dismiss_notification/<int:notification_id>', methods=['POST'])
@@ -363,10 +403,16 @@ def dismiss_notification(notification_id):
     """Delete/dismiss a notification"""
     conn = get_db_connection()
     try:
+        # Unread first, so the badge count can be adjusted by what was removed
+        unread = conn.execute('''
+            DELETE FROM notifications
+            WHERE id = ? AND user_id = ? AND is_read = 0 AND type != 'friend_request'
+        ''', (notification_id, current_user.id)).rowcount
         conn.execute('''
             DELETE FROM notifications
             WHERE id = ? AND user_id = ?
         ''', (notification_id, current_user.id))
+        publish_counts(conn, current_user.id, notifications=-unread)
         conn.commit()
         flash('Notification dismissed', 'info')
     except Exception as e:
@@ -383,12 +429,18 @@ def mark_all_read():
     """Dismiss all notifications for the current user"""
     conn = get_db_connection()
     try:
+        # Unread first, so the badge count can be adjusted by what was removed
+        unread = conn.execute('''
+            DELETE FROM notifications
+            WHERE user_id = ? AND is_read = 0 AND type != 'friend_request'
+        ''', (current_user.id,)).rowcount
         result = conn.execute('''
             DELETE FROM notifications
             WHERE user_id = ?
         ''', (current_user.id,))
+        publish_counts(conn, current_user.id, notifications=-unread)
 
-        count = result.rowcount
+        count = unread + result.rowcount
         conn.commit()
 
         if count > 0:
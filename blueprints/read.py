@@ -1,6 +1,7 @@
 from flask import Blueprint, request, render_template, redirect, url_for, flash
 from flask_login import login_required, current_user
 from utils.database import get_db_connection
+from utils.activity_utils import record_activity
 from datetime import datetime
 
 # Define the blueprint
@@ -70,6 +71,7 @@ def rate_review(book_id):
                 rating = excluded.rating,
                 comment = excluded.comment
         ''', (current_user.id, book_id, int(rating), comment))
+        record_activity(conn, current_user.id, 'review_added', book_id)
 
         conn.commit()
 
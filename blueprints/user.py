@@ -1,14 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, make_response, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app, Response, stream_with_context
 from flask_login import current_user, login_required
 from functools import wraps
 from utils.database import get_db_connection
-from models import User, admin_required, get_friendship_status, is_friends_with, shares_library_with
-from werkzeug.utils import secure_filename
+from utils.stats_utils import get_user_stats, rebuild_user_stats, get_library_stats
+from utils.jobs import create_job, start_job, get_job
+from utils.import_utils import run_goodreads_import
+from utils.user_cache import invalidate_user
+from utils.social_graph import invalidate_social_graph
+from utils.image_processing import (save_image_upload, queue_avatar_processing,
+                                    COVER_JOB_TYPE, AVATAR_JOB_TYPE)
+from models import (User, admin_required, get_friendship_status, is_friends_with, shares_library_with,
+                    visible_sql)
 import bcrypt
+import click
 import csv
 import os
+import tempfile
 from io import StringIO
-from PIL import Image
 
 # Initialize Blueprint
 user_blueprint = Blueprint('user', __name__)
@@ -35,137 +43,13 @@ def rate_limit(limit_string):
 # Allowed extensions for profile pictures
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+# Rows fetched and written per chunk of a streamed library export
+EXPORT_BATCH_SIZE = 500
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def calculate_user_stats(conn, user_id):
-    """Calculate user reading statistics"""
-    query = '''
-        SELECT
-            COUNT(DISTINCT r.book_id) as books_read,
-            SUM(CAST(b.page_count AS INTEGER)) as pages_read,
-            AVG(r.rating) as avg_rating
-        FROM read_data r
-        JOIN books b ON r.book_id = b.id
-        WHERE r.user_id = ?
-    '''
-    stats = conn.execute(query, [user_id]).fetchone()
-
-    # Calculate year-to-date reading progress
-    from datetime import datetime
-    current_year = datetime.now().year
-    ytd_query = '''
-        SELECT COUNT(DISTINCT rs.book_id) as books_read_this_year
-        FROM reading_sessions rs
-        WHERE rs.user_id = ?
-        AND rs.date_completed IS NOT NULL
-        AND strftime('%Y', rs.date_completed) = ?
-    '''
-    ytd_stats = conn.execute(ytd_query, [user_id, str(current_year)]).fetchone()
-
-    result = dict(stats) if stats else {}
-    if ytd_stats:
-        result['books_read_this_year'] = ytd_stats['books_read_this_year']
-    else:
-        result['books_read_this_year'] = 0
-
-    # Calculate user-specific read percentage (books user has read vs total books in library)
-    library_query = '''
-        SELECT COUNT(DISTINCT id) as total_books
-        FROM books
-    '''
-    library_total = conn.execute(library_query).fetchone()
-
-    books_read = result.get('books_read', 0) or 0
-    total_books = library_total['total_books'] if library_total else 0
-
-    if total_books > 0:
-        result['read_percentage'] = round((books_read / total_books) * 100, 1)
-    else:
-        result['read_percentage'] = 0
-
-    # Reading by month (last 12 months)
-    reading_by_month_query = '''
-        SELECT
-            strftime('%Y-%m', rs.date_completed) as month,
-            COUNT(DISTINCT rs.book_id) as books_count
-        FROM reading_sessions rs
-        WHERE rs.user_id = ?
-        AND rs.date_completed IS NOT NULL
-        AND rs.date_completed >= date('now', '-12 months')
-        GROUP BY month
-        ORDER BY month
-    '''
-    result['reading_by_month'] = [dict(row) for row in conn.execute(reading_by_month_query, [user_id]).fetchall()]
-
-    # Top genres
-    top_genres_query = '''
-        SELECT
-            b.genre,
-            COUNT(DISTINCT r.book_id) as count
-        FROM read_data r
-        JOIN books b ON r.book_id = b.id
-        WHERE r.user_id = ? AND b.genre IS NOT NULL AND b.genre != ''
-        GROUP BY b.genre
-        ORDER BY count DESC
-        LIMIT 5
-    '''
-    result['top_genres'] = [dict(row) for row in conn.execute(top_genres_query, [user_id]).fetchall()]
-
-    # Rating distribution
-    rating_dist_query = '''
-        SELECT
-            r.rating,
-            COUNT(*) as count
-        FROM read_data r
-        WHERE r.user_id = ? AND r.rating IS NOT NULL
-        GROUP BY r.rating
-        ORDER BY r.rating
-    '''
-    result['rating_distribution'] = [dict(row) for row in conn.execute(rating_dist_query, [user_id]).fetchall()]
-
-    # Collection status breakdown
-    collection_status_query = '''
-        SELECT
-            c.status,
-            COUNT(DISTINCT c.book_id) as count
-        FROM collections c
-        WHERE c.user_id = ?
-        GROUP BY c.status
-    '''
-    result['collection_status'] = [dict(row) for row in conn.execute(collection_status_query, [user_id]).fetchall()]
-
-    # Top authors
-    top_authors_query = '''
-        SELECT
-            b.author,
-            COUNT(DISTINCT r.book_id) as books_count,
-            ROUND(AVG(r.rating), 1) as avg_rating
-        FROM read_data r
-        JOIN books b ON r.book_id = b.id
-        WHERE r.user_id = ?
-        GROUP BY b.author
-        ORDER BY books_count DESC, avg_rating DESC
-        LIMIT 5
-    '''
-    result['top_authors'] = [dict(row) for row in conn.execute(top_authors_query, [user_id]).fetchall()]
-
-    # Reading streak stats
-    streak_query = '''
-        SELECT
-            MIN(date_completed) as first_read,
-            MAX(date_completed) as last_read,
-            COUNT(DISTINCT date(date_completed)) as unique_days
-        FROM reading_sessions
-        WHERE user_id = ? AND date_completed IS NOT NULL
-    '''
-    streak_stats = conn.execute(streak_query, [user_id]).fetchone()
-    if streak_stats:
-        result.update(dict(streak_stats))
-
-    return result
-
 @user_blueprint.route('/<username>')
 @login_required
 def profile(username):
@@ -192,10 +76,10 @@ def profile(username):
         are_friends = friendship_status in ('self', 'friends')
 
         # Get user's reading stats (only if friends or own profile)
-        stats = calculate_user_stats(conn, user['id']) if are_friends else None
+        stats = get_user_stats(conn, user['id']) if are_friends else None
 
         # Library stats (only if friends or own profile)
-        library_stats = calculate_library_stats(conn) if are_friends else None
+        library_stats = get_library_stats(conn) if are_friends else None
 
         # Get pending friend request ID if applicable
         friend_request_id = None
@@ -230,10 +114,16 @@ def profile(username):
         from datetime import datetime
         current_year = datetime.now().year
 
+        # Privacy of the user's wishlist, shelves and reading sessions, as seen
+        # by the current user (all visible on their own profile)
+        wishlist_visible, wishlist_params = visible_sql(current_user.id, 'w.user_id', 'w.privacy')
+        shelf_visible, shelf_params = visible_sql(current_user.id, 'c.user_id', 'c.privacy')
+        session_visible, session_params = visible_sql(current_user.id, 'rs.user_id', 'rs.privacy')
+
         # Get wishlist books for the user
         wishlist_books = []
         if are_friends:
-            wishlist_query = """
+            wishlist_query = f"""
                 SELECT
                     b.id,
                     b.title,
@@ -243,36 +133,37 @@ def profile(username):
                     w.added_at
                 FROM wishlist w
                 JOIN books b ON w.book_id = b.id
-                WHERE w.user_id = ?
+                WHERE w.user_id = ? AND {wishlist_visible}
                 ORDER BY w.added_at DESC
                 LIMIT 20
             """
-            wishlist_books = [dict(row) for row in conn.execute(wishlist_query, (user['id'],)).fetchall()]
+            wishlist_books = [dict(row) for row in conn.execute(
+                wishlist_query, [user['id']] + wishlist_params).fetchall()]
 
         # Get reading shelves data (like collections page)
         reading_lists = []
         reading_list_covers = {}
         if are_friends:
             # Get count for each reading status
-            reading_lists = conn.execute("""
+            reading_lists = conn.execute(f"""
                 SELECT status, COUNT(*) as book_count
-                FROM collections
-                WHERE user_id = ?
+                FROM collections c
+                WHERE user_id = ? AND {shelf_visible}
                 GROUP BY status
-            """, (user['id'],)).fetchall()
+            """, [user['id']] + shelf_params).fetchall()
             reading_lists = [dict(row) for row in reading_lists]
 
             # Get cover previews for each status
             statuses = ['read', 'currently reading', 'want to read', 'did not finish']
             for status in statuses:
-                covers = conn.execute("""
+                covers = conn.execute(f"""
                     SELECT b.cover_image_url
                     FROM collections c
                     JOIN books b ON c.book_id = b.id
-                    WHERE c.user_id = ? AND c.status = ?
+                    WHERE c.user_id = ? AND c.status = ? AND {shelf_visible}
                     ORDER BY c.created_at DESC
                     LIMIT 8
-                """, (user['id'], status)).fetchall()
+                """, [user['id'], status] + shelf_params).fetchall()
                 reading_list_covers[status] = [row['cover_image_url'] for row in covers]
 
         # Check if this user is in current user's shared library
@@ -281,7 +172,7 @@ def profile(username):
         # Get recent reviews/ratings for the user
         recent_reviews = []
         if are_friends:
-            reviews_query = """
+            reviews_query = f"""
                 SELECT
                     r.book_id,
                     r.rating,
@@ -293,11 +184,13 @@ def profile(username):
                 FROM read_data r
                 JOIN books b ON r.book_id = b.id
                 LEFT JOIN reading_sessions rs ON r.user_id = rs.user_id AND r.book_id = rs.book_id
+                    AND {session_visible}
                 WHERE r.user_id = ?
                 ORDER BY rs.date_completed DESC, r.rowid DESC
                 LIMIT 15
             """
-            recent_reviews = [dict(row) for row in conn.execute(reviews_query, (user['id'],)).fetchall()]
+            recent_reviews = [dict(row) for row in conn.execute(
+                reviews_query, session_params + [user['id']]).fetchall()]
 
         return render_template(
             'user.html',
@@ -319,6 +212,16 @@ def profile(username):
     finally:
         conn.close()
 
+@user_blueprint.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute cached reading statistics for every user (flask user rebuild-stats)"""
+    conn = get_db_connection()
+    try:
+        count = rebuild_user_stats(conn)
+    finally:
+        conn.close()
+    click.echo(f"Rebuilt reading stats for {count} users")
+
 @user_blueprint.route('/update_reading_goal', methods=['POST'])
 @login_required
 @rate_limit("20 per hour")
@@ -374,6 +277,7 @@ def update_email():
             # Update email
             conn.execute('UPDATE users SET email = ? WHERE id = ?', (new_email, current_user.id))
             conn.commit()
+            invalidate_user(current_user.id)
 
             return jsonify({'success': True, 'message': 'Email updated successfully'})
 
@@ -410,9 +314,7 @@ def update_username():
             # Update username
             conn.execute('UPDATE users SET username = ? WHERE id = ?', (new_username, current_user.id))
             conn.commit()
-
-            # Update the current_user object
-            current_user.username = new_username
+            invalidate_user(current_user.id)
 
             return jsonify({'success': True, 'message': 'Username updated successfully'})
 
@@ -440,9 +342,7 @@ def update_bio():
             # Update bio
             conn.execute('UPDATE users SET bio = ? WHERE id = ?', (new_bio if new_bio else None, current_user.id))
             conn.commit()
-
-            # Update the current_user object
-            current_user.bio = new_bio if new_bio else None
+            invalidate_user(current_user.id)
 
             return jsonify({'success': True, 'message': 'Bio updated successfully'})
 
@@ -539,92 +439,18 @@ def upload_avatar():
             return jsonify({'success': False, 'message': f'File size must be less than {max_size_mb:.0f}MB'}), 400
 
         if file and allowed_file(file.filename):
-            # Secure the filename and create a unique name
-            filename = secure_filename(file.filename)
-            file_ext = filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"user_{current_user.id}_{int(os.urandom(4).hex(), 16)}.{file_ext}"
-            logger.info(f"Generated unique filename: {unique_filename}")
-
-            # Create uploads/avatars directory if it doesn't exist
-            avatar_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'avatars')
-            os.makedirs(avatar_folder, exist_ok=True)
-            logger.info(f"Avatar folder: {avatar_folder}")
-
-            filepath = os.path.join(avatar_folder, unique_filename)
-            logger.info(f"Full filepath: {filepath}")
-
-            # Process and resize image
-            try:
-                img = Image.open(file)
-                logger.info(f"Image opened successfully, mode: {img.mode}, size: {img.size}")
-
-                # Fix orientation based on EXIF data
-                try:
-                    from PIL import ImageOps
-                    img = ImageOps.exif_transpose(img)
-                    logger.info(f"Applied EXIF orientation correction")
-                except Exception as e:
-                    logger.warning(f"Could not apply EXIF orientation: {str(e)}")
-
-                # Convert RGBA to RGB if necessary
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                    logger.info(f"Converted image to RGB")
-
-                # Resize to a reasonable size (400x400) while maintaining aspect ratio
-                img.thumbnail((400, 400), Image.Resampling.LANCZOS)
-                logger.info(f"Image resized to: {img.size}")
-
-                # Save the image
-                img.save(filepath, quality=85, optimize=True)
-                logger.info(f"Image saved to: {filepath}")
-
-            except Exception as e:
-                logger.error(f"Error processing image: {str(e)}", exc_info=True)
-                return jsonify({'success': False, 'message': f'Error processing image: {str(e)}'}), 500
-
-            # Get relative path for database storage (use forward slashes for URLs)
-            relative_path = f'uploads/avatars/{unique_filename}'
-            logger.info(f"Relative path for DB: {relative_path}")
-
-            conn = get_db_connection()
-            try:
-                # Get old avatar URL to delete old file
-                old_avatar = conn.execute('SELECT avatar_url FROM users WHERE id = ?',
-                                         (current_user.id,)).fetchone()
-                logger.info(f"Old avatar: {old_avatar['avatar_url'] if old_avatar else None}")
-
-                # Update database with new avatar URL
-                conn.execute('UPDATE users SET avatar_url = ? WHERE id = ?',
-                           (relative_path, current_user.id))
-                conn.commit()
-                logger.info(f"Database updated successfully")
-
-                # Delete old avatar file if it exists
-                if old_avatar and old_avatar['avatar_url']:
-                    old_file_path = os.path.join(current_app.root_path, 'static', old_avatar['avatar_url'])
-                    if os.path.exists(old_file_path):
-                        try:
-                            os.remove(old_file_path)
-                            logger.info(f"Deleted old avatar: {old_file_path}")
-                        except Exception as e:
-                            logger.warning(f"Could not delete old avatar: {str(e)}")
-
-                avatar_url = url_for('static', filename=relative_path)
-                logger.info(f"Generated avatar URL: {avatar_url}")
-
-                return jsonify({
-                    'success': True,
-                    'message': 'Profile picture updated successfully',
-                    'avatar_url': avatar_url
-                })
-
-            finally:
-                conn.close()
+            # Resizing happens in the background; the page polls status_url
+            # and swaps the picture in when it is ready
+            raw_path = save_image_upload(file)
+            job_id = queue_avatar_processing(current_user.id, raw_path)
+            logger.info(f"Queued avatar processing job {job_id}")
+
+            return jsonify({
+                'success': True,
+                'message': 'Profile picture uploaded, processing...',
+                'job_id': job_id,
+                'status_url': url_for('user.image_status', job_id=job_id)
+            }), 202
         else:
             logger.error(f"Invalid file type: {file.filename}")
             return jsonify({'success': False, 'message': 'Invalid file type. Allowed: png, jpg, jpeg, gif, webp'}), 400
@@ -633,123 +459,123 @@ def upload_avatar():
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         return jsonify({'success': False, 'message': f'An error occurred: {str(e)}'}), 500
 
-def calculate_library_stats(conn):
-   query = '''
-       SELECT
-           COUNT(DISTINCT b.id) as total_books,
-           SUM(CAST(b.page_count AS INTEGER)) as total_pages,
-           COUNT(DISTINCT c.book_id) as read_books,
-           (SELECT COUNT(*) FROM (
-               SELECT DISTINCT author FROM books
-           )) as unique_authors,
-           (SELECT title FROM books
-            WHERE CAST(page_count AS INTEGER) = (
-                SELECT MAX(CAST(page_count AS INTEGER)) FROM books
-            )) as longest_book,
-           (SELECT MAX(CAST(page_count AS INTEGER)) FROM books) as longest_pages,
-           (
-               SELECT genre
-               FROM (
-                   SELECT genre, COUNT(*) as count
-                   FROM books
-                   WHERE genre IS NOT NULL
-                   GROUP BY genre
-                   ORDER BY count DESC
-                   LIMIT 1
-               )
-           ) as most_common_genre
-       FROM books b
-       LEFT JOIN collections c ON b.id = c.book_id AND c.status = 'read'
-   '''
-   stats = dict(conn.execute(query).fetchone())
-   if stats['total_books']:
-       stats['read_percentage'] = round((stats['read_books'] / stats['total_books']) * 100)
-       stats['total_pages'] = "{:,}".format(int(stats['total_pages'] or 0))
-       stats['longest_pages'] = "{:,}".format(int(stats['longest_pages'] or 0))
-   return stats
-
 @user_blueprint.route('/export_library')
 @login_required
 def export_library():
-    conn = get_db_connection()
-    try:
-        # Get all books with their statuses and ratings for the current user
-        query = '''
-            SELECT
-                b.id as book_id,
-                b.title,
-                b.subtitle,
-                b.author,
-                b.publisher,
-                b.publish_year,
-                b.isbn,
-                b.page_count,
-                b.genre,
-                c.status as reading_status,
-                c.created_at as date_added_to_collection,
-                r.rating,
-                (SELECT MIN(date_started) FROM reading_sessions
-                 WHERE book_id = b.id AND user_id = ?) as date_started,
-                (SELECT MAX(date_completed) FROM reading_sessions
-                 WHERE book_id = b.id AND user_id = ?) as date_completed,
-                (SELECT COUNT(*) FROM reading_sessions
-                 WHERE book_id = b.id AND user_id = ? AND date_completed IS NOT NULL) as reread_count,
-                r.comment as review,
-                GROUP_CONCAT(DISTINCT t.tag_name) as tags,
-                GROUP_CONCAT(DISTINCT uc.name) as custom_collections
-            FROM books b
-            LEFT JOIN collections c ON b.id = c.book_id AND c.user_id = ?
-            LEFT JOIN read_data r ON b.id = r.book_id AND r.user_id = ?
-            LEFT JOIN book_tags t ON b.id = t.book_id AND t.user_id = ?
-            LEFT JOIN collection_books cb ON b.id = cb.book_id
-            LEFT JOIN user_collections uc ON cb.collection_id = uc.collection_id AND uc.user_id = ?
-            GROUP BY b.id
-            ORDER BY b.title
-        '''
-        books = conn.execute(query, (current_user.id, current_user.id, current_user.id,
-                                     current_user.id, current_user.id, current_user.id,
-                                     current_user.id)).fetchall()
-
-        # Create CSV in memory
-        si = StringIO()
-        writer = csv.writer(si)
-
-        # Write headers
-        writer.writerow(['Book ID', 'Title', 'Subtitle', 'Author', 'Publisher', 'Year', 'ISBN', 'Pages',
-                        'Genre', 'Reading Status', 'Date Added to Collection', 'Date Started',
-                        'Date Completed', 'Reread Count', 'Rating', 'Review', 'Tags', 'Custom Collections'])
-
-        # Write data
-        for book in books:
-            writer.writerow([
-                book['book_id'],
-                book['title'],
-                book['subtitle'],
-                book['author'],
-                book['publisher'],
-                book['publish_year'],
-                book['isbn'],
-                book['page_count'],
-                book['genre'],
-                book['reading_status'] or 'Untracked',
-                book['date_added_to_collection'],
-                book['date_started'],
-                book['date_completed'],
-                book['reread_count'] or 0,
-                book['rating'],
-                book['review'],
-                book['tags'],
-                book['custom_collections']
-            ])
-
-        # Create the response
-        output = make_response(si.getvalue())
-        output.headers["Content-Disposition"] = f"attachment; filename=library_export_{current_user.username}.csv"
-        output.headers["Content-type"] = "text/csv"
-        return output
+    """Stream the user's library as CSV, EXPORT_BATCH_SIZE rows at a time"""
+    user_id = current_user.id
 
-    finally:
-        conn.close()
+    # Per-book aggregates are computed once per table in grouped CTEs and
+    # joined one-to-one, instead of per-row subqueries and row-multiplying joins
+    query = '''
+        WITH session_stats AS (
+            SELECT book_id,
+                   MIN(date_started) as date_started,
+                   MAX(date_completed) as date_completed,
+                   COUNT(date_completed) as reread_count
+            FROM reading_sessions
+            WHERE user_id = ?
+            GROUP BY book_id
+        ),
+        statuses AS (
+            -- Latest collection entry per book (bare columns come from the MAX row)
+            SELECT book_id, status, created_at, MAX(collection_id)
+            FROM collections
+            WHERE user_id = ?
+            GROUP BY book_id
+        ),
+        tags AS (
+            SELECT book_id, GROUP_CONCAT(DISTINCT tag_name) as tags
+            FROM book_tags
+            WHERE user_id = ?
+            GROUP BY book_id
+        ),
+        custom_collections AS (
+            SELECT cb.book_id, GROUP_CONCAT(DISTINCT uc.name) as names
+            FROM collection_books cb
+            JOIN user_collections uc ON cb.collection_id = uc.collection_id
+            WHERE uc.user_id = ?
+            GROUP BY cb.book_id
+        )
+        SELECT
+            b.id as book_id,
+            b.title,
+            b.subtitle,
+            b.author,
+            b.publisher,
+            b.publish_year,
+            b.isbn,
+            b.page_count,
+            b.genre,
+            c.status as reading_status,
+            c.created_at as date_added_to_collection,
+            r.rating,
+            s.date_started,
+            s.date_completed,
+            s.reread_count,
+            r.comment as review,
+            t.tags,
+            cc.names as custom_collections
+        FROM books b
+        LEFT JOIN statuses c ON c.book_id = b.id
+        LEFT JOIN read_data r ON r.book_id = b.id AND r.user_id = ?
+        LEFT JOIN session_stats s ON s.book_id = b.id
+        LEFT JOIN tags t ON t.book_id = b.id
+        LEFT JOIN custom_collections cc ON cc.book_id = b.id
+        ORDER BY b.title
+    '''
+
+    def generate():
+        conn = get_db_connection()
+        try:
+            si = StringIO()
+            writer = csv.writer(si)
+
+            # Write headers
+            writer.writerow(['Book ID', 'Title', 'Subtitle', 'Author', 'Publisher', 'Year', 'ISBN', 'Pages',
+                            'Genre', 'Reading Status', 'Date Added to Collection', 'Date Started',
+                            'Date Completed', 'Reread Count', 'Rating', 'Review', 'Tags', 'Custom Collections'])
+            yield si.getvalue()
+
+            cursor = conn.execute(query, (user_id,) * 5)
+            while True:
+                books = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not books:
+                    break
+
+                si.seek(0)
+                si.truncate()
+                for book in books:
+                    writer.writerow([
+                        book['book_id'],
+                        book['title'],
+                        book['subtitle'],
+                        book['author'],
+                        book['publisher'],
+                        book['publish_year'],
+                        book['isbn'],
+                        book['page_count'],
+                        book['genre'],
+                        book['reading_status'] or 'Untracked',
+                        book['date_added_to_collection'],
+                        book['date_started'],
+                        book['date_completed'],
+                        book['reread_count'] or 0,
+                        book['rating'],
+                        book['review'],
+                        book['tags'],
+                        book['custom_collections']
+                    ])
+                yield si.getvalue()
+
+        finally:
+            conn.close()
+
+    # Stream the response so the download starts straight away and memory
+    # stays flat however large the library is
+    output = Response(stream_with_context(generate()), mimetype='text/csv')
+    output.headers["Content-Disposition"] = f"attachment; filename=library_export_{current_user.username}.csv"
+    return output
 
 @user_blueprint.route('/import_goodreads_page')
 @login_required
@@ -757,18 +583,11 @@ def import_goodreads_page():
     """Display the Goodreads import page with instructions"""
     return render_template('goodreads_import.html')
 
-def format_goodreads_date(date_str):
-    """Convert Goodreads date format (YYYY/MM/DD) to SQLite format (YYYY-MM-DD)"""
-    if not date_str:
-        return None
-    # Replace forward slashes with dashes for proper SQLite date sorting
-    return date_str.replace('/', '-')
-
 @user_blueprint.route('/import_goodreads', methods=['POST'])
 @login_required
 @rate_limit("3 per hour")
 def import_goodreads():
-    """Import library data from Goodreads CSV export"""
+    """Start a background import of a Goodreads CSV export"""
     import logging
     logger = logging.getLogger(__name__)
 
@@ -785,194 +604,75 @@ def import_goodreads():
         if not file.filename.endswith('.csv'):
             return jsonify({'success': False, 'message': 'File must be a CSV'}), 400
 
-        # Read CSV content
-        csv_content = file.read().decode('utf-8')
-        csv_reader = csv.DictReader(StringIO(csv_content))
+        # Spool the upload to disk; the job streams it from there
+        fd, csv_path = tempfile.mkstemp(prefix='goodreads-', suffix='.csv')
+        with os.fdopen(fd, 'wb') as f:
+            file.save(f)
 
         conn = get_db_connection()
-        stats = {
-            'books_added': 0,
-            'wishlist_added': 0,
-            'ratings_added': 0,
-            'duplicates_skipped': 0,
-            'collection_added': 0,
-            'sessions_added': 0,
-            'rows_processed': 0,
-            'unknown_shelf': 0,
-            'errors': []
-        }
-
         try:
-            for row in csv_reader:
-                stats['rows_processed'] += 1
-                try:
-                    # Extract book data from Goodreads CSV
-                    title = row.get('Title', '').strip()
-                    author = row.get('Author', '').strip()
-                    isbn = row.get('ISBN13', '').strip() or row.get('ISBN', '').strip()
-                    isbn = isbn.replace('="', '').replace('"', '').strip()  # Clean ISBN formatting
-
-                    publisher = row.get('Publisher', '').strip()
-                    year = row.get('Year Published', '').strip() or row.get('Original Publication Year', '').strip()
-                    pages = row.get('Number of Pages', '').strip()
-                    my_rating = row.get('My Rating', '').strip()
-                    # Format dates to use dashes instead of slashes for proper SQLite sorting
-                    date_read = format_goodreads_date(row.get('Date Read', '').strip())
-                    date_added = format_goodreads_date(row.get('Date Added', '').strip())
-                    bookshelves = row.get('Bookshelves', '').strip()
-                    exclusive_shelf = row.get('Exclusive Shelf', '').strip()
-                    my_review = row.get('My Review', '').strip()
-
-                    # Skip if no title
-                    if not title:
-                        continue
-
-                    # Determine shelf (use Exclusive Shelf first, then Bookshelves)
-                    shelf = exclusive_shelf or bookshelves
-
-                    # Debug logging
-                    if stats['rows_processed'] <= 3:
-                        logger.info(f"Row {stats['rows_processed']}: Title='{title}', Shelf='{shelf}', Exclusive='{exclusive_shelf}', Bookshelves='{bookshelves}'")
-
-                    # Check if book already exists (by ISBN or title+author)
-                    existing_book = None
-                    if isbn:
-                        existing_book = conn.execute(
-                            'SELECT * FROM books WHERE isbn = ?', (isbn,)
-                        ).fetchone()
-
-                    if not existing_book and title and author:
-                        existing_book = conn.execute(
-                            'SELECT * FROM books WHERE LOWER(title) = LOWER(?) AND LOWER(author) = LOWER(?)',
-                            (title, author)
-                        ).fetchone()
-
-                    # If book doesn't exist, create it
-                    if not existing_book:
-                        # For bulk import, use Goodreads data directly (API calls are too slow)
-                        # Covers can be fetched later via separate feature
-                        final_title = title
-                        final_author = author
-                        final_isbn = isbn
-                        final_publisher = publisher
-                        final_year = year
-                        final_pages = pages
-                        cover_url = ''  # Will fetch covers later
-                        description = ''
-                        subtitle = ''
-                        genre = ''
-
-                        # Insert book into database
-                        cursor = conn.execute('''
-                            INSERT INTO books (title, author, isbn, publisher, publish_year,
-                                             page_count, cover_image_url, description, subtitle,
-                                             genre, added_by)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (final_title, final_author, final_isbn, final_publisher,
-                              final_year, final_pages, cover_url, description, subtitle,
-                              genre, current_user.id))
-
-                        book_id = cursor.lastrowid
-                        stats['books_added'] += 1
-                    else:
-                        book_id = existing_book['id']
-
-                    # Handle different shelves
-                    if shelf in ['to-read', 'want-to-read']:
-                        # Add to wishlist
-                        existing_wishlist = conn.execute(
-                            'SELECT * FROM wishlist WHERE user_id = ? AND book_id = ?',
-                            (current_user.id, book_id)
-                        ).fetchone()
-
-                        if not existing_wishlist:
-                            conn.execute('''
-                                INSERT INTO wishlist (user_id, book_id, notes, added_at)
-                                VALUES (?, ?, ?, ?)
-                            ''', (current_user.id, book_id, my_review or '', date_added or None))
-                            stats['wishlist_added'] += 1
-                            logger.info(f"Added '{title}' to wishlist")
-
-                    elif shelf in ['read', 'currently-reading']:
-                        # Check if already in collections
-                        existing_collection = conn.execute(
-                            'SELECT * FROM collections WHERE user_id = ? AND book_id = ?',
-                            (current_user.id, book_id)
-                        ).fetchone()
-
-                        if existing_collection:
-                            stats['duplicates_skipped'] += 1
-                            logger.info(f"Skipping '{title}' - already in collections")
-                            continue
-
-                        # Map shelf to collection status
-                        if shelf == 'read':
-                            status = 'read'
-                        elif shelf == 'currently-reading':
-                            status = 'currently reading'
-                        else:
-                            status = 'want to read'
-
-                        # Add to collections (date_added is already formatted)
-                        conn.execute('''
-                            INSERT INTO collections (user_id, book_id, status, created_at)
-                            VALUES (?, ?, ?, ?)
-                        ''', (current_user.id, book_id, status, date_added))
-                        stats['collection_added'] += 1
-                        logger.info(f"Added '{title}' to collections with status '{status}'")
-
-                        # Add rating and review if provided
-                        if my_rating and my_rating != '0':
-                            conn.execute('''
-                                INSERT INTO read_data (user_id, book_id, rating, comment)
-                                VALUES (?, ?, ?, ?)
-                            ''', (current_user.id, book_id, int(my_rating), my_review or ''))
-                            stats['ratings_added'] += 1
-
-                        # Add reading session if date_read is provided (date_read is already formatted)
-                        if date_read and shelf == 'read':
-                            conn.execute('''
-                                INSERT INTO reading_sessions (user_id, book_id, date_started, date_completed)
-                                VALUES (?, ?, ?, ?)
-                            ''', (current_user.id, book_id, None, date_read))
-                            stats['sessions_added'] += 1
-                    else:
-                        stats['unknown_shelf'] += 1
-                        if stats['unknown_shelf'] <= 5:
-                            logger.warning(f"Unknown shelf '{shelf}' for book '{title}'")
-
-                except Exception as row_error:
-                    logger.error(f"Error processing row: {row_error}")
-                    stats['errors'].append(f"Error with book '{title}': {str(row_error)}")
-                    continue
+            job_id = create_job(conn, 'goodreads_import', user_id=current_user.id)
+        finally:
+            conn.close()
 
-            conn.commit()
+        start_job(job_id, run_goodreads_import, current_user.id, csv_path)
+        logger.info(f"User {current_user.username} started Goodreads import job {job_id}")
 
-            logger.info(f"Import completed: {stats}")
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('user.import_goodreads_status', job_id=job_id)
+        }), 202
 
-            # Return success with detailed stats
-            result = {
-                'success': True,
-                **stats
-            }
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': str(e)}), 500
 
-            # If nothing was added, include a warning
-            if stats['books_added'] == 0 and stats['wishlist_added'] == 0 and stats['collection_added'] == 0:
-                result['message'] = f"No items imported. Processed {stats['rows_processed']} rows. Unknown shelves: {stats['unknown_shelf']}. Check logs for details."
 
-            return jsonify(result)
+@user_blueprint.route('/import_goodreads/<int:job_id>')
+@login_required
+def import_goodreads_status(job_id):
+    """Report the progress of a Goodreads import job"""
+    conn = get_db_connection()
+    try:
+        job = get_job(conn, job_id)
+    finally:
+        conn.close()
 
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Import error: {str(e)}", exc_info=True)
-            return jsonify({'success': False, 'message': str(e)}), 500
+    if not job or job['job_type'] != 'goodreads_import' or job['user_id'] != current_user.id:
+        return jsonify({'success': False, 'message': 'Import not found'}), 404
 
-        finally:
-            conn.close()
+    return jsonify({
+        'success': job['status'] != 'failed',
+        'status': job['status'],
+        'processed': job['processed'],
+        'total': job['total'],
+        'stats': job['result'],
+        'message': job['message']
+    })
 
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-        return jsonify({'success': False, 'message': str(e)}), 500
+
+@user_blueprint.route('/image_status/<int:job_id>')
+@login_required
+def image_status(job_id):
+    """Report whether an uploaded cover or avatar has finished processing"""
+    conn = get_db_connection()
+    try:
+        job = get_job(conn, job_id)
+    finally:
+        conn.close()
+
+    if (not job or job['job_type'] not in (COVER_JOB_TYPE, AVATAR_JOB_TYPE)
+            or (job['user_id'] != current_user.id and not current_user.is_admin)):
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+
+    image_path = (job['result'] or {}).get('image_path')
+    return jsonify({
+        'success': job['status'] not in ('failed', 'cancelled'),
+        'status': job['status'],
+        'message': job['message'],
+        'image_url': url_for('static', filename=image_path) if image_path else None
+    })
 
 
 @user_blueprint.route('/add_to_shared_library/<int:user_id>', methods=['POST'])
@@ -1023,6 +723,7 @@ def add_to_shared_library(user_id):
         ''', (library_id, user_id, current_user.id))
 
         conn.commit()
+        invalidate_social_graph()
         flash(f"{friend['username']} added to your shared library!", 'success')
         current_app.logger.info(
             f"User {current_user.username} added {friend['username']} to shared library"
@@ -1061,6 +762,7 @@ def remove_from_shared_library(user_id):
         # Remove from library
         conn.execute('DELETE FROM library_members WHERE user_id = ?', (user_id,))
         conn.commit()
+        invalidate_social_graph()
 
         flash(f"{user['username']} removed from your shared library", 'success')
         current_app.logger.info(
@@ -1,9 +1,12 @@
 from flask import render_template, redirect, url_for, request, flash, Blueprint, current_app, jsonify
 from flask_login import login_required, current_user
 from utils.database import get_db_connection
+from utils.activity_utils import record_activity, remove_activity, record_collection_status
+from utils.stats_utils import invalidate_library_stats
+from utils.image_processing import queue_cover_processing
 from utils.book_utils import (
     fetch_book_details_from_isbn,
-    process_image,
+    save_cover_upload,
     download_and_save_cover,
     search_google_books
 )
@@ -31,7 +34,7 @@ def view_user_wishlist(username):
             return redirect(url_for('wishlist.view_wishlist'))
 
         # Check friendship status
-        from models import get_friendship_status
+        from models import get_friendship_status, visible_sql
         friendship_status = get_friendship_status(current_user.id, target_user_id)
 
         # Only allow viewing if they are friends
@@ -39,14 +42,15 @@ def view_user_wishlist(username):
             flash('You must be friends to view this wishlist!', 'warning')
             return redirect(url_for('user.profile', username=username))
 
-        # Get wishlist books for the target user
-        wishlist_books = conn.execute("""
+        # Get wishlist books for the target user, leaving out the ones they keep private
+        visible, visible_params = visible_sql(current_user.id, 'w.user_id', 'w.privacy')
+        wishlist_books = conn.execute(f"""
             SELECT b.*, w.wishlist_id, w.notes, w.added_at as wishlist_added_at
             FROM wishlist w
             JOIN books b ON w.book_id = b.id
-            WHERE w.user_id = ?
+            WHERE w.user_id = ? AND {visible}
             ORDER BY w.added_at DESC
-        """, (target_user_id,)).fetchall()
+        """, [target_user_id] + visible_params).fetchall()
 
         return render_template(
             "user_wishlist.html",
@@ -65,6 +69,7 @@ def view_wishlist():
         if "submit_book" in request.form:
             # Add book to wishlist
             # First, add to books table if it doesn't exist
+            cover_upload = None
             with get_db_connection() as conn:
                 # Check if book already exists by ISBN
                 isbn = request.form.get("isbn")
@@ -77,11 +82,12 @@ def view_wishlist():
                 if existing_book:
                     book_id = existing_book['id']
                 else:
-                    # Process uploaded image or use downloaded cover
-                    cover_image_url = process_image(
-                        request.files.get("image"),
-                        request.form.get("existing_cover_url")
-                    )
+                    # Uploaded images are processed in the background once the book exists
+                    try:
+                        cover_upload = save_cover_upload(request.files.get("image"))
+                    except ValueError as e:
+                        flash(f"{e}; the book was saved without it.", "error")
+                    cover_image_url = request.form.get("existing_cover_url")
 
                     # Insert new book
                     cursor = conn.execute("""
@@ -102,6 +108,7 @@ def view_wishlist():
                         current_user.id
                     ))
                     book_id = cursor.lastrowid
+                    invalidate_library_stats(conn)
 
                 # Add to wishlist
                 try:
@@ -109,6 +116,7 @@ def view_wishlist():
                         INSERT INTO wishlist (user_id, book_id, notes)
                         VALUES (?, ?, ?)
                     """, (current_user.id, book_id, request.form.get("notes", "")))
+                    record_activity(conn, current_user.id, 'wishlist_added', book_id)
                     conn.commit()
                     flash("Book added to wishlist!", "success")
                 except Exception as e:
@@ -117,7 +125,9 @@ def view_wishlist():
                     else:
                         flash(f"Error adding to wishlist: {str(e)}", "error")
 
-                return redirect(url_for("wishlist.view_wishlist"))
+            if cover_upload:
+                queue_cover_processing(book_id, cover_upload, user_id=current_user.id)
+            return redirect(url_for("wishlist.view_wishlist"))
 
     # Get wishlist books for display
     with get_db_connection() as conn:
@@ -264,6 +274,7 @@ def select_search_result():
                     current_user.id
                 ))
                 book_id = cursor.lastrowid
+                invalidate_library_stats(conn)
 
             # Add to wishlist
             try:
@@ -271,6 +282,7 @@ def select_search_result():
                     INSERT INTO wishlist (user_id, book_id, notes)
                     VALUES (?, ?, ?)
                 """, (current_user.id, book_id, ""))
+                record_activity(conn, current_user.id, 'wishlist_added', book_id)
                 conn.commit()
 
                 # Fetch the complete book data to return
@@ -376,12 +388,14 @@ def move_to_library(book_id):
                     INSERT INTO collections (user_id, book_id, status, created_at, updated_at)
                     VALUES (?, ?, 'want to read', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
                 """, (current_user.id, book_id))
+                record_collection_status(conn, current_user.id, book_id, 'want to read')
 
             # Remove from wishlist
             conn.execute("""
                 DELETE FROM wishlist
                 WHERE user_id = ? AND book_id = ?
             """, (current_user.id, book_id))
+            remove_activity(conn, current_user.id, 'wishlist_added', book_id)
 
             conn.commit()
             flash("Book added to your library!", "success")
@@ -421,6 +435,7 @@ def remove_from_wishlist(book_id):
             DELETE FROM wishlist
             WHERE user_id = ? AND book_id = ?
         """, (current_user.id, book_id))
+        remove_activity(conn, current_user.id, 'wishlist_added', book_id)
 
         # If the book has no other references, delete it
         book_was_deleted = False
@@ -428,6 +443,10 @@ def remove_from_wishlist(book_id):
             conn.execute("""
                 DELETE FROM books WHERE id = ?
             """, (book_id,))
+            conn.execute("""
+                DELETE FROM activities WHERE book_id = ?
+            """, (book_id,))
+            invalidate_library_stats(conn)
             flash("Book removed from wishlist and deleted.", "success")
             book_was_deleted = True
         else:
@@ -477,6 +496,7 @@ def quick_add_to_wishlist(book_id):
                 INSERT INTO wishlist (user_id, book_id)
                 VALUES (?, ?)
             """, (current_user.id, book_id))
+            record_activity(conn, current_user.id, 'wishlist_added', book_id)
             conn.commit()
             flash("Book added to wishlist!", "success")
         except Exception as e:
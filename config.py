@@ -5,6 +5,55 @@ class Config:
     DEBUG = False
     TESTING = False
     DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite:///library.db')
+    # Idle SQLite connections kept per worker process for reuse across requests
+    DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', 5))
+    # PRAGMAs applied to every new SQLite connection (see utils/database.py for defaults)
+    DATABASE_PRAGMAS = {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -16000)),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 134217728)),
+        'temp_store': 'MEMORY',
+    }
+    # Seconds between passive WAL checkpoints in each worker (0 disables)
+    DATABASE_CHECKPOINT_INTERVAL = int(os.getenv('DATABASE_CHECKPOINT_INTERVAL', 300))
+    # Background job threads per worker (Goodreads imports, ...)
+    BACKGROUND_JOB_WORKERS = int(os.getenv('BACKGROUND_JOB_WORKERS', 2))
+    # Processes per worker that decode and resize uploaded/downloaded images
+    IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', 2))
+    # Logged-in users cached per worker, and seconds before a cached user is
+    # reloaded (how long other workers may see a changed profile; 0 disables)
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+    # Library filter options (with counts) cached per worker, one entry per
+    # user and listing; recomputed after books, tags or shelves change
+    FILTER_FACET_CACHE_SIZE = int(os.getenv('FILTER_FACET_CACHE_SIZE', 512))
+    # Seconds between each worker's checks for notification changes to push,
+    # and before an open notification stream ends and the browser reconnects
+    NOTIFICATION_STREAM_POLL = float(os.getenv('NOTIFICATION_STREAM_POLL', 1))
+    NOTIFICATION_STREAM_LIFETIME = int(os.getenv('NOTIFICATION_STREAM_LIFETIME', 300))
+    # Most notification streams each worker holds open (each takes a thread;
+    # keep it well below gunicorn's --threads); past it, pages poll instead
+    NOTIFICATION_STREAM_MAX = int(os.getenv('NOTIFICATION_STREAM_MAX', 4))
+    # ISBN metadata cache lifetimes in seconds: found books, misses, and how
+    # long an expired entry is still served while it is refreshed
+    ISBN_CACHE_TTL = int(os.getenv('ISBN_CACHE_TTL', 30 * 24 * 3600))
+    ISBN_CACHE_MISS_TTL = int(os.getenv('ISBN_CACHE_MISS_TTL', 24 * 3600))
+    ISBN_CACHE_STALE_TTL = int(os.getenv('ISBN_CACHE_STALE_TTL', 7 * 24 * 3600))
+    # Seconds to wait on one book metadata/cover provider request, and on a
+    # whole lookup that queries several providers in parallel
+    PROVIDER_TIMEOUT = float(os.getenv('PROVIDER_TIMEOUT', 5))
+    PROVIDER_LOOKUP_BUDGET = float(os.getenv('PROVIDER_LOOKUP_BUDGET', 8))
+    # Consecutive failures before a provider is skipped, and seconds before it is retried
+    HTTP_BREAKER_THRESHOLD = int(os.getenv('HTTP_BREAKER_THRESHOLD', 5))
+    HTTP_BREAKER_RESET = int(os.getenv('HTTP_BREAKER_RESET', 60))
+    # Concurrent requests allowed to any one external host, per worker
+    HTTP_MAX_PER_HOST = int(os.getenv('HTTP_MAX_PER_HOST', 4))
+    # Books fetched at once by the bulk cover fetch job
+    BULK_COVER_CONCURRENCY = int(os.getenv('BULK_COVER_CONCURRENCY', 6))
+    # Seconds a stored cover must go unreferenced before it counts as orphaned
+    COVER_ORPHAN_GRACE = int(os.getenv('COVER_ORPHAN_GRACE', 3600))
     UPLOAD_FOLDER = os.path.join('static', 'uploads')  # Default path
     MAX_CONTENT_LENGTH = 20 * 1024 * 1024  # 20MB max upload size
 
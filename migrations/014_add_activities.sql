@@ -0,0 +1,55 @@
+-- Migration: Add activities table
+-- Materialized activity feed: one row per feed event, written when it happens,
+-- so /feed/activity reads a single indexed range instead of scanning
+-- books, wishlist, collections and read_data on every load
+
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,  -- The user whose activity this is
+    activity_type TEXT NOT NULL,  -- 'book_added', 'wishlist_added', 'collection_added', 'review_added'
+    book_id INTEGER NOT NULL,
+    status TEXT,  -- Collection status for 'collection_added'
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+    -- Same key as activity_likes and dismissed_activities
+    UNIQUE(activity_type, book_id, user_id)
+);
+
+-- Index for the feed: newest activities of a set of users
+CREATE INDEX IF NOT EXISTS idx_activities_user_created
+ON activities(user_id, created_at);
+
+-- Backfill from existing data, skipping dismissed activities
+INSERT OR IGNORE INTO activities (user_id, activity_type, book_id, created_at)
+SELECT b.added_by, 'book_added', b.id, b.created_at
+FROM books b
+WHERE b.added_by IS NOT NULL
+AND b.id NOT IN (SELECT book_id FROM wishlist);
+
+INSERT OR IGNORE INTO activities (user_id, activity_type, book_id, created_at)
+SELECT w.user_id, 'wishlist_added', w.book_id, w.added_at
+FROM wishlist w;
+
+INSERT OR IGNORE INTO activities (user_id, activity_type, book_id, status, created_at)
+SELECT c.user_id, 'collection_added', c.book_id, c.status, c.created_at
+FROM collections c
+WHERE c.status IN ('currently reading', 'want to read');
+
+INSERT OR IGNORE INTO activities (user_id, activity_type, book_id, created_at)
+SELECT r.user_id, 'review_added', r.book_id,
+       COALESCE((SELECT MAX(date_completed) FROM reading_sessions
+                 WHERE book_id = r.book_id AND user_id = r.user_id), CURRENT_TIMESTAMP)
+FROM read_data r
+WHERE r.rating IS NOT NULL OR r.comment IS NOT NULL;
+
+DELETE FROM activities
+WHERE EXISTS (
+    SELECT 1 FROM dismissed_activities da
+    WHERE da.activity_type = activities.activity_type
+    AND da.book_id = activities.book_id
+    AND da.user_id = activities.user_id
+);
+
+-- Verify with:
+-- SELECT activity_type, COUNT(*) FROM activities GROUP BY activity_type;
@@ -0,0 +1,70 @@
+-- Migration: Add user_stats rollup table
+-- Caches each user's reading statistics for the profile page. Triggers bump
+-- `version` whenever the underlying data changes; the app recomputes a user's
+-- stats only when `computed_version` has fallen behind (or a new month has
+-- started, since some stats are relative to today).
+-- Rebuild everything with: flask user rebuild-stats
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    stats TEXT,  -- JSON from utils.stats_utils.compute_user_stats()
+    period TEXT,  -- 'YYYY-MM' the stats were computed in
+    version INTEGER NOT NULL DEFAULT 0,
+    computed_version INTEGER,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Reviews and ratings
+CREATE TRIGGER IF NOT EXISTS user_stats_read_data_insert AFTER INSERT ON read_data BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id = new.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_read_data_update AFTER UPDATE ON read_data BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id IN (old.user_id, new.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_read_data_delete AFTER DELETE ON read_data BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id = old.user_id;
+END;
+
+-- Reading sessions
+CREATE TRIGGER IF NOT EXISTS user_stats_sessions_insert AFTER INSERT ON reading_sessions BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id = new.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_sessions_update AFTER UPDATE ON reading_sessions BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id IN (old.user_id, new.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_sessions_delete AFTER DELETE ON reading_sessions BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id = old.user_id;
+END;
+
+-- Collection statuses
+CREATE TRIGGER IF NOT EXISTS user_stats_collections_insert AFTER INSERT ON collections BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id = new.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_collections_update AFTER UPDATE ON collections BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id IN (old.user_id, new.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_collections_delete AFTER DELETE ON collections BEGIN
+    UPDATE user_stats SET version = version + 1 WHERE user_id = old.user_id;
+END;
+
+-- Book details feed into pages read, top genres and top authors for everyone who read it
+CREATE TRIGGER IF NOT EXISTS user_stats_books_update
+AFTER UPDATE OF author, genre, page_count ON books BEGIN
+    UPDATE user_stats SET version = version + 1
+    WHERE user_id IN (SELECT user_id FROM read_data WHERE book_id = new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_books_delete AFTER DELETE ON books BEGIN
+    UPDATE user_stats SET version = version + 1
+    WHERE user_id IN (SELECT user_id FROM read_data WHERE book_id = old.id);
+END;
+
+-- Verify with:
+-- SELECT user_id, period, version, computed_version, updated_at FROM user_stats;
@@ -0,0 +1,29 @@
+-- Migration: Add library_stats cache table
+-- Single-row cache for the whole-library stats shown on profiles and the admin
+-- settings page. Book writes bump `version` (utils.stats_utils.invalidate_library_stats),
+-- and so do triggers on collections, which read_books is counted from; the
+-- stats are recomputed on the next read when `computed_version` is behind.
+
+CREATE TABLE IF NOT EXISTS library_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    stats TEXT,  -- JSON from utils.stats_utils.compute_library_stats()
+    version INTEGER NOT NULL DEFAULT 0,
+    computed_version INTEGER,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO library_stats (id) VALUES (1);
+
+-- Read statuses
+CREATE TRIGGER IF NOT EXISTS library_stats_collections_insert AFTER INSERT ON collections BEGIN
+    UPDATE library_stats SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS library_stats_collections_update
+AFTER UPDATE OF book_id, status ON collections BEGIN
+    UPDATE library_stats SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS library_stats_collections_delete AFTER DELETE ON collections BEGIN
+    UPDATE library_stats SET version = version + 1 WHERE id = 1;
+END;
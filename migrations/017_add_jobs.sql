@@ -0,0 +1,23 @@
+-- Migration: Add jobs table
+-- Tracks long-running background work (e.g. Goodreads imports) so any worker
+-- process can report progress while another one does the work
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_type TEXT NOT NULL,  -- e.g. 'goodreads_import'
+    user_id INTEGER,  -- User who started the job
+    status TEXT NOT NULL DEFAULT 'queued' CHECK(status IN ('queued', 'running', 'completed', 'failed')),
+    processed INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,  -- NULL until known
+    result TEXT,  -- JSON, job-type specific
+    message TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Index for looking up a user's recent jobs of a given type
+CREATE INDEX IF NOT EXISTS idx_jobs_user_type
+ON jobs(user_id, job_type, created_at);
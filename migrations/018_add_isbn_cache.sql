@@ -0,0 +1,16 @@
+-- Migration: Add ISBN metadata cache
+-- Stores Google Books / Open Library lookups by ISBN-13, including misses,
+-- so repeat lookups of the same ISBN don't go back out to the providers
+
+CREATE TABLE IF NOT EXISTS isbn_cache (
+    isbn TEXT PRIMARY KEY,  -- Normalized ISBN-13
+    found INTEGER NOT NULL,  -- 0 = no provider had the book (negative entry)
+    data TEXT,  -- JSON provider response, NULL for misses
+    local_cover_url TEXT,  -- Last cover downloaded for this ISBN, relative to static/
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Index for purging expired entries
+CREATE INDEX IF NOT EXISTS idx_isbn_cache_expires
+ON isbn_cache(expires_at);
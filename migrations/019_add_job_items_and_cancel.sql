@@ -0,0 +1,48 @@
+-- Migration: Add job items and job cancellation
+-- job_items is the persistent work queue for jobs that process many rows
+-- (e.g. bulk cover fetching), so an interrupted job can resume where it
+-- stopped. jobs gains cancel_requested and the 'cancelled' status.
+
+-- SQLite can't change a CHECK constraint in place, so rebuild jobs
+CREATE TABLE jobs_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_type TEXT NOT NULL,  -- e.g. 'goodreads_import', 'bulk_covers'
+    user_id INTEGER,  -- User who started the job
+    status TEXT NOT NULL DEFAULT 'queued' CHECK(status IN ('queued', 'running', 'completed', 'failed', 'cancelled')),
+    processed INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,  -- NULL until known
+    result TEXT,  -- JSON, job-type specific
+    message TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+INSERT INTO jobs_new (id, job_type, user_id, status, processed, total, result, message,
+                      created_at, started_at, finished_at, updated_at)
+SELECT id, job_type, user_id, status, processed, total, result, message,
+       created_at, started_at, finished_at, updated_at
+FROM jobs;
+
+DROP TABLE jobs;
+ALTER TABLE jobs_new RENAME TO jobs;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_user_type
+ON jobs(user_id, job_type, created_at);
+
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,  -- e.g. a book ID
+    status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'done', 'failed')),
+    message TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_id, item_id),
+    FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+);
+
+-- Index for fetching a job's remaining work
+CREATE INDEX IF NOT EXISTS idx_job_items_status
+ON job_items(job_id, status);
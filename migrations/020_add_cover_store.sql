@@ -0,0 +1,82 @@
+-- Migration: Add content-addressed cover storage
+-- Covers are stored once per distinct image under
+-- static/uploads/covers/<hash[:2]>/<hash>.jpg (see utils/cover_store.py).
+-- Triggers keep ref_count equal to the number of books and ISBN cache
+-- entries pointing at each file, so unreferenced covers can be found with a
+-- query instead of walking the uploads directory.
+-- Move existing covers into the store with: flask books dedupe-covers
+
+CREATE TABLE IF NOT EXISTS cover_files (
+    hash TEXT PRIMARY KEY,  -- SHA-256 of the stored JPEG
+    path TEXT NOT NULL UNIQUE,  -- Relative to static/
+    size INTEGER NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    released_at TIMESTAMP  -- When ref_count last dropped to 0 (or creation, if never used)
+);
+
+-- Downloaded URLs and the cover they produced, so a known URL isn't fetched again
+CREATE TABLE IF NOT EXISTS cover_sources (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (hash) REFERENCES cover_files(hash) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_cover_sources_hash
+ON cover_sources(hash);
+
+-- Index for finding unreferenced covers
+CREATE INDEX IF NOT EXISTS idx_cover_files_unreferenced
+ON cover_files(released_at) WHERE ref_count = 0;
+
+-- Book covers
+CREATE TRIGGER IF NOT EXISTS cover_files_books_insert
+AFTER INSERT ON books WHEN new.cover_image_url IS NOT NULL BEGIN
+    UPDATE cover_files SET ref_count = ref_count + 1 WHERE path = new.cover_image_url;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cover_files_books_update
+AFTER UPDATE OF cover_image_url ON books
+WHEN old.cover_image_url IS NOT new.cover_image_url BEGIN
+    UPDATE cover_files
+    SET ref_count = MAX(ref_count - 1, 0),
+        released_at = CASE WHEN ref_count <= 1 THEN CURRENT_TIMESTAMP ELSE released_at END
+    WHERE path = old.cover_image_url;
+    UPDATE cover_files SET ref_count = ref_count + 1 WHERE path = new.cover_image_url;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cover_files_books_delete
+AFTER DELETE ON books WHEN old.cover_image_url IS NOT NULL BEGIN
+    UPDATE cover_files
+    SET ref_count = MAX(ref_count - 1, 0),
+        released_at = CASE WHEN ref_count <= 1 THEN CURRENT_TIMESTAMP ELSE released_at END
+    WHERE path = old.cover_image_url;
+END;
+
+-- Covers remembered by the ISBN cache
+CREATE TRIGGER IF NOT EXISTS cover_files_isbn_cache_insert
+AFTER INSERT ON isbn_cache WHEN new.local_cover_url IS NOT NULL BEGIN
+    UPDATE cover_files SET ref_count = ref_count + 1 WHERE path = new.local_cover_url;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cover_files_isbn_cache_update
+AFTER UPDATE OF local_cover_url ON isbn_cache
+WHEN old.local_cover_url IS NOT new.local_cover_url BEGIN
+    UPDATE cover_files
+    SET ref_count = MAX(ref_count - 1, 0),
+        released_at = CASE WHEN ref_count <= 1 THEN CURRENT_TIMESTAMP ELSE released_at END
+    WHERE path = old.local_cover_url;
+    UPDATE cover_files SET ref_count = ref_count + 1 WHERE path = new.local_cover_url;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cover_files_isbn_cache_delete
+AFTER DELETE ON isbn_cache WHEN old.local_cover_url IS NOT NULL BEGIN
+    UPDATE cover_files
+    SET ref_count = MAX(ref_count - 1, 0),
+        released_at = CASE WHEN ref_count <= 1 THEN CURRENT_TIMESTAMP ELSE released_at END
+    WHERE path = old.local_cover_url;
+END;
+
+-- Verify with:
+-- SELECT path, ref_count, released_at FROM cover_files ORDER BY ref_count;
@@ -0,0 +1,42 @@
+-- Migration: Add the uploads file index
+-- Every file under static/uploads, kept up to date on upload and delete and
+-- by an incremental rescan that only lists directories whose mtime has
+-- changed (see utils/upload_index.py). Orphan reports are read from here
+-- instead of walking the filesystem.
+-- Build it with: flask admin rescan-uploads
+
+CREATE TABLE IF NOT EXISTS upload_files (
+    path TEXT PRIMARY KEY,  -- Relative to static/
+    dir TEXT NOT NULL,  -- Containing directory, relative to static/
+    image_key TEXT NOT NULL,  -- Shared by an image and its thumbnails/alternative encodings
+    derived INTEGER NOT NULL DEFAULT 0,  -- 1 for thumbnails and alternative encodings
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,  -- Nanoseconds since the epoch
+    referenced INTEGER NOT NULL DEFAULT 1,  -- Recomputed by refresh_references()
+    indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_files_dir
+ON upload_files(dir);
+
+CREATE INDEX IF NOT EXISTS idx_upload_files_key
+ON upload_files(image_key);
+
+-- Index for the orphan report
+CREATE INDEX IF NOT EXISTS idx_upload_files_unreferenced
+ON upload_files(image_key) WHERE referenced = 0;
+
+-- Directory mtimes as of the last scan; a directory whose mtime hasn't
+-- changed has had nothing added, removed or renamed in it
+CREATE TABLE IF NOT EXISTS upload_dirs (
+    path TEXT PRIMARY KEY,  -- Relative to static/
+    parent TEXT,
+    mtime INTEGER NOT NULL,  -- Nanoseconds since the epoch
+    scanned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_dirs_parent
+ON upload_dirs(parent);
+
+-- Verify with:
+-- SELECT dir, COUNT(*), SUM(size), SUM(referenced = 0) FROM upload_files GROUP BY dir;
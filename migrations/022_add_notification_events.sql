@@ -0,0 +1,21 @@
+-- Migration: Add the notification events log
+-- Changes to a user's unread notification and pending friend request counts,
+-- written in the same transaction as the change (see
+-- utils/notification_utils.py). Each worker tails this table and pushes the
+-- new counts to that user's open notification streams, so the badge no
+-- longer polls. Rows are only needed for a few minutes and are pruned as new
+-- ones are written.
+
+CREATE TABLE IF NOT EXISTS notification_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Never reused, so streams can tell old events from new
+    user_id INTEGER NOT NULL,
+    friend_requests INTEGER NOT NULL DEFAULT 0,  -- Change in pending friend requests
+    notifications INTEGER NOT NULL DEFAULT 0,  -- Change in unread notifications
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_events_created
+ON notification_events(created_at);
+
+-- Verify with:
+-- SELECT user_id, SUM(friend_requests), SUM(notifications) FROM notification_events GROUP BY user_id;
@@ -0,0 +1,26 @@
+-- Migration: Add per-user notification badge counters
+-- Pending friend requests and unread notifications for each user, kept up
+-- to date by the app in the same transaction as every change to them (see
+-- publish_counts() in utils/notification_utils.py), so the badge reads one
+-- row instead of counting. A user without a row has nothing pending.
+-- Recount everything with: flask friends rebuild-counters
+
+CREATE TABLE IF NOT EXISTS user_counters (
+    user_id INTEGER PRIMARY KEY,
+    friend_requests INTEGER NOT NULL DEFAULT 0,  -- Pending friend requests received
+    notifications INTEGER NOT NULL DEFAULT 0,  -- Unread notifications (other than friend_request ones)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Backfill from existing data
+INSERT OR REPLACE INTO user_counters (user_id, friend_requests, notifications)
+SELECT u.id,
+       (SELECT COUNT(*) FROM friend_requests
+        WHERE receiver_id = u.id AND status = 'pending'),
+       (SELECT COUNT(*) FROM notifications
+        WHERE user_id = u.id AND is_read = 0 AND type != 'friend_request')
+FROM users u;
+
+-- Verify with:
+-- SELECT user_id, friend_requests, notifications FROM user_counters WHERE friend_requests + notifications > 0;
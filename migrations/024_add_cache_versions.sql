@@ -0,0 +1,63 @@
+-- Migration: Add version counters for in-memory caches
+-- Each worker keeps the social graph (friendships, pending friend requests
+-- and library membership) in memory (see utils/social_graph.py). Triggers
+-- bump the 'social_graph' version whenever those tables change, whoever
+-- changes them, and a worker reloads its copy when it sees a new version.
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('social_graph', 0);
+
+-- Friendships
+CREATE TRIGGER IF NOT EXISTS social_graph_friendships_insert
+AFTER INSERT ON friendships BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+CREATE TRIGGER IF NOT EXISTS social_graph_friendships_update
+AFTER UPDATE ON friendships BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+CREATE TRIGGER IF NOT EXISTS social_graph_friendships_delete
+AFTER DELETE ON friendships BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+-- Friend requests
+CREATE TRIGGER IF NOT EXISTS social_graph_friend_requests_insert
+AFTER INSERT ON friend_requests BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+CREATE TRIGGER IF NOT EXISTS social_graph_friend_requests_update
+AFTER UPDATE OF sender_id, receiver_id, status ON friend_requests BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+CREATE TRIGGER IF NOT EXISTS social_graph_friend_requests_delete
+AFTER DELETE ON friend_requests BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+-- Library membership
+CREATE TRIGGER IF NOT EXISTS social_graph_library_members_insert
+AFTER INSERT ON library_members BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+CREATE TRIGGER IF NOT EXISTS social_graph_library_members_update
+AFTER UPDATE OF library_id, user_id ON library_members BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+CREATE TRIGGER IF NOT EXISTS social_graph_library_members_delete
+AFTER DELETE ON library_members BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'social_graph';
+END;
+
+-- Verify with:
+-- SELECT * FROM cache_versions;
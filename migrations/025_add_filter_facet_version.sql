@@ -0,0 +1,75 @@
+-- Migration: Version the cached filter facets
+-- Each worker caches the genre, read status and tag options (with counts)
+-- shown in the listing filters (see utils/facet_utils.py). Triggers bump the
+-- 'filter_facets' version when books, tags, shelves or wishlists change, so
+-- workers recompute the facets instead of serving stale counts.
+-- Requires 024_add_cache_versions.sql
+
+INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('filter_facets', 0);
+
+-- Books (genre facet, and which books are in a listing)
+CREATE TRIGGER IF NOT EXISTS filter_facets_books_insert
+AFTER INSERT ON books BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_books_update
+AFTER UPDATE OF genre, added_by ON books BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_books_delete
+AFTER DELETE ON books BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+-- Tags
+CREATE TRIGGER IF NOT EXISTS filter_facets_book_tags_insert
+AFTER INSERT ON book_tags BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_book_tags_update
+AFTER UPDATE ON book_tags BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_book_tags_delete
+AFTER DELETE ON book_tags BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+-- Read statuses
+CREATE TRIGGER IF NOT EXISTS filter_facets_collections_insert
+AFTER INSERT ON collections BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_collections_update
+AFTER UPDATE OF user_id, book_id, status ON collections BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_collections_delete
+AFTER DELETE ON collections BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+-- Wishlisted books are left out of the listings
+CREATE TRIGGER IF NOT EXISTS filter_facets_wishlist_insert
+AFTER INSERT ON wishlist BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_wishlist_update
+AFTER UPDATE OF user_id, book_id ON wishlist BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+CREATE TRIGGER IF NOT EXISTS filter_facets_wishlist_delete
+AFTER DELETE ON wishlist BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'filter_facets';
+END;
+
+-- Verify with:
+-- SELECT * FROM cache_versions;
@@ -0,0 +1,31 @@
+-- Migration: Add the 'skipped' job item status
+-- Items a job no longer needed to work on (e.g. a book that was given a
+-- cover or deleted after the bulk cover fetch queued it) are marked
+-- 'skipped', so they aren't counted as done.
+
+-- SQLite can't change a CHECK constraint in place, so rebuild job_items
+CREATE TABLE job_items_new (
+    job_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,  -- e.g. a book ID
+    status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'done', 'skipped', 'failed')),
+    message TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_id, item_id),
+    FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
+);
+
+INSERT INTO job_items_new (job_id, item_id, status, message, updated_at)
+SELECT job_id, item_id,
+       CASE WHEN status = 'done' AND message LIKE 'Skipped:%' THEN 'skipped' ELSE status END,
+       message, updated_at
+FROM job_items;
+
+DROP TABLE job_items;
+ALTER TABLE job_items_new RENAME TO job_items;
+
+-- Index for fetching a job's remaining work
+CREATE INDEX IF NOT EXISTS idx_job_items_status
+ON job_items(job_id, status);
+
+-- Verify with:
+-- SELECT status, COUNT(*) FROM job_items GROUP BY status;
@@ -3,6 +3,7 @@ from functools import wraps
 from flask import abort, redirect, url_for
 from flask_login import current_user
 from utils.database import get_db_connection
+from utils.social_graph import get_social_graph
 
 class User(UserMixin):
     def __init__(self, id, username, email, is_active=True, is_admin=False, avatar_url=None, email_verified=True, bio=None):
@@ -47,18 +48,15 @@ def is_friends_with(user_id, other_user_id):
     if user_id == other_user_id:
         return True  # User is always "friends" with themselves
 
-    conn = get_db_connection()
-    try:
-        friendship = conn.execute('''
-            SELECT id FROM friendships
-            WHERE (user_id_1 = ? AND user_id_2 = ?)
-               OR (user_id_1 = ? AND user_id_2 = ?)
-        ''', (min(user_id, other_user_id), max(user_id, other_user_id),
-              min(user_id, other_user_id), max(user_id, other_user_id))).fetchone()
-
-        return friendship is not None
-    finally:
-        conn.close()
+    return get_social_graph().are_friends(user_id, other_user_id)
+
+
+def get_friend_ids(user_id):
+    """
+    Get the IDs of all of a user's friends (not including the user themselves).
+    Returns a list of user IDs.
+    """
+    return list(get_social_graph().friend_ids(user_id))
 
 
 def get_friendship_status(current_user_id, target_user_id):
@@ -69,35 +67,17 @@ def get_friendship_status(current_user_id, target_user_id):
     if current_user_id == target_user_id:
         return 'self'
 
-    conn = get_db_connection()
-    try:
-        # Check if friends
-        friendship = conn.execute('''
-            SELECT id FROM friendships
-            WHERE (user_id_1 = ? AND user_id_2 = ?)
-               OR (user_id_1 = ? AND user_id_2 = ?)
-        ''', (min(current_user_id, target_user_id), max(current_user_id, target_user_id),
-              min(current_user_id, target_user_id), max(current_user_id, target_user_id))).fetchone()
-
-        if friendship:
-            return 'friends'
-
-        # Check for pending friend request
-        friend_request = conn.execute('''
-            SELECT sender_id FROM friend_requests
-            WHERE ((sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?))
-              AND status = 'pending'
-        ''', (current_user_id, target_user_id, target_user_id, current_user_id)).fetchone()
-
-        if friend_request:
-            if friend_request['sender_id'] == current_user_id:
-                return 'request_sent'
-            else:
-                return 'request_received'
-
-        return 'none'
-    finally:
-        conn.close()
+    graph = get_social_graph()
+    if graph.are_friends(current_user_id, target_user_id):
+        return 'friends'
+
+    # Check for pending friend request
+    if graph.request_between(current_user_id, target_user_id):
+        return 'request_sent'
+    if graph.request_between(target_user_id, current_user_id):
+        return 'request_received'
+
+    return 'none'
 
 
 def get_library_members(user_id):
@@ -105,27 +85,7 @@ def get_library_members(user_id):
     Get all users who share a library with the given user (including the user themselves).
     Returns a list of user IDs.
     """
-    conn = get_db_connection()
-    try:
-        # Find the library this user belongs to
-        library = conn.execute('''
-            SELECT library_id FROM library_members
-            WHERE user_id = ?
-        ''', (user_id,)).fetchone()
-
-        if not library:
-            # User is not in any library group, return just themselves
-            return [user_id]
-
-        # Get all members of this library
-        members = conn.execute('''
-            SELECT user_id FROM library_members
-            WHERE library_id = ?
-        ''', (library['library_id'],)).fetchall()
-
-        return [m['user_id'] for m in members]
-    finally:
-        conn.close()
+    return list(get_social_graph().library_members(user_id))
 
 
 def shares_library_with(user_id, other_user_id):
@@ -136,8 +96,7 @@ def shares_library_with(user_id, other_user_id):
     if user_id == other_user_id:
         return True
 
-    library_members = get_library_members(user_id)
-    return other_user_id in library_members
+    return get_social_graph().share_library(user_id, other_user_id)
 
 
 def can_view_content(viewer_id, owner_id, privacy_setting):
@@ -172,4 +131,30 @@ def can_view_content(viewer_id, owner_id, privacy_setting):
         return is_friends_with(viewer_id, owner_id)
 
     # Default: deny access
-    return False
\ No newline at end of file
+    return False
+
+
+def visible_sql(viewer_id, owner_column, privacy_column):
+    """
+    SQL condition for the rows viewer_id can see, by the same rules as
+    can_view_content(), to filter a listing in its own query.
+
+    Args:
+        viewer_id: User looking at the rows
+        owner_column: Column holding each row's owner, e.g. 'w.user_id'
+        privacy_column: Column holding each row's privacy setting, e.g. 'w.privacy'
+
+    Returns:
+        tuple: (condition, params) to add to the query's WHERE clause
+    """
+    graph = get_social_graph()
+    household = list(graph.library_members(viewer_id))
+    friends = list(graph.friend_ids(viewer_id))
+
+    condition = (f"({owner_column} IN ({','.join('?' for _ in household)})"
+                 f" OR {privacy_column} = 'public'")
+    if friends:
+        condition += (f" OR ({privacy_column} = 'friends'"
+                      f" AND {owner_column} IN ({','.join('?' for _ in friends)}))")
+    condition += ")"
+    return condition, household + friends
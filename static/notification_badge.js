@@ -1,4 +1,18 @@
-// Simple notification badge - shows red dot when there are notifications
+// Simple notification badge - shows red dot when there are notifications.
+// Counts are pushed over Server-Sent Events (/friends/notification_stream);
+// browsers without EventSource, or whose stream is refused, poll instead.
+
+function setNotificationBadge(count) {
+    const badge = document.getElementById('notification-badge');
+
+    if (badge) {
+        if (count > 0) {
+            badge.classList.remove('hidden');
+        } else {
+            badge.classList.add('hidden');
+        }
+    }
+}
 
 async function updateNotificationBadge() {
     try {
@@ -6,22 +20,35 @@ async function updateNotificationBadge() {
         if (!response.ok) return;
 
         const data = await response.json();
-        const badge = document.getElementById('notification-badge');
-
-        if (badge) {
-            if (data.count > 0) {
-                badge.classList.remove('hidden');
-            } else {
-                badge.classList.add('hidden');
-            }
-        }
+        setNotificationBadge(data.count);
     } catch (error) {
         console.error('Error fetching notification count:', error);
     }
 }
 
-// Update badge on page load
-document.addEventListener('DOMContentLoaded', updateNotificationBadge);
+function pollNotificationBadge() {
+    updateNotificationBadge();
+    // Refresh badge every 30 seconds
+    setInterval(updateNotificationBadge, 30000);
+}
+
+function streamNotificationBadge() {
+    if (!window.EventSource) {
+        pollNotificationBadge();
+        return;
+    }
+
+    const source = new EventSource('/friends/notification_stream');
+    source.addEventListener('counts', event => {
+        setNotificationBadge(JSON.parse(event.data).count);
+    });
+    source.onerror = () => {
+        // EventSource reconnects by itself after the server ends a stream;
+        // it only gives up (CLOSED) when the stream is refused
+        if (source.readyState === EventSource.CLOSED) {
+            pollNotificationBadge();
+        }
+    };
+}
 
-// Refresh badge every 30 seconds
-setInterval(updateNotificationBadge, 30000);
+document.addEventListener('DOMContentLoaded', streamNotificationBadge);
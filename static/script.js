@@ -32,6 +32,22 @@ function getCSRFHeaders() {
     };
 }
 
+// Wait for an uploaded image to finish processing (see /user/image_status);
+// resolves with the processed image's URL
+async function waitForProcessedImage(statusUrl, interval = 1000) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+        if (data.status === 'completed') {
+            return data.image_url;
+        }
+        if (!data.success) {
+            throw new Error(data.message || 'Image processing failed');
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
 // // NEW JAVASCRIPT FOR BETTER SEARCH BAR NOT WORKING ROLLED BACK
 //
 // // Initialize everything on page load
@@ -278,13 +294,13 @@ function updateActiveFilters() {
     // Check genre
     const genre = document.getElementById('genre');
     if (genre && genre.value) {
-        activeFilters.push({ label: 'Genre', value: genre.options[genre.selectedIndex].text });
+        activeFilters.push({ label: 'Genre', value: genre.value });  // Option text includes the count
     }
 
     // Check read status
     const readStatus = document.getElementById('read_status');
     if (readStatus && readStatus.value) {
-        activeFilters.push({ label: 'Status', value: readStatus.options[readStatus.selectedIndex].text });
+        activeFilters.push({ label: 'Status', value: readStatus.value });  // Option text includes the count
     }
 
     // Check rating
@@ -703,6 +719,7 @@ function createCollection() {
 class InfiniteScroll {
     constructor() {
         this.currentPage = 1;
+        this.nextCursor = null;
         this.isLoading = false;
         this.hasMore = true;
         this.bookGrid = null;
@@ -723,6 +740,7 @@ class InfiniteScroll {
         if (gridContainer && gridContainer.hasAttribute('data-current-page')) {
             this.currentPage = parseInt(gridContainer.dataset.currentPage) || 1;
             this.hasMore = gridContainer.dataset.hasMore === 'true';
+            this.nextCursor = gridContainer.dataset.nextCursor || null;
         }
 
         // Create and insert loading indicator
@@ -806,8 +824,12 @@ class InfiniteScroll {
             const url = new URL(window.location.href);
             const params = new URLSearchParams(url.search);
 
-            // Add pagination parameters
+            // Add pagination parameters - the cursor lets the server seek
+            // straight to the next page instead of counting past an offset
             params.set('page', this.currentPage + 1);
+            if (this.nextCursor) {
+                params.set('cursor', this.nextCursor);
+            }
 
             // Make AJAX request
             const response = await fetch(`${url.pathname}?${params.toString()}`, {
@@ -820,12 +842,19 @@ class InfiniteScroll {
 
             const data = await response.json();
 
+            // The server starts over from page 1 if the cursor no longer
+            // matches the listing; replace the grid rather than repeat rows
+            if (data.current_page <= this.currentPage) {
+                this.bookGrid.querySelectorAll('.group').forEach(card => card.remove());
+            }
+
             // Append new books to grid
             this.appendBooks(data.books);
 
             // Update state
             this.currentPage = data.current_page;
             this.hasMore = data.has_more;
+            this.nextCursor = data.next_cursor || null;
 
             // Update result count
             this.updateResultCount(data.total_count, this.bookGrid.querySelectorAll('.group').length);
@@ -861,6 +890,7 @@ class InfiniteScroll {
             // List view card
             const coverImage = book.cover_image_url
                 ? `<img src="/static/${book.cover_image_url}"
+                        ${book.cover_srcset ? `srcset="${book.cover_srcset}" sizes="96px"` : ''}
                         alt="${this.escapeHtml(book.title)}"
                         class="book-cover-img object-cover w-full h-full" />`
                 : `<div class="flex items-center justify-center h-full bg-primary-bg text-content-secondary">
@@ -889,6 +919,7 @@ class InfiniteScroll {
             // Grid view card
             const coverImage = book.cover_image_url
                 ? `<img src="/static/${book.cover_image_url}"
+                        ${book.cover_srcset ? `srcset="${book.cover_srcset}" sizes="(min-width: 1280px) 20vw, (min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw"` : ''}
                         alt="${this.escapeHtml(book.title)}"
                         class="book-cover-img object-cover w-full h-full group-hover:opacity-90 transition-opacity duration-200" />`
                 : `<div class="flex items-center justify-center h-full bg-primary-bg text-content-secondary">
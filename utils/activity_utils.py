@@ -0,0 +1,51 @@
+"""
+Activity feed event recording (see migrations/014_add_activities.sql)
+
+Feed events are written to the activities table when they happen, using the
+caller's connection so they commit (or roll back) with the change itself.
+"""
+
+# Collection statuses that show up in the activity feed
+FEED_COLLECTION_STATUSES = ('currently reading', 'want to read')
+
+
+def record_activity(conn, user_id, activity_type, book_id, status=None):
+    """
+    Record a feed event, or bump an existing one for the same book to the top.
+    Events the user has dismissed are not recorded again.
+
+    Args:
+        conn: Database connection (not committed here)
+        user_id: User whose activity this is
+        activity_type: 'book_added', 'wishlist_added', 'collection_added' or 'review_added'
+        book_id: Book the activity is about
+        status: Collection status, for 'collection_added'
+    """
+    # Activities their owner dismissed from the feed stay dismissed
+    conn.execute('''
+        INSERT INTO activities (user_id, activity_type, book_id, status)
+        SELECT ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM dismissed_activities
+            WHERE activity_type = ? AND book_id = ? AND user_id = ?
+        )
+        ON CONFLICT(activity_type, book_id, user_id) DO UPDATE SET
+            status = excluded.status,
+            created_at = CURRENT_TIMESTAMP
+    ''', (user_id, activity_type, book_id, status, activity_type, book_id, user_id))
+
+
+def remove_activity(conn, user_id, activity_type, book_id):
+    """Remove a feed event, e.g. when the wishlist entry behind it is deleted"""
+    conn.execute('''
+        DELETE FROM activities
+        WHERE user_id = ? AND activity_type = ? AND book_id = ?
+    ''', (user_id, activity_type, book_id))
+
+
+def record_collection_status(conn, user_id, book_id, status):
+    """Record a collection status change; only some statuses appear in the feed"""
+    if status in FEED_COLLECTION_STATUSES:
+        record_activity(conn, user_id, 'collection_added', book_id, status)
+    else:
+        remove_activity(conn, user_id, 'collection_added', book_id)
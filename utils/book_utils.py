@@ -1,27 +1,72 @@
 from flask import current_app
-from werkzeug.utils import secure_filename
-from PIL import Image, ImageOps
 import requests
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait
 from typing import Optional, Dict, Any
 from utils.database import get_db_connection
-from flask_login import current_user
+from utils.isbn_cache_utils import normalize_isbn, get_cached_metadata, store_metadata, set_cached_cover
+from utils.jobs import run_in_background
+from utils.http_client import http_get, http_head, ProviderUnavailable
+from utils.cover_store import COVER_MAX_SIZE, find_cover_for_url, is_stored_cover
+from utils.image_processing import store_cover_image, save_image_upload, is_image_file, discard_upload
 
 # Constants
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-MAX_IMAGE_SIZE = (500, 1000)
+MAX_IMAGE_SIZE = COVER_MAX_SIZE
+
+# Seconds to wait on a single provider request, and on a whole multi-provider lookup
+DEFAULT_PROVIDER_TIMEOUT = 5
+DEFAULT_PROVIDER_LOOKUP_BUDGET = 8
+PROVIDER_THREADS = 8
+
+# ISBNs with a background cache refresh in flight in this process
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+_provider_executor = None
+_provider_executor_pid = None
+_provider_executor_lock = threading.Lock()
 
 from typing import Optional, Dict, Any, List
 from flask import current_app
 import requests
 from urllib.parse import quote_plus
 
+def _provider_timeout() -> float:
+    return current_app.config.get('PROVIDER_TIMEOUT', DEFAULT_PROVIDER_TIMEOUT)
+
+def _run_providers(calls: list) -> list:
+    """Start provider calls concurrently on this process's provider thread pool.
+
+    Args:
+        calls: List of (function, args) tuples
+
+    Returns:
+        List of futures, in the same order as calls
+    """
+    global _provider_executor, _provider_executor_pid
+    if _provider_executor_pid != os.getpid():
+        with _provider_executor_lock:
+            if _provider_executor_pid != os.getpid():
+                _provider_executor = ThreadPoolExecutor(max_workers=PROVIDER_THREADS,
+                                                        thread_name_prefix='provider')
+                _provider_executor_pid = os.getpid()
+
+    app = current_app._get_current_object()
+
+    def run(fn, args):
+        with app.app_context():
+            return fn(*args)
+
+    return [_provider_executor.submit(run, fn, args) for fn, args in calls]
+
 def search_google_books(query: str, max_results: int = 15) -> List[Dict[str, Any]]:
     """Search Google Books API by title/author and return formatted results."""
     api_url = f"https://www.googleapis.com/books/v1/volumes?q={quote_plus(query)}&key={os.getenv('GOOGLE_BOOKS_API_KEY')}"
     try:
-        http_response = requests.get(api_url)
+        http_response = http_get(api_url, provider='google_books', timeout=_provider_timeout())
         http_response.raise_for_status()  # Raise exception for bad status codes
         response = http_response.json()
 
@@ -86,11 +131,15 @@ def search_google_books(query: str, max_results: int = 15) -> List[Dict[str, Any
         current_app.logger.error(f"Google Books search error: {str(e)}")
         return []
 
-def fetch_google_books(isbn: str) -> Optional[Dict[str, Any]]:
-    """Fetch book details from Google Books API with highest resolution cover."""
+def fetch_google_books(isbn: str, raise_errors: bool = False) -> Optional[Dict[str, Any]]:
+    """Fetch book details from Google Books API with highest resolution cover.
+
+    Returns None when the book isn't found; errors also return None unless
+    raise_errors is set.
+    """
     api_url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{isbn}&key={os.getenv('GOOGLE_BOOKS_API_KEY')}"
     try:
-        http_response = requests.get(api_url)
+        http_response = http_get(api_url, provider='google_books', timeout=_provider_timeout())
         http_response.raise_for_status()
         response = http_response.json()
 
@@ -98,6 +147,8 @@ def fetch_google_books(isbn: str) -> Optional[Dict[str, Any]]:
         if "error" in response:
             error_msg = response.get("error", {}).get("message", "Unknown API error")
             current_app.logger.error(f"Google Books API error: {error_msg}")
+            if raise_errors:
+                raise Exception(f"Google Books API error: {error_msg}")
             return None
 
         if "items" not in response:
@@ -138,13 +189,15 @@ def fetch_google_books(isbn: str) -> Optional[Dict[str, Any]]:
         }
     except Exception as e:
         current_app.logger.error(f"Google Books API error: {str(e)}")
+        if raise_errors:
+            raise
         return None
 
-def fetch_open_library(isbn: str) -> Optional[Dict[str, Any]]:
-    """Fetch book details from Open Library API."""
+def fetch_open_library(isbn: str, raise_errors: bool = False) -> Optional[Dict[str, Any]]:
+    """Fetch book details from Open Library API (see fetch_google_books for raise_errors)."""
     api_url = f"https://openlibrary.org/api/books?bibkeys=ISBN:{isbn}&format=json&jscmd=data"
     try:
-        response = requests.get(api_url).json()
+        response = http_get(api_url, provider='open_library', timeout=_provider_timeout()).json()
         book_key = f"ISBN:{isbn}"
 
         if book_key not in response:
@@ -188,24 +241,126 @@ def fetch_open_library(isbn: str) -> Optional[Dict[str, Any]]:
         }
     except Exception as e:
         current_app.logger.error(f"Open Library API error: {str(e)}")
+        if raise_errors:
+            raise
         return None
 
+def _lookup_isbn(isbn: str) -> Optional[Dict[str, Any]]:
+    """Ask all providers for an ISBN's metadata at once.
+
+    Providers are queried in parallel and the first one in priority order
+    (Google Books, then Open Library) with a result wins, so a slow or hung
+    provider costs at most PROVIDER_LOOKUP_BUDGET seconds. Returns None if
+    no provider has the book; raises if none had it and at least one failed
+    or timed out, so an outage isn't cached as a miss.
+    """
+    futures = _run_providers([(fetch_google_books, (isbn, True)),
+                              (fetch_open_library, (isbn, True))])
+    budget = current_app.config.get('PROVIDER_LOOKUP_BUDGET', DEFAULT_PROVIDER_LOOKUP_BUDGET)
+    deadline = time.monotonic() + budget
+
+    error = None
+    for future in futures:
+        try:
+            book_details = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FuturesTimeoutError:
+            error = error or TimeoutError(f"ISBN lookup exceeded {budget}s")
+            continue
+        except Exception as e:
+            error = error or e
+            continue
+        if book_details:
+            return book_details
+    if error:
+        raise error
+    return None
+
+def _refresh_isbn_metadata(isbn13: str) -> Optional[Dict[str, Any]]:
+    """Fetch an ISBN from the providers and store the result in the cache."""
+    book_details = _lookup_isbn(isbn13)
+    store_metadata(get_db_connection(), isbn13, book_details)
+    return book_details
+
+def _revalidate_isbn(isbn13: str) -> None:
+    """Background refresh of a stale cache entry."""
+    try:
+        _refresh_isbn_metadata(isbn13)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(isbn13)
+
+def _cached_cover(local_cover_url: Optional[str]) -> Optional[str]:
+    """Reuse the cover downloaded for an earlier lookup of the same ISBN.
+
+    Stored covers are shared between books (see utils/cover_store.py).
+    Legacy per-book files are deleted with their book, so they aren't reused.
+    """
+    if not is_stored_cover(local_cover_url):
+        return None
+    if not os.path.exists(os.path.join(current_app.root_path, 'static', local_cover_url)):
+        return None
+    return local_cover_url
+
 def fetch_book_details_from_isbn(isbn: str) -> Optional[Dict[str, Any]]:
-    """Try multiple APIs to fetch book details with high-res covers and fallback support."""
-    book_details = fetch_google_books(isbn)
+    """Try multiple APIs to fetch book details with high-res covers and fallback support.
+
+    Lookups go through the isbn_cache table: known ISBNs (and known misses)
+    are answered without contacting the providers, expired entries are
+    served while being refreshed in the background, and a cover downloaded
+    for an earlier lookup is reused instead of downloaded again.
+    """
+    isbn13 = normalize_isbn(isbn)
+    if not isbn13:
+        # Not a valid ISBN; still let the providers have a go, uncached
+        try:
+            book_details = _lookup_isbn(isbn)
+        except Exception as e:
+            current_app.logger.error(f"ISBN lookup failed for {isbn}: {str(e)}")
+            book_details = None
+        cached_cover = None
+    else:
+        conn = get_db_connection()
+        entry = get_cached_metadata(conn, isbn13)
+
+        if entry and entry['usable']:
+            if not entry['fresh']:
+                with _revalidating_lock:
+                    refresh = isbn13 not in _revalidating
+                    _revalidating.add(isbn13)
+                if refresh:
+                    run_in_background(_revalidate_isbn, isbn13)
+            book_details = entry['data']
+            cached_cover = entry['local_cover_url']
+        else:
+            try:
+                book_details = _refresh_isbn_metadata(isbn13)
+            except Exception as e:
+                current_app.logger.error(f"ISBN lookup failed for {isbn}: {str(e)}")
+                # Fall back to an expired entry rather than nothing
+                book_details = entry['data'] if entry else None
+            cached_cover = entry['local_cover_url'] if entry else None
 
     if not book_details:
-        book_details = fetch_open_library(isbn)
+        return None
+
+    # Report the ISBN as the caller gave it, as the providers do
+    book_details = dict(book_details, isbn=isbn)
+
+    if book_details.get("cover_image_url"):
+        local_cover_url = _cached_cover(cached_cover) if isbn13 else None
+
+        if not local_cover_url:
+            # Download cover with fallback URL support
+            primary_url = book_details["cover_image_url"]
+            fallback_urls = book_details.get("cover_fallback_urls")
 
-    if book_details and book_details.get("cover_image_url"):
-        # Download cover with fallback URL support
-        primary_url = book_details["cover_image_url"]
-        fallback_urls = book_details.get("cover_fallback_urls")
+            local_cover_url = download_and_save_cover(primary_url, fallback_urls)
+            if local_cover_url and isbn13:
+                set_cached_cover(get_db_connection(), isbn13, local_cover_url)
 
-        local_cover_url = download_and_save_cover(primary_url, fallback_urls)
         if local_cover_url:
             book_details["local_cover_url"] = local_cover_url
-            book_details["thumbnail_url"] = primary_url
+            book_details["thumbnail_url"] = book_details["cover_image_url"]
         else:
             current_app.logger.warning(f"Failed to download any cover images for ISBN {isbn}")
 
@@ -214,34 +369,33 @@ def fetch_book_details_from_isbn(isbn: str) -> Optional[Dict[str, Any]]:
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_image(image_file, existing_url: Optional[str] = None) -> Optional[str]:
-    """Process and save uploaded image."""
-    if not image_file or image_file.filename == '':
-        return existing_url
-        
-    if image_file and allowed_file(image_file.filename):
-        filename = secure_filename(image_file.filename)
-        timestamp = int(time.time())
-        unique_filename = f"{filename.split('.')[0]}_{timestamp}.{filename.split('.')[-1]}"
-        
-        # Use absolute path for saving but return relative path for database
-        save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Ensure upload directory exists
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        
-        img = Image.open(image_file)
-        img.thumbnail(MAX_IMAGE_SIZE)
-        img = ImageOps.exif_transpose(img)
-        img.save(save_path)
-        
-        # Return relative path for database storage
-        return os.path.join('uploads', unique_filename)
-    return existing_url
+def save_cover_upload(image_file) -> Optional[str]:
+    """Spool an uploaded cover to disk for queue_cover_processing (see utils/image_processing.py).
+
+    The file's header is checked here, so an upload that isn't an image is
+    turned away while the user can still be told, rather than failing in
+    the background.
+
+    Returns:
+        Path of the spooled file, or None if no (allowed) file was uploaded
+
+    Raises:
+        ValueError: If the uploaded file can't be read as an image
+    """
+    if not image_file or image_file.filename == '' or not allowed_file(image_file.filename):
+        return None
+    raw_path = save_image_upload(image_file)
+    if not is_image_file(raw_path):
+        discard_upload(raw_path)
+        raise ValueError("The uploaded cover could not be read as an image")
+    return raw_path
 
 def download_and_save_cover(url: str, fallback_urls: Optional[list] = None) -> Optional[str]:
     """Download and save cover image from URL with fallback support.
 
+    Covers go into the content-addressed store, and a URL that has been
+    downloaded before is answered from the store without fetching it again.
+
     Args:
         url: Primary image URL to download
         fallback_urls: Optional list of fallback URLs to try if primary fails
@@ -258,68 +412,41 @@ def download_and_save_cover(url: str, fallback_urls: Optional[list] = None) -> O
     if fallback_urls:
         urls_to_try.extend(fallback_urls)
 
-    # Create a session with headers to mimic a browser
-    session = requests.Session()
-    session.headers.update({
+    # Send headers that mimic a browser
+    headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    })
+    }
 
     # Try each URL in order
     for attempt_num, attempt_url in enumerate(urls_to_try, 1):
+        stored_cover = find_cover_for_url(attempt_url)
+        if stored_cover:
+            current_app.logger.debug(f"Already downloaded {attempt_url}: {stored_cover}")
+            return stored_cover
+
         try:
             current_app.logger.debug(f"Download attempt {attempt_num}/{len(urls_to_try)} from: {attempt_url}")
 
-            # Try to get the image with a timeout
-            response = session.get(attempt_url, stream=True, timeout=10)
-            response.raise_for_status()  # Raise an exception for bad status codes
-
+            # Try to get the image with a timeout (through the shared client,
+            # so connections to each image host are reused). Covers are small,
+            # so the body is read inside the client's per-host limit.
+            response = http_get(attempt_url, headers=headers, timeout=10)
             if response.status_code != 200:
                 current_app.logger.warning(f"Attempt {attempt_num} failed. Status code: {response.status_code}")
+                response.close()
                 continue  # Try next URL
 
-            # Generate unique filename
-            timestamp = int(time.time())
-            filename = f"cover_{timestamp}_{attempt_num}.jpg"
-
-            # Ensure the upload directory exists
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            os.makedirs(upload_folder, exist_ok=True)
-
-            save_path = os.path.join(upload_folder, filename)
-            current_app.logger.debug(f"Will save image to: {save_path}")
-
-            # Save the raw image data first
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-
-            # Now process with Pillow
+            # Resize in the image pool straight from the response body;
+            # identical covers share one file
             try:
-                with Image.open(save_path) as img:
-                    # Convert to RGB if necessary
-                    if img.mode in ('RGBA', 'P'):
-                        img = img.convert('RGB')
-
-                    # Resize while maintaining aspect ratio
-                    img.thumbnail(MAX_IMAGE_SIZE)
-
-                    # Handle EXIF orientation
-                    img = ImageOps.exif_transpose(img)
+                relative_path = store_cover_image(response.content, source_url=attempt_url)
 
-                    # Save with optimal settings
-                    img.save(save_path, 'JPEG', quality=85, optimize=True)
-
-                relative_path = os.path.join('uploads', filename)
                 resolution = "primary" if attempt_num == 1 else f"fallback #{attempt_num - 1}"
                 current_app.logger.info(f"Successfully saved image ({resolution}) at: {relative_path}")
                 return relative_path
 
             except Exception as e:
                 current_app.logger.warning(f"Error processing image from attempt {attempt_num}: {str(e)}")
-                # Try to remove the failed file
-                if os.path.exists(save_path):
-                    os.remove(save_path)
                 continue  # Try next URL
 
         except requests.RequestException as e:
@@ -350,13 +477,17 @@ def fetch_cover_by_isbn_direct(isbn: str) -> Optional[str]:
         url = f"https://covers.openlibrary.org/b/isbn/{clean_isbn}-{size}.jpg"
         try:
             # Check if the cover exists (Open Library returns a 1x1 pixel for missing covers)
-            response = requests.head(url, timeout=5, allow_redirects=True)
+            response = http_head(url, provider='open_library_covers', timeout=_provider_timeout(),
+                                 allow_redirects=True)
             if response.status_code == 200:
                 # Check content length to avoid tiny placeholder images
                 content_length = int(response.headers.get('content-length', 0))
                 if content_length > 1000:  # More than 1KB suggests real cover
                     current_app.logger.info(f"Found Open Library cover (size {size}): {url}")
                     return url
+        except ProviderUnavailable:
+            # No point trying the smaller sizes
+            return None
         except Exception as e:
             current_app.logger.debug(f"Open Library cover check failed for {url}: {str(e)}")
             continue
@@ -380,7 +511,7 @@ def fetch_goodreads_cover(isbn: str = None, title: str = None, author: str = Non
                 "author_name": author
             }
 
-            response = requests.get(base_url, params=params, timeout=10)
+            response = http_get(base_url, provider='bookcover_api', params=params, timeout=_provider_timeout())
 
             # Check if we got a successful response
             if response.status_code == 200:
@@ -404,91 +535,95 @@ def fetch_goodreads_cover(isbn: str = None, title: str = None, author: str = Non
         current_app.logger.warning(f"Goodreads BookCover API error: {str(e)}")
         return None
 
+def _covers_from_isbn_direct(isbn: str) -> list:
+    url = fetch_cover_by_isbn_direct(isbn)
+    return [(url, "Open Library Direct", 1)] if url else []
+
+def _covers_from_google_isbn(isbn: str) -> list:
+    google_data = fetch_google_books(isbn)
+    if google_data and google_data.get("cover_image_url"):
+        return [(google_data["cover_image_url"], "Google Books (ISBN)", 2)]
+    return []
+
+def _covers_from_open_library_isbn(isbn: str) -> list:
+    ol_data = fetch_open_library(isbn)
+    if ol_data and ol_data.get("cover_image_url"):
+        return [(ol_data["cover_image_url"], "Open Library (ISBN)", 3)]
+    return []
+
+def _covers_from_goodreads(title: str, author: str) -> list:
+    url = fetch_goodreads_cover(title=title, author=author)
+    return [(url, "Goodreads", 4)] if url else []
+
+def _covers_from_google_search(title: str, author: Optional[str], isbn: Optional[str]) -> list:
+    covers = []
+    query = f"{title} {author}".strip() if author else title
+    search_results = search_google_books(query, max_results=3)
+
+    for idx, result in enumerate(search_results):
+        thumbnail_url = result.get("volumeInfo", {}).get("imageLinks", {}).get("thumbnail")
+        if thumbnail_url:
+            # Try to get ISBN from search result for Open Library lookup
+            result_isbn = None
+            identifiers = result.get("volumeInfo", {}).get("industryIdentifiers", [])
+            for identifier in identifiers:
+                if identifier.get("type") in ["ISBN_13", "ISBN_10"]:
+                    result_isbn = identifier.get("identifier")
+                    break
+
+            # If we found an ISBN in the search result, try Open Library direct
+            if result_isbn and not isbn:  # Only if we didn't already try with main ISBN
+                ol_direct_url = fetch_cover_by_isbn_direct(result_isbn)
+                if ol_direct_url:
+                    covers.append((ol_direct_url, f"Open Library (Search Result #{idx+1})", 5 + idx))
+
+            covers.append((thumbnail_url, f"Google Books (Search #{idx+1})", 6 + idx))
+
+    return covers
+
 def search_covers_multiple_sources(isbn: str = None, title: str = None, author: str = None) -> list:
     """Search multiple sources for book covers and return all found URLs.
 
+    All sources are queried in parallel; any that haven't answered within
+    PROVIDER_LOOKUP_BUDGET seconds are left out of the results.
+
     Returns:
         List of tuples: [(url, source_name, priority), ...]
         Priority: lower number = better quality/more reliable
     """
-    covers = []
-
-    # Source 1: Open Library direct ISBN lookup (often best quality)
-    if isbn:
-        ol_direct_url = fetch_cover_by_isbn_direct(isbn)
-        if ol_direct_url:
-            covers.append((ol_direct_url, "Open Library Direct", 1))
+    sources = []
 
-    # Source 2: Google Books via ISBN
     if isbn:
-        google_data = fetch_google_books(isbn)
-        if google_data and google_data.get("cover_image_url"):
-            covers.append((google_data["cover_image_url"], "Google Books (ISBN)", 2))
-
-    # Source 3: Open Library Books API via ISBN
-    if isbn:
-        ol_data = fetch_open_library(isbn)
-        if ol_data and ol_data.get("cover_image_url"):
-            covers.append((ol_data["cover_image_url"], "Open Library (ISBN)", 3))
+        # Source 1: Open Library direct ISBN lookup (often best quality)
+        sources.append((_covers_from_isbn_direct, (isbn,)))
+        # Source 2: Google Books via ISBN
+        sources.append((_covers_from_google_isbn, (isbn,)))
+        # Source 3: Open Library Books API via ISBN
+        sources.append((_covers_from_open_library_isbn, (isbn,)))
 
     # Source 4: Goodreads via BookCover API (requires both title AND author)
     if title and author:
-        goodreads_url = fetch_goodreads_cover(title=title, author=author)
-        if goodreads_url:
-            covers.append((goodreads_url, "Goodreads", 4))
+        sources.append((_covers_from_goodreads, (title, author)))
 
     # Source 5: Google Books via title/author search
     if title:
-        query = f"{title} {author}".strip() if author else title
-        search_results = search_google_books(query, max_results=3)
+        sources.append((_covers_from_google_search, (title, author, isbn)))
 
-        for idx, result in enumerate(search_results):
-            thumbnail_url = result.get("volumeInfo", {}).get("imageLinks", {}).get("thumbnail")
-            if thumbnail_url:
-                # Try to get ISBN from search result for Open Library lookup
-                result_isbn = None
-                identifiers = result.get("volumeInfo", {}).get("industryIdentifiers", [])
-                for identifier in identifiers:
-                    if identifier.get("type") in ["ISBN_13", "ISBN_10"]:
-                        result_isbn = identifier.get("identifier")
-                        break
-
-                # If we found an ISBN in the search result, try Open Library direct
-                if result_isbn and not isbn:  # Only if we didn't already try with main ISBN
-                    ol_direct_url = fetch_cover_by_isbn_direct(result_isbn)
-                    if ol_direct_url:
-                        covers.append((ol_direct_url, f"Open Library (Search Result #{idx+1})", 5 + idx))
-
-                covers.append((thumbnail_url, f"Google Books (Search #{idx+1})", 6 + idx))
+    futures = _run_providers(sources)
+    budget = current_app.config.get('PROVIDER_LOOKUP_BUDGET', DEFAULT_PROVIDER_LOOKUP_BUDGET)
+    done, not_done = wait(futures, timeout=budget)
+    if not_done:
+        current_app.logger.warning(f"{len(not_done)} cover source(s) timed out after {budget}s")
+
+    covers = []
+    for future in futures:
+        if future in done:
+            try:
+                covers.extend(future.result())
+            except Exception as e:
+                current_app.logger.warning(f"Cover source failed: {str(e)}")
 
     # Sort by priority (lower number first)
     covers.sort(key=lambda x: x[2])
 
     return covers
-
-# filter options
-def get_filter_options():
-    """Fetch available filter options from the database."""
-    conn = get_db_connection()
-    try:
-        # Fetch genres
-        genres = [row['genre'] for row in conn.execute("SELECT DISTINCT genre FROM books").fetchall()]
-
-        # Fetch read statuses
-        read_statuses = [row['status'] for row in conn.execute("SELECT DISTINCT status FROM collections WHERE user_id = ?", (current_user.id,)).fetchall()]
-
-        # Fetch ratings
-        ratings = [row['rating'] for row in conn.execute("SELECT DISTINCT rating FROM read_data WHERE user_id = ?", (current_user.id,)).fetchall()]
-
-        # Fetch tags
-        tags = [row['tag_name'] for row in conn.execute("SELECT DISTINCT tag_name FROM book_tags WHERE user_id = ?", (current_user.id,)).fetchall()]
-
-        # Return filter options as a dictionary
-        return {
-            'genres': genres,
-            'read_statuses': read_statuses,
-            'ratings': ratings,
-            'tags': tags
-        }
-    finally:
-        conn.close()
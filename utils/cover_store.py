@@ -0,0 +1,177 @@
+"""
+Content-addressed cover storage (see migrations/020_add_cover_store.sql)
+
+Covers are saved as JPEG under static/uploads/covers/, named by the SHA-256
+of their bytes, so an image that is downloaded or uploaded twice is stored
+once and shared by every book that uses it. cover_files.ref_count is kept up
+to date by triggers on books and isbn_cache; a cover nothing has pointed at
+for COVER_ORPHAN_GRACE seconds is an orphan, and is reported and cleaned up
+through the uploads index (utils/upload_index.py). Covers that were just
+fetched but not yet saved to a book (e.g. the candidates offered by
+fetch_cover) are protected by the same grace period.
+
+cover_sources maps each downloaded URL to the cover it produced, so a URL
+that has been fetched before is not downloaded again.
+"""
+import hashlib
+import io
+import os
+import tempfile
+from flask import current_app
+from PIL import Image
+from utils.database import get_db_connection
+from utils.image_utils import create_thumbnails, create_variants, delete_image_file
+from utils.upload_index import index_image
+
+COVER_DIR = 'covers'  # Under uploads/
+COVER_QUALITY = 85
+COVER_MAX_SIZE = (500, 1000)  # Covers are resized to fit
+
+
+def cover_path(digest):
+    """Path of a stored cover, relative to the static directory"""
+    return f"uploads/{COVER_DIR}/{digest[:2]}/{digest}.jpg"
+
+
+def is_stored_cover(image_path):
+    """Whether a path points into the content-addressed store (rather than a legacy per-book file)"""
+    return bool(image_path) and image_path.startswith(f"uploads/{COVER_DIR}/")
+
+
+def _static_path(image_path):
+    return os.path.join(current_app.root_path, 'static', image_path)
+
+
+def register_cover(digest, size, source_url=None):
+    """
+    Record a stored cover (or re-protect an unused one), so the orphan
+    cleanup leaves it alone until a book has had time to start using it
+
+    Args:
+        digest: SHA-256 of the cover's JPEG bytes
+        size: Size of the JPEG in bytes
+        source_url: URL the image was downloaded from, if any
+
+    Returns:
+        str: Cover path relative to the static directory
+    """
+    path = cover_path(digest)
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO cover_files (hash, path, size, released_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(hash) DO UPDATE SET released_at = CURRENT_TIMESTAMP
+        WHERE ref_count = 0
+    ''', (digest, path, size))
+    if source_url:
+        conn.execute('''
+            INSERT INTO cover_sources (url, hash) VALUES (?, ?)
+            ON CONFLICT(url) DO UPDATE SET hash = excluded.hash, fetched_at = CURRENT_TIMESTAMP
+        ''', (source_url, digest))
+    conn.commit()
+    return path
+
+
+def _store_bytes(data, source_url=None):
+    # Register the cover before touching the file, so the orphan cleanup
+    # can't delete it out from under this save
+    path = register_cover(hashlib.sha256(data).hexdigest(), len(data), source_url)
+
+    full_path = _static_path(path)
+    if not os.path.exists(full_path):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # Write then rename, so a concurrent save of the same cover never
+        # sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+
+        try:
+            create_thumbnails(path)
+            create_variants(path)
+        except Exception as e:
+            current_app.logger.warning(f"Could not create derived images for {path}: {str(e)}")
+        index_image(path)
+
+    return path
+
+
+def store_cover(img, source_url=None):
+    """
+    Save a processed cover, reusing the stored file if an identical one exists
+
+    Args:
+        img: PIL image, already resized and oriented
+        source_url: URL the image was downloaded from, remembered so the
+            URL isn't downloaded again
+
+    Returns:
+        str: Cover path relative to the static directory
+    """
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=COVER_QUALITY, optimize=True)
+    return _store_bytes(buf.getvalue(), source_url)
+
+
+def find_cover_for_url(url):
+    """
+    Get the stored cover previously downloaded from a URL
+
+    Returns:
+        str: Cover path relative to the static directory, or None if the URL
+        hasn't been downloaded (or its file has since been removed)
+    """
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT f.hash, f.path, f.ref_count
+        FROM cover_sources s
+        JOIN cover_files f ON f.hash = s.hash
+        WHERE s.url = ?
+    ''', (url,)).fetchone()
+    if not row or not os.path.exists(_static_path(row['path'])):
+        return None
+
+    if row['ref_count'] == 0:
+        # About to be reused: restart its grace period
+        conn.execute('''
+            UPDATE cover_files SET released_at = CURRENT_TIMESTAMP
+            WHERE hash = ? AND ref_count = 0
+        ''', (row['hash'],))
+        conn.commit()
+    return row['path']
+
+
+def discard_cover(image_path):
+    """
+    Let go of a book's old cover when it is replaced or the book is deleted
+
+    Stored covers are shared and are freed through their ref_count (the
+    triggers do that when the book row changes); legacy per-book files are
+    deleted straight away.
+    """
+    if image_path and not is_stored_cover(image_path):
+        delete_image_file(image_path)
+
+
+def import_cover_file(image_path):
+    """
+    Move a legacy cover file into the store
+
+    JPEGs are stored byte for byte; other formats are re-encoded.
+
+    Returns:
+        str: The stored cover's path, or None if the file doesn't exist
+    """
+    full_path = _static_path(image_path)
+    if not os.path.exists(full_path):
+        return None
+
+    with Image.open(full_path) as img:
+        if img.format == 'JPEG':
+            with open(full_path, 'rb') as f:
+                return _store_bytes(f.read())
+        img.load()
+        return store_cover(img)
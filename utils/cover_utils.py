@@ -0,0 +1,119 @@
+"""
+Bulk cover fetching, run as a background job (see utils/jobs.py)
+
+Every book missing a cover (and with an ISBN to look it up by) is queued as
+a job item. Books are fetched BULK_COVER_CONCURRENCY at a time and each
+result is committed as soon as it completes, so an interrupted job loses
+at most the books in flight and can be resumed from its pending items.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from utils.database import get_db_connection
+from utils.book_utils import fetch_book_details_from_isbn
+from utils.jobs import (get_pending_items, finish_item, count_items, update_job,
+                        finish_job, is_cancel_requested)
+
+JOB_TYPE = 'bulk_covers'
+DEFAULT_BULK_COVER_CONCURRENCY = 6
+
+logger = logging.getLogger(__name__)
+
+
+def missing_cover_book_ids(conn):
+    """IDs of books without a cover that can be looked up by ISBN"""
+    return [row[0] for row in conn.execute("""
+        SELECT id
+        FROM books
+        WHERE (cover_image_url IS NULL OR cover_image_url = '')
+        AND isbn IS NOT NULL AND isbn != ''
+        ORDER BY id
+    """)]
+
+
+def _job_stats(conn, job_id):
+    counts = count_items(conn, job_id)
+    return {
+        'books_processed': counts['done'] + counts['skipped'] + counts['failed'],
+        'covers_found': counts['done'],
+        'covers_failed': counts['failed'],
+        'skipped': counts['skipped'],
+        'remaining': counts['pending']
+    }
+
+
+def _fetch_cover(app, job_id, book_id):
+    """Fetch and store one book's cover on its own connection; returns True if found"""
+    with app.app_context():
+        conn = get_db_connection()
+        book = conn.execute(
+            'SELECT id, title, isbn, cover_image_url FROM books WHERE id = ?', (book_id,)
+        ).fetchone()
+
+        # The book may have been deleted or given a cover since it was queued
+        if not book or book['cover_image_url']:
+            finish_item(conn, job_id, book_id, 'skipped', 'Skipped: already has a cover or was deleted')
+            conn.commit()
+            return False
+
+        try:
+            logger.info(f"Fetching cover for: {book['title']} (ISBN: {book['isbn']})")
+            book_data = fetch_book_details_from_isbn(book['isbn'])
+        except Exception as e:
+            logger.error(f"Error fetching cover for '{book['title']}': {str(e)}")
+            finish_item(conn, job_id, book_id, 'failed', str(e))
+            conn.commit()
+            return False
+
+        if book_data and book_data.get('local_cover_url'):
+            conn.execute('''
+                UPDATE books SET cover_image_url = ?
+                WHERE id = ? AND (cover_image_url IS NULL OR cover_image_url = '')
+            ''', (book_data['local_cover_url'], book_id))
+            finish_item(conn, job_id, book_id, 'done')
+            conn.commit()
+            logger.info(f"✓ Cover found for: {book['title']}")
+            return True
+
+        finish_item(conn, job_id, book_id, 'failed', 'No cover found')
+        conn.commit()
+        logger.warning(f"✗ No cover found for: {book['title']}")
+        return False
+
+
+def run_bulk_cover_fetch(job_id):
+    """
+    Job target: fetch covers for a job's pending books
+
+    Args:
+        job_id: The bulk cover job's ID (its books queued with add_job_items)
+    """
+    conn = get_db_connection()
+    app = current_app._get_current_object()
+    pending = get_pending_items(conn, job_id)
+    workers = current_app.config.get('BULK_COVER_CONCURRENCY', DEFAULT_BULK_COVER_CONCURRENCY)
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='covers')
+    try:
+        futures = [executor.submit(_fetch_cover, app, job_id, book_id) for book_id in pending]
+
+        for future in as_completed(futures):
+            future.result()
+            stats = _job_stats(conn, job_id)
+            update_job(conn, job_id, processed=stats['books_processed'], result=stats)
+
+            if is_cancel_requested(conn, job_id):
+                # Let in-flight books finish (and commit), drop the rest
+                executor.shutdown(wait=True, cancel_futures=True)
+                stats = _job_stats(conn, job_id)
+                update_job(conn, job_id, processed=stats['books_processed'])
+                finish_job(conn, job_id, status='cancelled', result=stats,
+                           message=f"Cancelled with {stats['remaining']} book(s) remaining")
+                return
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    stats = _job_stats(conn, job_id)
+    logger.info(f"Bulk cover fetch complete: {stats}")
+    update_job(conn, job_id, processed=stats['books_processed'])
+    finish_job(conn, job_id, result=stats)
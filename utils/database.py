@@ -1,10 +1,202 @@
+"""
+Database connection management.
+
+Within an app context every call to get_db_connection() returns the same
+connection, bound to flask.g and handed back to a small per-worker pool when
+the context tears down. Outside an app context (scripts, the shell) a fresh
+standalone connection is returned as before.
+
+Every new connection gets the PRAGMA profile from DATABASE_PRAGMAS (WAL
+journaling by default, so readers no longer block behind writers), and each
+worker periodically checkpoints the WAL back into the main database file.
+"""
 import sqlite3
 import os
+import queue
+import threading
+import time
+import logging
+from flask import g, has_app_context
 
 DATABASE = os.getenv('DATABASE_PATH', 'library.db')
+DEFAULT_POOL_SIZE = 5
+
+# Applied in this order to every new connection; busy_timeout comes first so
+# the switch to WAL waits for other workers instead of failing.
+DEFAULT_PRAGMAS = {
+    'busy_timeout': 5000,       # ms to wait on a locked database
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',    # durable across app crashes in WAL mode
+    'cache_size': -16000,       # negative = KiB, so a 16 MB page cache
+    'mmap_size': 134217728,     # 128 MB memory-mapped reads
+    'temp_store': 'MEMORY',
+}
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+logger = logging.getLogger(__name__)
+
+_pragmas = dict(DEFAULT_PRAGMAS)
+_checkpoint_interval = 0
+_checkpointer_pid = None
+_pool = queue.LifoQueue(maxsize=DEFAULT_POOL_SIZE)
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that ignores close() while it is bound to a request.
+
+    Existing code calls conn.close() when it is done with a connection; for a
+    request-scoped connection that would pull it out from under the other
+    helpers sharing it, so closing is deferred to the app context teardown.
+    """
+
+    request_bound = False
+
+    def close(self):
+        if self.request_bound:
+            return
+        super().close()
+
+    def dispose(self):
+        """Really close the connection, regardless of request binding."""
+        self.request_bound = False
+        super().close()
+
+
+def _connect(pooled=False):
+    conn = sqlite3.connect(
+        DATABASE,
+        factory=PooledConnection,
+        # Pooled connections are reused by whichever thread serves the next
+        # request, but only ever by one request at a time.
+        check_same_thread=not pooled
+    )
+    conn.row_factory = sqlite3.Row  # Allows dict-like access to rows
+    for name, value in _pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def _get_pool():
+    """Return this process's pool, discarding one inherited across a fork."""
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = queue.LifoQueue(maxsize=_pool.maxsize)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _acquire():
+    _start_checkpointer()
+    try:
+        return _get_pool().get_nowait()
+    except queue.Empty:
+        return _connect(pooled=True)
+
+
+def _release(conn):
+    # Never hand out a connection with someone else's half-finished transaction
+    if conn.in_transaction:
+        conn.rollback()
+    conn.request_bound = False
+    try:
+        _get_pool().put_nowait(conn)
+    except queue.Full:
+        conn.dispose()
+
 
 # Helper function to connect to the database
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # Allows dict-like access to rows
-    return conn
\ No newline at end of file
+    """Return the request's shared connection, or a standalone one outside a request."""
+    if not has_app_context():
+        return _connect()
+
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn = _acquire()
+        conn.request_bound = True
+        g._db_conn = conn
+    return conn
+
+
+def get_standalone_connection():
+    """
+    Return a new connection that isn't shared with the request (caller closes it).
+
+    For caches that are written while serving a read: committing them on
+    their own connection never commits the request's pending changes early.
+    """
+    return _connect()
+
+
+def close_db_connection(exception=None):
+    """Return the app context's connection to the pool (registered as a teardown)."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        _release(conn)
+
+
+def checkpoint_wal(mode='PASSIVE'):
+    """
+    Copy committed WAL frames back into the main database file.
+
+    Args:
+        mode: One of CHECKPOINT_MODES. PASSIVE never blocks readers or writers;
+              TRUNCATE waits for them and also shrinks the -wal file to zero.
+
+    Returns:
+        dict: {'busy': 1 if the checkpoint could not finish, 'log_pages': frames
+        in the WAL, 'checkpointed_pages': frames copied back}
+    """
+    mode = mode.upper()
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+
+    # Use a dedicated connection so we never checkpoint from inside the
+    # current request's read transaction
+    conn = _connect()
+    try:
+        busy, log_pages, checkpointed_pages = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        return {
+            'busy': busy,
+            'log_pages': log_pages,
+            'checkpointed_pages': checkpointed_pages
+        }
+    finally:
+        conn.close()
+
+
+def _checkpoint_loop():
+    while True:
+        time.sleep(_checkpoint_interval)
+        try:
+            result = checkpoint_wal('PASSIVE')
+            logger.debug(f"Background WAL checkpoint: {result}")
+        except sqlite3.Error as e:
+            logger.warning(f"Background WAL checkpoint failed: {e}")
+
+
+def _start_checkpointer():
+    """Start this worker's background checkpoint thread once (threads don't survive a fork)."""
+    global _checkpointer_pid
+    if not _checkpoint_interval or _checkpointer_pid == os.getpid():
+        return
+    with _pool_lock:
+        if _checkpointer_pid == os.getpid():
+            return
+        _checkpointer_pid = os.getpid()
+    threading.Thread(target=_checkpoint_loop, name='wal-checkpoint', daemon=True).start()
+
+
+def init_app(app):
+    """Configure the pool and PRAGMA profile from app config and register the teardown handler."""
+    global _pool, _checkpoint_interval
+    pool_size = app.config.get('DATABASE_POOL_SIZE', DEFAULT_POOL_SIZE)
+    if pool_size != _pool.maxsize:
+        _pool = queue.LifoQueue(maxsize=pool_size)
+    _pragmas.update(app.config.get('DATABASE_PRAGMAS', {}))
+    _checkpoint_interval = app.config.get('DATABASE_CHECKPOINT_INTERVAL', 0)
+    app.teardown_appcontext(close_db_connection)
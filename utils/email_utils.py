@@ -8,6 +8,7 @@ from itsdangerous import URLSafeTimedSerializer
 import secrets
 from datetime import datetime, timedelta
 from utils.database import get_db_connection
+from utils.user_cache import invalidate_user
 
 
 def get_serializer():
@@ -206,6 +207,7 @@ def verify_token(token):
         ''', (token_data['user_id'],))
 
         conn.commit()
+        invalidate_user(token_data['user_id'])
 
         return dict(token_data)
 
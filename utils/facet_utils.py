@@ -0,0 +1,114 @@
+"""
+Filter options for the library listings (My Library, Shared Library and
+search), with the number of books behind each option
+
+The genre, read status and tag options are grouped counts over the books in
+a listing, which would otherwise be worked out on every page load. Each
+worker caches them per user and listing (see FILTER_FACET_CACHE_SIZE).
+Triggers bump cache_versions.filter_facets whenever books, tags, shelves or
+wishlists change (see migrations/025_add_filter_facet_version.sql); the
+cached facets are recomputed once the version has moved on, so a page load
+costs a single primary-key read while nothing has changed.
+"""
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+DEFAULT_FILTER_FACET_CACHE_SIZE = 512
+
+_facets = OrderedDict()  # (user ID, owner IDs, any_wishlist) -> (version, facets)
+_lock = threading.Lock()
+
+
+def _listing_scope(owner_ids, any_wishlist):
+    """SQL condition for the books in a listing of owner_ids' libraries, and its params"""
+    placeholders = ','.join(['?' for _ in owner_ids])
+    if any_wishlist:
+        return f'''
+            b.added_by IN ({placeholders})
+            AND NOT EXISTS (SELECT 1 FROM wishlist w WHERE w.book_id = b.id)
+        ''', list(owner_ids)
+    condition = f'''
+        b.added_by IN ({placeholders})
+        AND NOT EXISTS (SELECT 1 FROM wishlist w WHERE w.book_id = b.id AND w.user_id IN ({placeholders}))
+    '''
+    return condition, list(owner_ids) + list(owner_ids)
+
+
+def _compute_facets(conn, user_id, owner_ids, any_wishlist):
+    scope, scope_params = _listing_scope(owner_ids, any_wishlist)
+
+    # Genres are grouped case-insensitively, as the genre filter matches them
+    genres = conn.execute(f'''
+        SELECT MIN(b.genre) AS value, COUNT(*) AS count
+        FROM books b
+        WHERE {scope} AND b.genre IS NOT NULL AND b.genre != ''
+        GROUP BY LOWER(b.genre)
+        ORDER BY LOWER(b.genre)
+    ''', scope_params).fetchall()
+
+    # Read statuses and tags are the user's own, on the books in the listing
+    read_statuses = conn.execute(f'''
+        SELECT c.status AS value, COUNT(DISTINCT c.book_id) AS count
+        FROM collections c
+        JOIN books b ON b.id = c.book_id
+        WHERE c.user_id = ? AND c.status IS NOT NULL AND {scope}
+        GROUP BY c.status
+        ORDER BY c.status
+    ''', [user_id] + scope_params).fetchall()
+
+    tags = conn.execute(f'''
+        SELECT t.tag_name AS value, COUNT(DISTINCT t.book_id) AS count
+        FROM book_tags t
+        JOIN books b ON b.id = t.book_id
+        WHERE t.user_id = ? AND {scope}
+        GROUP BY t.tag_name
+        ORDER BY t.tag_name
+    ''', [user_id] + scope_params).fetchall()
+
+    return {
+        'genres': [dict(row) for row in genres],
+        'read_statuses': [dict(row) for row in read_statuses],
+        'tags': [dict(row) for row in tags]
+    }
+
+
+def get_filter_facets(conn, user_id, owner_ids, any_wishlist=False):
+    """
+    Get the filter options for a listing, from the cache if nothing has changed
+
+    Args:
+        conn: Database connection
+        user_id: User viewing the listing (read statuses and tags are theirs)
+        owner_ids: Users whose books the listing shows
+        any_wishlist: Leave out books on anyone's wishlist (as search does),
+            rather than only those on the owners' wishlists
+
+    Returns:
+        dict: {'genres', 'read_statuses', 'tags'}, each a list of
+        {'value', 'count'} dicts in display order; shared between requests,
+        so don't modify it
+    """
+    key = (user_id, frozenset(owner_ids), any_wishlist)
+    version = conn.execute(
+        "SELECT version FROM cache_versions WHERE name = 'filter_facets'"
+    ).fetchone()[0]
+
+    with _lock:
+        entry = _facets.get(key)
+        if entry and entry[0] == version:
+            _facets.move_to_end(key)
+            return entry[1]
+
+    facets = _compute_facets(conn, user_id, sorted(key[1]), any_wishlist)
+
+    size = current_app.config.get('FILTER_FACET_CACHE_SIZE', DEFAULT_FILTER_FACET_CACHE_SIZE)
+    with _lock:
+        entry = _facets.get(key)
+        # A concurrent request may have stored facets for a newer version
+        if not entry or entry[0] <= version:
+            _facets[key] = (version, facets)
+            _facets.move_to_end(key)
+            while len(_facets) > size:
+                _facets.popitem(last=False)
+    return facets
@@ -0,0 +1,168 @@
+"""
+Shared HTTP client for the external book APIs
+
+One requests.Session per worker process keeps connections to each host
+alive across lookups, retries connection failures and 429/5xx responses a
+bounded number of times with jittered backoff, and tracks a circuit breaker
+per provider. At most HTTP_MAX_PER_HOST requests run against one host at a
+time, however many threads are fetching. After HTTP_BREAKER_THRESHOLD consecutive failures a provider's
+breaker opens and calls to it fail immediately with ProviderUnavailable for
+HTTP_BREAKER_RESET seconds, after which a single trial request is let
+through to see whether it has recovered.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import current_app
+
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 60
+DEFAULT_MAX_PER_HOST = 4
+POOL_MAXSIZE = 10  # Connections kept per host
+
+# Retry connection errors and throttling/server errors, but not read
+# timeouts: a hung provider should cost one timeout, not three
+RETRY_POLICY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=2,
+    backoff_factor=0.25,
+    backoff_jitter=0.25,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD']),
+    raise_on_status=False,
+)
+
+_session = None
+_session_pid = None
+_breakers = {}
+_host_slots = {}
+_lock = threading.Lock()
+
+
+class ProviderUnavailable(requests.RequestException):
+    """Raised instead of making a request while a provider's breaker is open"""
+
+
+class _CircuitBreaker:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self, reset_after):
+        with _lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < reset_after or self.trial_in_flight:
+                return False
+            # Half-open: let one request through to probe the provider
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with _lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self, threshold):
+        with _lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+def _get_session():
+    """Return this process's session, discarding one inherited across a fork."""
+    global _session, _session_pid
+    if _session_pid != os.getpid():
+        with _lock:
+            if _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=20, pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=RETRY_POLICY)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+                _session_pid = os.getpid()
+                _breakers.clear()
+                _host_slots.clear()
+    return _session
+
+
+def _get_breaker(provider):
+    with _lock:
+        return _breakers.setdefault(provider, _CircuitBreaker())
+
+
+def _get_host_slots(host):
+    with _lock:
+        slots = _host_slots.get(host)
+        if slots is None:
+            limit = current_app.config.get('HTTP_MAX_PER_HOST', DEFAULT_MAX_PER_HOST)
+            slots = _host_slots[host] = threading.BoundedSemaphore(limit)
+        return slots
+
+
+def request(method, url, provider=None, **kwargs):
+    """
+    Make an HTTP request through the shared session and provider breaker
+
+    Args:
+        method: 'GET' or 'HEAD'
+        url: URL to request
+        provider: Breaker name, e.g. 'google_books'; defaults to the URL's host
+        **kwargs: Passed on to requests (timeout, params, headers, stream, ...)
+
+    Returns:
+        requests.Response: The response; 4xx responses are returned, not raised
+
+    Raises:
+        ProviderUnavailable: The provider's breaker is open
+        requests.RequestException: The request failed after retries
+    """
+    host = urlparse(url).hostname
+    provider = provider or host
+    session = _get_session()
+    breaker = _get_breaker(provider)
+    reset_after = current_app.config.get('HTTP_BREAKER_RESET', DEFAULT_BREAKER_RESET)
+    threshold = current_app.config.get('HTTP_BREAKER_THRESHOLD', DEFAULT_BREAKER_THRESHOLD)
+
+    if not breaker.allow(reset_after):
+        raise ProviderUnavailable(f"{provider} is unavailable (circuit open)")
+
+    try:
+        # Streamed bodies are read after the slot is released, so callers that
+        # want the limit to cover the download should not stream
+        with _get_host_slots(host):
+            response = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        if breaker.record_failure(threshold):
+            current_app.logger.warning(f"Circuit opened for {provider} after repeated failures")
+        raise
+
+    if response.status_code == 429 or response.status_code >= 500:
+        if breaker.record_failure(threshold):
+            current_app.logger.warning(f"Circuit opened for {provider} after repeated failures")
+    else:
+        breaker.record_success()
+    return response
+
+
+def http_get(url, provider=None, **kwargs):
+    """GET url through the shared client (see request())"""
+    return request('GET', url, provider=provider, **kwargs)
+
+
+def http_head(url, provider=None, **kwargs):
+    """HEAD url through the shared client (see request())"""
+    return request('HEAD', url, provider=provider, **kwargs)
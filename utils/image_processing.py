@@ -0,0 +1,332 @@
+"""
+Image decoding and resizing, off the request threads
+
+Decoding and resizing a large photo holds the GIL for a noticeable time, so
+uploaded covers and avatars are spooled to disk as they arrive and the
+request returns straight away. A background job (see utils/jobs.py) then
+hands the file to a small per-worker process pool, which resizes it and
+writes it with its thumbnails and WebP/AVIF copies, and the job records the
+result in the database. The UI polls the job through image_status.
+Downloaded covers are resized in the same pool.
+
+JPEGs are decoded with Image.draft(), which has libjpeg scale the image by
+1/2, 1/4 or 1/8 while decoding, so a 4000px photo is never held in memory
+at full size; other formats are shrunk with reduce() before resampling
+(thumbnail()'s reducing_gap).
+
+process_cover() and process_avatar() run in the pool: they are given the
+static directory and don't use the app or the database.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from PIL import Image, ImageOps
+from werkzeug.utils import secure_filename
+from utils.database import get_db_connection
+from utils.cover_store import COVER_MAX_SIZE, COVER_QUALITY, cover_path, register_cover, discard_cover
+from utils.image_utils import (THUMBNAIL_WIDTHS, thumbnail_path, save_thumbnails, save_variants,
+                               delete_image_file)
+from utils.jobs import create_job, start_job, finish_job
+from utils.upload_index import index_image
+from utils.user_cache import invalidate_user
+
+COVER_JOB_TYPE = 'cover_processing'
+AVATAR_JOB_TYPE = 'avatar_processing'
+AVATAR_MAX_SIZE = (400, 400)
+AVATAR_QUALITY = 85
+DEFAULT_IMAGE_PROCESS_WORKERS = 2
+
+# EXIF orientations that swap the stored image's width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+_EXIF_ORIENTATION = 0x0112
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Return this process's image pool, creating it on first use (or after it broke)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = current_app.config.get('IMAGE_PROCESS_WORKERS', DEFAULT_IMAGE_PROCESS_WORKERS)
+            # spawn rather than fork: the worker has job and HTTP threads running
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_image_task(fn, *args):
+    """
+    Run fn(*args) in the image process pool and wait for its result
+
+    If a pool process dies (e.g. killed for running out of memory on a
+    huge image), BrokenProcessPool is raised and the next task gets a
+    fresh pool.
+    """
+    pool = _get_pool()
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
+def _static_dir():
+    return os.path.join(current_app.root_path, 'static')
+
+
+def open_image(source, max_size, resample=Image.Resampling.BICUBIC):
+    """
+    Open an image, resized to fit max_size and turned upright
+
+    Args:
+        source: File path or the image's bytes
+        max_size: (width, height) to fit within, upright
+        resample: Resampling filter for the final resize
+
+    Returns:
+        PIL.Image.Image
+    """
+    img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    # Sizes below are of the image as stored, before exif_transpose()
+    width, height = max_size
+    if img.getexif().get(_EXIF_ORIENTATION) in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    if img.format == 'JPEG':
+        # Decode at the smallest 1/2^n scale that is still at least max_size
+        img.draft('RGB', (width, height))
+    img.thumbnail((width, height), resample, reducing_gap=2.0)
+    # Rotating after the resize is cheaper, and keeps the EXIF orientation
+    return ImageOps.exif_transpose(img)
+
+
+def _write_atomic(full_path, data):
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    # Write then rename, so a concurrent save of the same file never sees a partial one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, full_path)
+
+
+def process_cover(source, static_dir):
+    """
+    Pool task: resize a cover and write it to the cover store, with its
+    thumbnails and alternative encodings, unless an identical cover is
+    already stored
+
+    Args:
+        source: Path of the uploaded file, or downloaded image bytes
+        static_dir: The app's static directory
+
+    Returns:
+        tuple: (SHA-256 of the stored JPEG, its size in bytes)
+    """
+    img = open_image(source, COVER_MAX_SIZE)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=COVER_QUALITY, optimize=True)
+    data = buf.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+
+    path = cover_path(digest)
+    full_path = os.path.join(static_dir, path)
+    if not os.path.exists(full_path):
+        _write_atomic(full_path, data)
+        try:
+            save_thumbnails(img, [(width, thumbnail_path(path, width)) for width in THUMBNAIL_WIDTHS],
+                            static_dir=static_dir)
+            save_variants(img, path, static_dir=static_dir)
+        except Exception as e:
+            logger.warning(f"Could not create derived images for {path}: {str(e)}")
+    return digest, len(data)
+
+
+def process_avatar(source, static_dir, image_path):
+    """
+    Pool task: resize an avatar and save it as JPEG, with its alternative encodings
+
+    Args:
+        source: Path of the uploaded file
+        static_dir: The app's static directory
+        image_path: Where to save it, relative to the static directory
+    """
+    img = open_image(source, AVATAR_MAX_SIZE, Image.Resampling.LANCZOS)
+
+    # Flatten transparency onto white
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    full_path = os.path.join(static_dir, image_path)
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=AVATAR_QUALITY, optimize=True)
+    _write_atomic(full_path, buf.getvalue())
+    try:
+        save_variants(img, image_path, static_dir=static_dir)
+    except Exception as e:
+        logger.warning(f"Could not encode avatar variants for {image_path}: {str(e)}")
+
+
+def store_cover_image(source, source_url=None):
+    """
+    Resize a cover in the image pool and add it to the cover store
+
+    Args:
+        source: Path of an uploaded file, or downloaded image bytes
+        source_url: URL the image was downloaded from, remembered so the
+            URL isn't downloaded again
+
+    Returns:
+        str: Cover path relative to the static directory
+    """
+    static_dir = _static_dir()
+    digest, size = run_image_task(process_cover, source, static_dir)
+    path = register_cover(digest, size, source_url)
+    if not os.path.exists(os.path.join(static_dir, path)):
+        # An unused copy was cleaned up between the pool's check and
+        # register_cover(); now that it is protected again, write it back
+        run_image_task(process_cover, source, static_dir)
+    index_image(path)
+    return path
+
+
+def save_image_upload(file):
+    """
+    Spool an uploaded image to a temporary file for a processing job
+
+    Returns:
+        str: Path of the temporary file; the job removes it
+    """
+    suffix = os.path.splitext(secure_filename(file.filename))[1]
+    fd, raw_path = tempfile.mkstemp(prefix='image-upload-', suffix=suffix)
+    with os.fdopen(fd, 'wb') as f:
+        file.save(f)
+    return raw_path
+
+
+def is_image_file(path):
+    """Whether a file starts like an image Pillow can open (its header only; nothing is decoded)"""
+    try:
+        with Image.open(path):
+            return True
+    except (OSError, Image.DecompressionBombError):
+        return False
+
+
+def discard_upload(raw_path):
+    """Remove a spooled upload once it has been processed (or won't be)"""
+    try:
+        os.remove(raw_path)
+    except FileNotFoundError:
+        pass
+
+
+def queue_cover_processing(book_id, raw_path, user_id=None):
+    """
+    Start a job that processes an uploaded cover and sets it on a book
+
+    Returns:
+        int: The job's ID
+    """
+    conn = get_db_connection()
+    try:
+        job_id = create_job(conn, COVER_JOB_TYPE, user_id=user_id, total=1)
+    finally:
+        conn.close()
+    start_job(job_id, run_cover_processing, book_id, raw_path)
+    return job_id
+
+
+def run_cover_processing(job_id, book_id, raw_path):
+    """Job target: store an uploaded cover and point its book at it"""
+    try:
+        path = store_cover_image(raw_path)
+    finally:
+        discard_upload(raw_path)
+
+    conn = get_db_connection()
+    book = conn.execute('SELECT cover_image_url FROM books WHERE id = ?', (book_id,)).fetchone()
+    if not book:
+        # Deleted while the cover was processing; the stored cover is left unreferenced
+        finish_job(conn, job_id, status='cancelled', message='Book was deleted')
+        return
+
+    conn.execute('UPDATE books SET cover_image_url = ? WHERE id = ?', (path, book_id))
+    conn.commit()
+    if book['cover_image_url'] != path:
+        discard_cover(book['cover_image_url'])
+    finish_job(conn, job_id, result={'image_path': path, 'book_id': book_id})
+
+
+def queue_avatar_processing(user_id, raw_path, requested_by=None):
+    """
+    Start a job that processes an uploaded avatar and sets it on a user
+
+    Args:
+        user_id: User whose avatar it is
+        raw_path: Upload spooled by save_image_upload()
+        requested_by: User who uploaded it (an admin may upload for others)
+
+    Returns:
+        int: The job's ID
+    """
+    conn = get_db_connection()
+    try:
+        job_id = create_job(conn, AVATAR_JOB_TYPE, user_id=requested_by or user_id, total=1)
+    finally:
+        conn.close()
+    start_job(job_id, run_avatar_processing, user_id, raw_path)
+    return job_id
+
+
+def run_avatar_processing(job_id, user_id, raw_path):
+    """Job target: resize an uploaded avatar and set it on its user"""
+    image_path = f"uploads/avatars/user_{user_id}_{int(os.urandom(4).hex(), 16)}.jpg"
+    try:
+        run_image_task(process_avatar, raw_path, _static_dir(), image_path)
+    finally:
+        discard_upload(raw_path)
+    index_image(image_path)
+
+    conn = get_db_connection()
+    user = conn.execute('SELECT avatar_url FROM users WHERE id = ?', (user_id,)).fetchone()
+    if not user:
+        delete_image_file(image_path)
+        finish_job(conn, job_id, status='cancelled', message='User was deleted')
+        return
+
+    conn.execute('UPDATE users SET avatar_url = ? WHERE id = ?', (image_path, user_id))
+    conn.commit()
+    invalidate_user(user_id)
+    if user['avatar_url']:
+        # Removes its WebP/AVIF copies too
+        delete_image_file(user['avatar_url'])
+    finish_job(conn, job_id, result={'image_path': image_path, 'user_id': user_id})
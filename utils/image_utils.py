@@ -1,158 +1,297 @@
 """
-Image management utilities for file cleanup and orphan detection
+Image management utilities for file cleanup, cover thumbnails and
+alternative (WebP/AVIF) encodings
 """
 import os
-from flask import current_app
+from flask import current_app, url_for, request, send_from_directory
+from werkzeug.security import safe_join
+from PIL import Image
 
+try:
+    # Optional: adds AVIF support to Pillow builds without it
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
 
-def delete_image_file(image_path):
+# Widths of the cover thumbnails generated next to each uploaded cover
+THUMBNAIL_WIDTHS = (96, 200, 400)
+THUMBNAIL_DIR = 'thumbs'  # Under uploads/
+THUMBNAIL_QUALITY = 80
+
+# Alternative encodings saved next to covers, avatars and thumbnails (as
+# '<name>.jpg.webp' etc.), in order of preference when serving:
+# (mimetype, Pillow format, extension, save options)
+IMAGE_VARIANTS = (
+    ('image/avif', 'AVIF', 'avif', {'quality': 60}),
+    ('image/webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+)
+VARIANT_SOURCE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+
+
+def thumbnail_path(image_path, width):
     """
-    Safely delete an image file given its relative path from static directory
+    Path of a cover's thumbnail, relative to the static directory
 
     Args:
-        image_path: Relative path from static directory (e.g., 'uploads/cover_123.jpg')
+        image_path: Cover path as stored in the database (e.g. 'uploads/cover_123.jpg')
+        width: One of THUMBNAIL_WIDTHS
 
     Returns:
-        bool: True if file was deleted, False if it didn't exist or deletion failed
+        str: e.g. 'uploads/thumbs/cover_123_200w.jpg', or None for images
+        outside uploads/ (which never get thumbnails)
+    """
+    if not image_path or not image_path.startswith('uploads/'):
+        return None
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return f"uploads/{THUMBNAIL_DIR}/{stem}_{width}w.jpg"
+
+
+def variant_path(image_path, extension):
+    """Path of an image's alternative encoding, e.g. 'uploads/cover_123.jpg.webp'"""
+    return f"{image_path}.{extension}"
+
+
+def derived_paths(image_path):
+    """
+    Paths of every file generated from an image: its thumbnails and the
+    alternative encodings of it and of its thumbnails
     """
     if not image_path:
-        return False
+        return []
+    thumbs = [path for path in (thumbnail_path(image_path, w) for w in THUMBNAIL_WIDTHS) if path]
+    variants = [
+        variant_path(path, extension)
+        for path in [image_path] + thumbs
+        for _, _, extension, _ in IMAGE_VARIANTS
+    ]
+    return thumbs + variants
 
-    # Build full path: app_root/static/image_path
-    full_path = os.path.join(current_app.root_path, 'static', image_path)
 
-    if os.path.exists(full_path):
-        try:
-            os.remove(full_path)
-            current_app.logger.info(f"Deleted image file: {full_path}")
-            return True
-        except Exception as e:
-            current_app.logger.error(f"Failed to delete image {full_path}: {e}")
-            return False
-    else:
-        current_app.logger.debug(f"Image file does not exist: {full_path}")
-        return False
+def _static_path(image_path, static_dir=None):
+    # static_dir is passed by the image worker processes, which have no app context
+    return os.path.join(static_dir or os.path.join(current_app.root_path, 'static'), image_path)
 
 
-def find_orphaned_images(db_connection):
+def _available_variants():
+    """The IMAGE_VARIANTS this Pillow build can encode"""
+    Image.init()
+    return [variant for variant in IMAGE_VARIANTS if variant[1] in Image.SAVE]
+
+
+def save_variants(img, image_path, force=False, static_dir=None):
+    """Write the alternative encodings of an open image; returns the number written"""
+    source_extension = image_path.rsplit('.', 1)[-1].lower()
+    written = 0
+    for _, image_format, extension, options in _available_variants():
+        if extension == source_extension:
+            continue
+        full_path = _static_path(variant_path(image_path, extension), static_dir)
+        if not force and os.path.exists(full_path):
+            continue
+        img.save(full_path, image_format, **options)
+        written += 1
+    return written
+
+
+def create_variants(image_path, force=False):
     """
-    Find image files that exist on disk but are not referenced in the database
+    Encode an uploaded image as WebP (and AVIF, where Pillow supports it)
+
+    The original stays in place as the fallback for browsers that accept
+    neither; serve_upload() picks the encoding per request.
 
     Args:
-        db_connection: Active database connection
+        image_path: Image path relative to the static directory
+        force: Re-encode variants that already exist
 
     Returns:
-        dict: {
-            'orphaned_files': list of relative paths to orphaned files,
-            'total_size': total size in bytes of orphaned files,
-            'count': number of orphaned files
-        }
-    """
-    # Collect all image paths referenced in database
-    db_images = set()
-
-    # Get book cover images
-    books = db_connection.execute(
-        "SELECT cover_image_url FROM books WHERE cover_image_url IS NOT NULL"
-    ).fetchall()
-    db_images.update(row['cover_image_url'] for row in books)
-
-    # Get user avatar images
-    users = db_connection.execute(
-        "SELECT avatar_url FROM users WHERE avatar_url IS NOT NULL"
-    ).fetchall()
-    db_images.update(row['avatar_url'] for row in users)
-
-    current_app.logger.info(f"Found {len(db_images)} images referenced in database")
-
-    # Scan filesystem for all images in uploads directory
-    upload_dir = os.path.join(current_app.root_path, 'static', 'uploads')
-    disk_images = []
+        int: Number of variants written
+    """
+    if not image_path or image_path.rsplit('.', 1)[-1].lower() not in VARIANT_SOURCE_EXTENSIONS:
+        return 0
+    source = _static_path(image_path)
+    if not os.path.exists(source):
+        return 0
 
-    if not os.path.exists(upload_dir):
-        current_app.logger.warning(f"Upload directory does not exist: {upload_dir}")
-        return {
-            'orphaned_files': [],
-            'total_size': 0,
-            'count': 0
-        }
+    with Image.open(source) as img:
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        return save_variants(img, image_path, force=force)
+
+
+def is_variant(filename):
+    """Whether a file name is an alternative encoding, e.g. 'cover_123.jpg.webp'"""
+    parts = filename.lower().rsplit('.', 2)
+    return (len(parts) == 3 and parts[1] in VARIANT_SOURCE_EXTENSIONS
+            and parts[2] in {extension for _, _, extension, _ in IMAGE_VARIANTS})
+
+
+def reencode_uploads(force=False):
+    """
+    Create missing WebP/AVIF encodings for every image under static/uploads
+    (covers, avatars and thumbnails)
+
+    Args:
+        force: Re-encode variants that already exist
+
+    Returns:
+        dict: {'images', 'written', 'failed'}
+    """
+    upload_dir = os.path.join(current_app.root_path, 'static', 'uploads')
+    static_dir = os.path.join(current_app.root_path, 'static')
+    stats = {'images': 0, 'written': 0, 'failed': 0}
 
-    # Walk through all files in uploads directory and subdirectories
     for root, dirs, files in os.walk(upload_dir):
         for file in files:
-            # Skip hidden files and system files
-            if file.startswith('.'):
+            if file.startswith('.') or is_variant(file):
+                continue
+            if file.rsplit('.', 1)[-1].lower() not in VARIANT_SOURCE_EXTENSIONS:
                 continue
+            rel_path = os.path.relpath(os.path.join(root, file), static_dir).replace('\\', '/')
+            stats['images'] += 1
+            try:
+                stats['written'] += create_variants(rel_path, force=force)
+            except Exception as e:
+                stats['failed'] += 1
+                current_app.logger.warning(f"Could not re-encode {rel_path}: {e}")
+    return stats
 
-            full_path = os.path.join(root, file)
-            # Get path relative to static directory
-            rel_path = os.path.relpath(full_path, os.path.join(current_app.root_path, 'static'))
-            # Normalize path separators for cross-platform compatibility
-            rel_path = rel_path.replace('\\', '/')
-            disk_images.append({
-                'path': rel_path,
-                'full_path': full_path,
-                'size': os.path.getsize(full_path)
-            })
-
-    current_app.logger.info(f"Found {len(disk_images)} image files on disk")
-
-    # Find orphans (files on disk but not in database)
-    orphaned = []
-    total_size = 0
-
-    for img in disk_images:
-        if img['path'] not in db_images:
-            orphaned.append({
-                'path': img['path'],
-                'full_path': img['full_path'],
-                'size': img['size'],
-                'size_kb': round(img['size'] / 1024, 2),
-                'size_mb': round(img['size'] / (1024 * 1024), 2)
-            })
-            total_size += img['size']
-
-    return {
-        'orphaned_files': orphaned,
-        'total_size': total_size,
-        'total_size_mb': round(total_size / (1024 * 1024), 2),
-        'count': len(orphaned)
-    }
-
-
-def cleanup_orphaned_images(orphaned_files):
-    """
-    Delete a list of orphaned image files
+
+def serve_upload(filename):
+    """
+    Serve a file from static/uploads, preferring an alternative encoding the
+    browser lists in its Accept header (falling back to the original)
+    """
+    upload_dir = os.path.join(current_app.root_path, 'static', 'uploads')
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+
+    for mimetype, _, extension, _ in IMAGE_VARIANTS:
+        if mimetype not in accepted:
+            continue
+        candidate = safe_join(upload_dir, variant_path(filename, extension))
+        if candidate and os.path.isfile(candidate):
+            response = send_from_directory(upload_dir, variant_path(filename, extension),
+                                           mimetype=mimetype)
+            break
+    else:
+        response = send_from_directory(upload_dir, filename)
+
+    response.vary.add('Accept')
+    return response
+
+
+def create_thumbnails(image_path, force=False):
+    """
+    Generate THUMBNAIL_WIDTHS thumbnails for an uploaded cover
 
     Args:
-        orphaned_files: List of file paths to delete (relative to static directory)
+        image_path: Cover path relative to the static directory
+        force: Regenerate thumbnails that already exist
 
     Returns:
-        dict: {
-            'deleted': number of files successfully deleted,
-            'failed': number of files that failed to delete,
-            'errors': list of error messages
-        }
-    """
-    deleted = 0
-    failed = 0
-    errors = []
-
-    for file_path in orphaned_files:
-        # If file_path is a dict (from find_orphaned_images), extract the path
-        if isinstance(file_path, dict):
-            file_path = file_path['path']
-
-        if delete_image_file(file_path):
-            deleted += 1
-        else:
-            failed += 1
-            errors.append(f"Failed to delete: {file_path}")
-
-    current_app.logger.info(f"Cleanup complete: {deleted} deleted, {failed} failed")
-
-    return {
-        'deleted': deleted,
-        'failed': failed,
-        'errors': errors
-    }
+        int: Number of thumbnails written
+    """
+    targets = [(width, thumbnail_path(image_path, width)) for width in THUMBNAIL_WIDTHS]
+    if not targets[0][1]:
+        return 0
+    if not force:
+        targets = [(w, path) for w, path in targets if not os.path.exists(_static_path(path))]
+    if not targets:
+        return 0
+
+    source = _static_path(image_path)
+    if not os.path.exists(source):
+        return 0
+
+    with Image.open(source) as img:
+        return save_thumbnails(img, targets)
+
+
+def save_thumbnails(img, targets, static_dir=None):
+    """
+    Write thumbnails (and their alternative encodings) of an open image
+
+    Args:
+        img: PIL image of the cover
+        targets: (width, thumbnail path) pairs, from thumbnail_path()
+        static_dir: Static directory, when called outside an app context
+
+    Returns:
+        int: Number of thumbnails written
+    """
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    written = 0
+    for width, path in targets:
+        full_path = _static_path(path, static_dir)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        thumb = img.copy()
+        # Height is bounded generously; covers are portrait
+        thumb.thumbnail((width, width * 3))
+        thumb.save(full_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        save_variants(thumb, path, force=True, static_dir=static_dir)
+        written += 1
+    return written
+
+
+def cover_srcset(image_path):
+    """
+    srcset attribute value for a cover, listing its thumbnails and the original
+
+    Returns an empty string when the cover has no thumbnails yet, so
+    templates can fall back to the plain src.
+    """
+    largest = thumbnail_path(image_path, THUMBNAIL_WIDTHS[-1])
+    if not largest or not os.path.exists(_static_path(largest)):
+        return ''
+
+    candidates = [
+        f"{url_for('static', filename=thumbnail_path(image_path, width))} {width}w"
+        for width in THUMBNAIL_WIDTHS
+    ]
+    # Covers are stored at most 500px wide (see cover_store.COVER_MAX_SIZE)
+    candidates.append(f"{url_for('static', filename=image_path)} 500w")
+    return ', '.join(candidates)
+
+
+def delete_image_file(image_path):
+    """
+    Safely delete an image file given its relative path from static directory
+
+    Args:
+        image_path: Relative path from static directory (e.g., 'uploads/cover_123.jpg')
+
+    Returns:
+        bool: True if file was deleted, False if it didn't exist or deletion failed
+    """
+    if not image_path:
+        return False
+
+    # Build full path: app_root/static/image_path
+    full_path = os.path.join(current_app.root_path, 'static', image_path)
+
+    # Thumbnails and alternative encodings go with the image
+    removed = []
+    for derived in derived_paths(image_path):
+        if derived != image_path and os.path.exists(_static_path(derived)):
+            try:
+                os.remove(_static_path(derived))
+                removed.append(derived)
+            except OSError as e:
+                current_app.logger.warning(f"Failed to delete derived image {derived}: {e}")
+
+    deleted = False
+    if os.path.exists(full_path):
+        try:
+            os.remove(full_path)
+            current_app.logger.info(f"Deleted image file: {full_path}")
+            deleted = True
+        except Exception as e:
+            current_app.logger.error(f"Failed to delete image {full_path}: {e}")
+    else:
+        current_app.logger.debug(f"Image file does not exist: {full_path}")
+
+    # Imported here: the uploads index builds on this module
+    from utils.upload_index import unindex_paths
+    unindex_paths(removed if os.path.exists(full_path) else removed + [image_path])
+    return deleted
@@ -0,0 +1,278 @@
+"""
+Goodreads CSV import, run as a background job (see utils/jobs.py)
+
+The uploaded export is streamed from a temporary file rather than held in
+memory. Existing ISBNs, title/author pairs and the user's wishlist and
+collection entries are loaded once up front, so rows are matched in memory
+and written with executemany, one transaction per chunk of rows.
+"""
+import csv
+import logging
+import os
+from utils.database import get_db_connection
+from utils.jobs import update_job, finish_job
+from utils.stats_utils import invalidate_library_stats
+
+IMPORT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 50
+
+logger = logging.getLogger(__name__)
+
+
+def format_goodreads_date(date_str):
+    """Convert Goodreads date format (YYYY/MM/DD) to SQLite format (YYYY-MM-DD)"""
+    if not date_str:
+        return None
+    # Replace forward slashes with dashes for proper SQLite date sorting
+    return date_str.replace('/', '-')
+
+
+def _parse_row(row):
+    """Pull the fields the import uses out of a Goodreads CSV row"""
+    # csv.DictReader fills the fields a short or truncated record lacks with None
+    if None in row.values():
+        raise ValueError("the row is missing fields")
+
+    isbn = row.get('ISBN13', '').strip() or row.get('ISBN', '').strip()
+    isbn = isbn.replace('="', '').replace('"', '').strip()  # Clean ISBN formatting
+
+    my_rating = row.get('My Rating', '').strip()
+    rating = int(my_rating) if my_rating and my_rating != '0' else None
+
+    return {
+        'title': row.get('Title', '').strip(),
+        'author': row.get('Author', '').strip(),
+        'isbn': isbn,
+        'publisher': row.get('Publisher', '').strip(),
+        'year': row.get('Year Published', '').strip() or row.get('Original Publication Year', '').strip(),
+        'pages': row.get('Number of Pages', '').strip(),
+        'rating': rating,
+        # Format dates to use dashes instead of slashes for proper SQLite sorting
+        'date_read': format_goodreads_date(row.get('Date Read', '').strip()),
+        'date_added': format_goodreads_date(row.get('Date Added', '').strip()),
+        # Determine shelf (use Exclusive Shelf first, then Bookshelves)
+        'shelf': row.get('Exclusive Shelf', '').strip() or row.get('Bookshelves', '').strip(),
+        'review': row.get('My Review', '').strip(),
+    }
+
+
+def _title_key(title, author):
+    return (title.lower(), author.lower())
+
+
+class _Library:
+    """In-memory view of the rows the import needs to check against"""
+
+    def __init__(self, conn, user_id):
+        self.by_isbn = {}
+        self.by_title = {}
+        for book in conn.execute('SELECT id, title, author, isbn FROM books ORDER BY id'):
+            if book['isbn']:
+                self.by_isbn.setdefault(book['isbn'], book['id'])
+            if book['title'] and book['author']:
+                self.by_title.setdefault(_title_key(book['title'], book['author']), book['id'])
+
+        self.wishlist = {row[0] for row in conn.execute(
+            'SELECT book_id FROM wishlist WHERE user_id = ?', (user_id,))}
+        self.collections = {row[0] for row in conn.execute(
+            'SELECT book_id FROM collections WHERE user_id = ?', (user_id,))}
+        self.rated = {row[0] for row in conn.execute(
+            'SELECT book_id FROM read_data WHERE user_id = ?', (user_id,))}
+
+    def find(self, book):
+        """Return the matching book's ID (or pending new book), by ISBN then title+author"""
+        if book['isbn'] and book['isbn'] in self.by_isbn:
+            return self.by_isbn[book['isbn']]
+        if book['author']:
+            return self.by_title.get(_title_key(book['title'], book['author']))
+        return None
+
+    def add(self, book, ref):
+        if book['isbn']:
+            self.by_isbn.setdefault(book['isbn'], ref)
+        if book['author']:
+            self.by_title.setdefault(_title_key(book['title'], book['author']), ref)
+
+
+class _NewBook:
+    """A book created by this import; id is filled in once its chunk is inserted"""
+
+    def __init__(self, book):
+        self.book = book
+        self.id = None
+
+
+def _import_chunk(conn, user_id, rows, library, stats):
+    """Match, insert and shelve one chunk of parsed rows in a single transaction"""
+    # Resolve each row to an existing book or one to be created; duplicates
+    # within the chunk resolve to the same new book
+    resolved = []
+    new_books = []
+    for book in rows:
+        ref = library.find(book)
+        if ref is None:
+            ref = _NewBook(book)
+            new_books.append(ref)
+            library.add(book, ref)
+        resolved.append((book, ref))
+
+    conn.execute('BEGIN IMMEDIATE')
+
+    if new_books:
+        # For bulk import, use Goodreads data directly (API calls are too slow)
+        # Covers can be fetched later via separate feature
+        max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM books').fetchone()[0]
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, publisher, publish_year,
+                             page_count, cover_image_url, description, subtitle,
+                             genre, added_by)
+            VALUES (?, ?, ?, ?, ?, ?, '', '', '', '', ?)
+        ''', [(nb.book['title'], nb.book['author'], nb.book['isbn'], nb.book['publisher'],
+               nb.book['year'], nb.book['pages'], user_id) for nb in new_books])
+
+        # The write lock is held, so the new rows are exactly those past max_id, in order
+        new_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM books WHERE id > ? ORDER BY id', (max_id,))]
+        for nb, book_id in zip(new_books, new_ids):
+            nb.id = book_id
+        stats['books_added'] += len(new_books)
+
+    wishlist_rows = []
+    collection_rows = []
+    rating_rows = []
+    session_rows = []
+
+    for book, ref in resolved:
+        book_id = ref.id if isinstance(ref, _NewBook) else ref
+        shelf = book['shelf']
+
+        if shelf in ['to-read', 'want-to-read']:
+            if book_id not in library.wishlist:
+                library.wishlist.add(book_id)
+                wishlist_rows.append((user_id, book_id, book['review'], book['date_added']))
+
+        elif shelf in ['read', 'currently-reading']:
+            if book_id in library.collections:
+                stats['duplicates_skipped'] += 1
+                continue
+            library.collections.add(book_id)
+
+            status = 'read' if shelf == 'read' else 'currently reading'
+            collection_rows.append((user_id, book_id, status, book['date_added']))
+
+            if book['rating'] and book_id not in library.rated:
+                library.rated.add(book_id)
+                rating_rows.append((user_id, book_id, book['rating'], book['review']))
+
+            if book['date_read'] and shelf == 'read':
+                session_rows.append((user_id, book_id, None, book['date_read']))
+
+        else:
+            stats['unknown_shelf'] += 1
+            if stats['unknown_shelf'] <= 5:
+                logger.warning(f"Unknown shelf '{shelf}' for book '{book['title']}'")
+
+    conn.executemany('''
+        INSERT INTO wishlist (user_id, book_id, notes, added_at)
+        VALUES (?, ?, ?, ?)
+    ''', wishlist_rows)
+    conn.executemany('''
+        INSERT INTO collections (user_id, book_id, status, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', collection_rows)
+    conn.executemany('''
+        INSERT INTO read_data (user_id, book_id, rating, comment)
+        VALUES (?, ?, ?, ?)
+    ''', rating_rows)
+    conn.executemany('''
+        INSERT INTO reading_sessions (user_id, book_id, date_started, date_completed)
+        VALUES (?, ?, ?, ?)
+    ''', session_rows)
+
+    stats['wishlist_added'] += len(wishlist_rows)
+    stats['collection_added'] += len(collection_rows)
+    stats['ratings_added'] += len(rating_rows)
+    stats['sessions_added'] += len(session_rows)
+
+    if new_books:
+        invalidate_library_stats(conn)
+    conn.commit()
+
+
+def run_goodreads_import(job_id, user_id, csv_path):
+    """
+    Job target: import a saved Goodreads CSV export for a user
+
+    Args:
+        job_id: The import's job ID
+        user_id: User importing the file
+        csv_path: Temporary file holding the upload; removed when done
+    """
+    conn = get_db_connection()
+    stats = {
+        'books_added': 0,
+        'wishlist_added': 0,
+        'ratings_added': 0,
+        'duplicates_skipped': 0,
+        'collection_added': 0,
+        'sessions_added': 0,
+        'rows_processed': 0,
+        'unknown_shelf': 0,
+        'errors': []
+    }
+
+    try:
+        # A cheap first pass gives the progress bar its total (rows can span
+        # lines when reviews contain newlines, so count parsed records)
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            total = sum(1 for _ in csv.DictReader(f))
+        update_job(conn, job_id, total=total)
+
+        library = _Library(conn, user_id)
+
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            chunk = []
+            for row in csv.DictReader(f):
+                stats['rows_processed'] += 1
+                try:
+                    book = _parse_row(row)
+                except Exception as row_error:
+                    logger.error(f"Error processing row: {row_error}")
+                    if len(stats['errors']) < MAX_REPORTED_ERRORS:
+                        stats['errors'].append(f"Error with book '{row.get('Title') or ''}': {row_error}")
+                    continue
+
+                # Skip if no title
+                if not book['title']:
+                    continue
+
+                chunk.append(book)
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    _import_chunk(conn, user_id, chunk, library, stats)
+                    chunk = []
+                    update_job(conn, job_id, processed=stats['rows_processed'], result=stats)
+
+            if chunk:
+                _import_chunk(conn, user_id, chunk, library, stats)
+
+        logger.info(f"Import completed: {stats}")
+
+        message = None
+        # If nothing was added, include a warning
+        if stats['books_added'] == 0 and stats['wishlist_added'] == 0 and stats['collection_added'] == 0:
+            message = f"No items imported. Processed {stats['rows_processed']} rows. Unknown shelves: {stats['unknown_shelf']}. Check logs for details."
+
+        update_job(conn, job_id, processed=stats['rows_processed'])
+        finish_job(conn, job_id, result=stats, message=message)
+
+    except Exception:
+        conn.rollback()
+        # Keep the counts from the chunks that were committed
+        update_job(conn, job_id, processed=stats['rows_processed'], result=stats)
+        raise
+
+    finally:
+        try:
+            os.remove(csv_path)
+        except OSError:
+            pass
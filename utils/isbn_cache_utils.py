@@ -0,0 +1,160 @@
+"""
+ISBN metadata cache (see migrations/018_add_isbn_cache.sql)
+
+Provider lookups are stored by normalized ISBN-13. Hits and misses get
+separate TTLs; once an entry expires it is still served for
+ISBN_CACHE_STALE_TTL seconds while a fresh copy is fetched in the background.
+"""
+import json
+import re
+from flask import current_app
+from utils.database import get_standalone_connection
+
+DEFAULT_ISBN_CACHE_TTL = 30 * 24 * 3600       # found: 30 days
+DEFAULT_ISBN_CACHE_MISS_TTL = 24 * 3600       # not found: 1 day
+DEFAULT_ISBN_CACHE_STALE_TTL = 7 * 24 * 3600  # serve expired entries this much longer
+
+
+def normalize_isbn(isbn):
+    """
+    Normalize an ISBN-10 or ISBN-13 to ISBN-13 digits
+
+    Args:
+        isbn: ISBN as entered or scanned, with or without hyphens/spaces
+
+    Returns:
+        str: 13-digit ISBN, or None if the input isn't a valid ISBN
+    """
+    if not isbn:
+        return None
+    digits = re.sub(r'[^0-9Xx]', '', isbn).upper()
+
+    if len(digits) == 10:
+        if not digits[:9].isdigit() or not (digits[9].isdigit() or digits[9] == 'X'):
+            return None
+        check = sum((10 - i) * (10 if c == 'X' else int(c)) for i, c in enumerate(digits))
+        if check % 11:
+            return None
+        digits = '978' + digits[:9]
+        total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digits))
+        return digits + str((10 - total % 10) % 10)
+
+    if len(digits) == 13 and digits.isdigit():
+        total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digits))
+        return digits if total % 10 == 0 else None
+
+    return None
+
+
+def get_cached_metadata(conn, isbn13):
+    """
+    Look up a cached provider response
+
+    Args:
+        conn: Database connection
+        isbn13: Normalized ISBN-13
+
+    Returns:
+        dict: {'found', 'data', 'local_cover_url', 'fresh', 'usable'}, or None
+        if the ISBN has never been looked up. 'fresh' entries are within their
+        TTL; 'usable' ones are at most ISBN_CACHE_STALE_TTL past it.
+    """
+    stale_ttl = current_app.config.get('ISBN_CACHE_STALE_TTL', DEFAULT_ISBN_CACHE_STALE_TTL)
+    row = conn.execute('''
+        SELECT found, data, local_cover_url,
+               expires_at > CURRENT_TIMESTAMP as fresh,
+               datetime(expires_at, ?) > CURRENT_TIMESTAMP as usable
+        FROM isbn_cache
+        WHERE isbn = ?
+    ''', (f'+{int(stale_ttl)} seconds', isbn13)).fetchone()
+    if not row:
+        return None
+
+    return {
+        'found': bool(row['found']),
+        'data': json.loads(row['data']) if row['data'] else None,
+        'local_cover_url': row['local_cover_url'],
+        'fresh': bool(row['fresh']),
+        'usable': bool(row['usable'])
+    }
+
+
+def _write_cache(conn, query, params):
+    """Commit a cache write on a connection of its own, leaving conn's transaction alone"""
+    if conn.in_transaction:
+        # conn holds the write lock; skip caching rather than wait for it
+        return
+    cache_conn = get_standalone_connection()
+    try:
+        cache_conn.execute(query, params)
+        cache_conn.commit()
+    finally:
+        cache_conn.close()
+
+
+def store_metadata(conn, isbn13, data):
+    """
+    Cache a provider response, or a miss if data is None
+
+    The previously downloaded cover is kept, so a refresh doesn't force a
+    new download. Written through a separate connection, so conn's pending
+    changes are never committed early; nothing is stored while it has any.
+    """
+    if data:
+        ttl = current_app.config.get('ISBN_CACHE_TTL', DEFAULT_ISBN_CACHE_TTL)
+    else:
+        ttl = current_app.config.get('ISBN_CACHE_MISS_TTL', DEFAULT_ISBN_CACHE_MISS_TTL)
+
+    _write_cache(conn, '''
+        INSERT INTO isbn_cache (isbn, found, data, fetched_at, expires_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP, datetime('now', ?))
+        ON CONFLICT(isbn) DO UPDATE SET
+            found = excluded.found,
+            data = excluded.data,
+            fetched_at = excluded.fetched_at,
+            expires_at = excluded.expires_at
+    ''', (isbn13, 1 if data else 0, json.dumps(data) if data else None, f'+{int(ttl)} seconds'))
+
+
+def set_cached_cover(conn, isbn13, local_cover_url):
+    """Remember the cover downloaded for an ISBN (written as store_metadata() writes)"""
+    _write_cache(
+        conn,
+        'UPDATE isbn_cache SET local_cover_url = ? WHERE isbn = ?',
+        (local_cover_url, isbn13)
+    )
+
+
+def get_isbn_cache_summary(conn):
+    """
+    Get counts for the admin maintenance panel
+
+    Returns:
+        dict: {'total', 'misses', 'expired'}
+    """
+    row = conn.execute('''
+        SELECT COUNT(*) as total,
+               COALESCE(SUM(found = 0), 0) as misses,
+               COALESCE(SUM(expires_at <= CURRENT_TIMESTAMP), 0) as expired
+        FROM isbn_cache
+    ''').fetchone()
+    return dict(row)
+
+
+def purge_isbn_cache(conn, expired_only=False):
+    """
+    Delete cached lookups (committed here)
+
+    Args:
+        conn: Database connection
+        expired_only: Only delete entries past their TTL
+
+    Returns:
+        int: Number of entries deleted
+    """
+    if expired_only:
+        cursor = conn.execute('DELETE FROM isbn_cache WHERE expires_at <= CURRENT_TIMESTAMP')
+    else:
+        cursor = conn.execute('DELETE FROM isbn_cache')
+    conn.commit()
+    return cursor.rowcount
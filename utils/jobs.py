@@ -0,0 +1,270 @@
+"""
+Background jobs (see migrations/017_add_jobs.sql)
+
+Long-running work is handed to a small per-worker thread pool and its state
+is kept in the jobs table, so whichever gunicorn worker receives a status
+poll can answer it. Job functions run inside an app context and report
+progress with update_job(). Jobs that work through many rows can queue them
+as job_items, so an interrupted job can be requeued and pick up the items
+still pending; such jobs should check is_cancel_requested() as they go.
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from utils.database import get_db_connection
+
+DEFAULT_JOB_WORKERS = 2
+# A running job whose progress hasn't moved for this long is assumed to have
+# died with its worker (e.g. a gunicorn restart)
+DEFAULT_JOB_STALE_SECONDS = 600
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Return this process's job executor, creating it on first use (threads don't survive a fork)."""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                workers = current_app.config.get('BACKGROUND_JOB_WORKERS', DEFAULT_JOB_WORKERS)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def create_job(conn, job_type, user_id=None, total=None):
+    """
+    Create a queued job record
+
+    Args:
+        conn: Database connection (committed here)
+        job_type: Kind of job, e.g. 'goodreads_import'
+        user_id: User the job belongs to
+        total: Number of items to process, if already known
+
+    Returns:
+        int: The new job's ID
+    """
+    cursor = conn.execute('''
+        INSERT INTO jobs (job_type, user_id, total)
+        VALUES (?, ?, ?)
+    ''', (job_type, user_id, total))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _run(app, job_id, target, args):
+    with app.app_context():
+        conn = get_db_connection()
+        try:
+            conn.execute('''
+                UPDATE jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (job_id,))
+            conn.commit()
+            target(job_id, *args)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            conn.rollback()
+            finish_job(conn, job_id, status='failed', message=str(e))
+
+
+def start_job(job_id, target, *args):
+    """
+    Run target(job_id, *args) on this worker's background thread pool.
+
+    The target is responsible for calling finish_job(); if it raises, the
+    job is marked failed with the exception message.
+    """
+    app = current_app._get_current_object()
+    _get_executor().submit(_run, app, job_id, target, args)
+
+
+def _run_untracked(app, target, args):
+    with app.app_context():
+        try:
+            target(*args)
+        except Exception as e:
+            logger.error(f"Background task {target.__name__} failed: {e}", exc_info=True)
+
+
+def run_in_background(target, *args):
+    """
+    Run target(*args) on the background thread pool without a jobs record,
+    for small fire-and-forget work such as cache refreshes. Errors are logged.
+    """
+    app = current_app._get_current_object()
+    _get_executor().submit(_run_untracked, app, target, args)
+
+
+def update_job(conn, job_id, processed=None, total=None, result=None):
+    """
+    Record a job's progress
+
+    Args:
+        conn: Database connection (committed here)
+        job_id: Job to update
+        processed: Items processed so far
+        total: Total number of items, once known
+        result: Job-specific partial result, stored as JSON
+    """
+    conn.execute('''
+        UPDATE jobs
+        SET processed = COALESCE(?, processed),
+            total = COALESCE(?, total),
+            result = COALESCE(?, result),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (processed, total, json.dumps(result) if result is not None else None, job_id))
+    conn.commit()
+
+
+def finish_job(conn, job_id, status='completed', result=None, message=None):
+    """Mark a job completed, failed or cancelled (committed here)"""
+    conn.execute('''
+        UPDATE jobs
+        SET status = ?,
+            result = COALESCE(?, result),
+            message = ?,
+            finished_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (status, json.dumps(result) if result is not None else None, message, job_id))
+    conn.commit()
+
+
+def requeue_job(conn, job_id):
+    """Reset a finished job to queued so start_job() can run it again (committed here)"""
+    conn.execute('''
+        UPDATE jobs
+        SET status = 'queued', cancel_requested = 0, message = NULL,
+            finished_at = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (job_id,))
+    conn.commit()
+
+
+def request_cancel(conn, job_id):
+    """Ask a queued or running job to stop at its next check (committed here)"""
+    conn.execute('''
+        UPDATE jobs SET cancel_requested = 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status IN ('queued', 'running')
+    ''', (job_id,))
+    conn.commit()
+
+
+def is_cancel_requested(conn, job_id):
+    """Check whether a cancel has been requested for a job"""
+    row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return bool(row and row['cancel_requested'])
+
+
+def add_job_items(conn, job_id, item_ids):
+    """
+    Queue the items a job will work through and set its total (committed here)
+
+    Args:
+        conn: Database connection
+        job_id: Job the items belong to
+        item_ids: Iterable of item IDs (e.g. book IDs)
+
+    Returns:
+        int: Number of items queued
+    """
+    conn.executemany(
+        'INSERT OR IGNORE INTO job_items (job_id, item_id) VALUES (?, ?)',
+        ((job_id, item_id) for item_id in item_ids)
+    )
+    total = conn.execute('SELECT COUNT(*) FROM job_items WHERE job_id = ?', (job_id,)).fetchone()[0]
+    conn.execute('UPDATE jobs SET total = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (total, job_id))
+    conn.commit()
+    return total
+
+
+def get_pending_items(conn, job_id):
+    """Get the IDs of a job's items that haven't been processed yet"""
+    return [row[0] for row in conn.execute(
+        "SELECT item_id FROM job_items WHERE job_id = ? AND status = 'pending' ORDER BY item_id",
+        (job_id,)
+    )]
+
+
+def finish_item(conn, job_id, item_id, status='done', message=None):
+    """
+    Mark a job item done, skipped or failed
+
+    Not committed here, so the item's outcome commits together with the
+    work it describes.
+    """
+    conn.execute('''
+        UPDATE job_items SET status = ?, message = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ? AND item_id = ?
+    ''', (status, message, job_id, item_id))
+
+
+def count_items(conn, job_id):
+    """
+    Count a job's items by status
+
+    Returns:
+        dict: {'pending', 'done', 'skipped', 'failed'}
+    """
+    counts = {'pending': 0, 'done': 0, 'skipped': 0, 'failed': 0}
+    for row in conn.execute(
+        'SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status', (job_id,)
+    ):
+        counts[row[0]] = row[1]
+    return counts
+
+
+def get_latest_job(conn, job_type, user_id=None):
+    """Get the most recently created job of a type (optionally for one user), or None"""
+    query = 'SELECT id FROM jobs WHERE job_type = ?'
+    params = [job_type]
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    row = conn.execute(query + ' ORDER BY id DESC LIMIT 1', params).fetchone()
+    return get_job(conn, row['id']) if row else None
+
+
+def get_job(conn, job_id):
+    """
+    Get a job's current state
+
+    Args:
+        conn: Database connection
+        job_id: Job to look up
+
+    Returns:
+        dict: Job fields with result decoded from JSON, or None if not found
+    """
+    row = conn.execute('''
+        SELECT *, CAST(strftime('%s', 'now') - strftime('%s', updated_at) AS INTEGER) AS idle_seconds
+        FROM jobs WHERE id = ?
+    ''', (job_id,)).fetchone()
+    if not row:
+        return None
+
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    idle_seconds = job.pop('idle_seconds') or 0
+
+    stale_after = current_app.config.get('BACKGROUND_JOB_STALE_SECONDS', DEFAULT_JOB_STALE_SECONDS)
+    if job['status'] not in FINISHED_STATUSES and idle_seconds > stale_after:
+        message = 'Job was interrupted before it finished'
+        finish_job(conn, job_id, status='failed', message=message)
+        job['status'] = 'failed'
+        job['message'] = message
+
+    return job
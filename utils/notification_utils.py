@@ -0,0 +1,282 @@
+"""
+Notification badge counts, pushed to the browser over Server-Sent Events
+(see migrations/022_add_notification_events.sql and 023_add_user_counters.sql)
+
+Routes that add, read or remove a notification or friend request call
+publish_counts() with the change to the affected user's counts, on the same
+connection and before the same commit as the change itself. That updates
+the user's row in user_counters, so reading the counts is a primary-key
+lookup rather than two COUNT(*)s, and records the change for the streams.
+rebuild_notification_counters() recounts them if they ever drift. Each worker
+runs one broker thread, started by the first stream it serves, that tails
+notification_events once per NOTIFICATION_STREAM_POLL seconds (however many
+streams are open) and hands new events to the streams of the users they
+belong to. A stream sends the counts when it opens and again after every
+change, and ends after NOTIFICATION_STREAM_LIFETIME seconds; EventSource
+reconnects on its own and starts again from fresh counts.
+
+Streams hold a thread for as long as they are open, so production runs
+gunicorn with threaded (gthread) workers, and each worker serves at most
+NOTIFICATION_STREAM_MAX streams at once: past that, the stream is refused
+with a 503 and the page polls instead, leaving the other threads for
+ordinary requests. Keep-alives are sent every few seconds, so a stream
+whose tab has gone frees its thread soon after.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from utils.database import get_db_connection
+
+DEFAULT_STREAM_POLL = 1.0
+DEFAULT_STREAM_LIFETIME = 300
+DEFAULT_STREAM_MAX = 4
+STREAM_HEARTBEAT = 3  # Seconds between keep-alive comments on an idle stream
+STREAM_RETRY_MS = 3000  # How soon EventSource reconnects after a stream ends
+EVENT_RETENTION = '-10 minutes'
+
+logger = logging.getLogger(__name__)
+
+_subscribers = {}  # user ID -> set of queues, one per open stream
+_subscribers_lock = threading.Lock()
+_broker_pid = None
+_broker_wakeup = threading.Event()
+
+
+def publish_counts(conn, user_id, friend_requests=0, notifications=0):
+    """
+    Record a change to a user's badge counts (not committed here)
+
+    Call it on the connection making the change, before its commit, so
+    the counters and the event are updated exactly when the change is.
+
+    Args:
+        conn: Database connection making the change
+        user_id: User whose counts changed
+        friend_requests: Change in their pending friend requests
+        notifications: Change in their unread notifications
+    """
+    if not friend_requests and not notifications:
+        return
+    conn.execute('''
+        INSERT INTO user_counters (user_id, friend_requests, notifications)
+        VALUES (?, MAX(?, 0), MAX(?, 0))
+        ON CONFLICT(user_id) DO UPDATE SET
+            friend_requests = MAX(friend_requests + ?, 0),
+            notifications = MAX(notifications + ?, 0),
+            updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, friend_requests, notifications, friend_requests, notifications))
+    conn.execute('''
+        INSERT INTO notification_events (user_id, friend_requests, notifications)
+        VALUES (?, ?, ?)
+    ''', (user_id, friend_requests, notifications))
+    conn.execute("DELETE FROM notification_events WHERE created_at < datetime('now', ?)",
+                 (EVENT_RETENTION,))
+
+
+def get_notification_counts(conn, user_id):
+    """
+    Get a user's pending friend requests and unread notifications
+
+    Returns:
+        dict: {'count', 'friend_requests', 'notifications', 'last_event'},
+        where last_event is the newest notification_events ID the counts
+        already include
+    """
+    # One statement, so the counts and last_event come from the same snapshot;
+    # a user without a counters row has nothing pending
+    row = conn.execute('''
+        SELECT
+            COALESCE((SELECT friend_requests FROM user_counters WHERE user_id = ?), 0) AS friend_requests,
+            COALESCE((SELECT notifications FROM user_counters WHERE user_id = ?), 0) AS notifications,
+            (SELECT COALESCE(MAX(id), 0) FROM notification_events) AS last_event
+    ''', (user_id, user_id)).fetchone()
+    return {
+        'count': row['friend_requests'] + row['notifications'],
+        'friend_requests': row['friend_requests'],
+        'notifications': row['notifications'],
+        'last_event': row['last_event']
+    }
+
+
+def rebuild_notification_counters(conn):
+    """
+    Recount every user's pending friend requests and unread notifications
+    into user_counters (committed here)
+
+    Returns:
+        int: Number of users whose counters were wrong
+    """
+    drifted = conn.execute('''
+        WITH actual(user_id, friend_requests, notifications) AS (
+            SELECT u.id,
+                   (SELECT COUNT(*) FROM friend_requests
+                    WHERE receiver_id = u.id AND status = 'pending'),
+                   (SELECT COUNT(*) FROM notifications
+                    WHERE user_id = u.id AND is_read = 0 AND type != 'friend_request')
+            FROM users u
+        )
+        SELECT a.user_id, a.friend_requests, a.notifications
+        FROM actual a
+        LEFT JOIN user_counters c ON c.user_id = a.user_id
+        WHERE COALESCE(c.friend_requests, 0) != a.friend_requests
+           OR COALESCE(c.notifications, 0) != a.notifications
+    ''').fetchall()
+    conn.executemany('''
+        INSERT INTO user_counters (user_id, friend_requests, notifications) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            friend_requests = excluded.friend_requests,
+            notifications = excluded.notifications,
+            updated_at = CURRENT_TIMESTAMP
+    ''', [(row['user_id'], row['friend_requests'], row['notifications']) for row in drifted])
+    conn.execute('DELETE FROM user_counters WHERE user_id NOT IN (SELECT id FROM users)')
+    conn.commit()
+    return len(drifted)
+
+
+def _broker_loop(last_id, poll_interval):
+    conn = get_db_connection()  # Standalone: the broker has no app context
+    while True:
+        with _subscribers_lock:
+            idle = not _subscribers
+        if idle:
+            # Nobody is listening in this worker; sleep until a stream opens
+            _broker_wakeup.wait()
+            _broker_wakeup.clear()
+
+        try:
+            rows = conn.execute('''
+                SELECT id, user_id, friend_requests, notifications
+                FROM notification_events
+                WHERE id > ?
+                ORDER BY id
+            ''', (last_id,)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Reading notification events failed: {e}")
+            rows = []
+
+        for row in rows:
+            last_id = row['id']
+            with _subscribers_lock:
+                streams = list(_subscribers.get(row['user_id'], ()))
+            for stream in streams:
+                stream.put(dict(row))
+        time.sleep(poll_interval)
+
+
+def _start_broker(conn, poll_interval):
+    """Start this worker's broker thread once (threads don't survive a fork)."""
+    global _broker_pid
+    if _broker_pid == os.getpid():
+        return
+    with _subscribers_lock:
+        if _broker_pid == os.getpid():
+            return
+        # Read here rather than in the thread, so it comes before the
+        # opening counts of the stream that starts the broker
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM notification_events').fetchone()[0]
+        _broker_pid = os.getpid()
+    threading.Thread(target=_broker_loop, args=(last_id, poll_interval),
+                     name='notification-broker', daemon=True).start()
+
+
+def _subscribe(conn, user_id, poll_interval, max_streams):
+    # Subscribed before the opening counts are read, so no event falls in between
+    _start_broker(conn, poll_interval)
+    stream = queue.Queue()
+    with _subscribers_lock:
+        if sum(len(streams) for streams in _subscribers.values()) >= max_streams:
+            return None
+        _subscribers.setdefault(user_id, set()).add(stream)
+    _broker_wakeup.set()
+    return stream
+
+
+def _unsubscribe(user_id, stream):
+    with _subscribers_lock:
+        streams = _subscribers.get(user_id)
+        if streams:
+            streams.discard(stream)
+            if not streams:
+                del _subscribers[user_id]
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class NotificationStream:
+    """
+    Server-Sent Events text for one open stream: a 'counts' event when it
+    opens and after every change
+
+    The server calls close() when the response ends, even if the client
+    went away before it was iterated, and that unsubscribes it.
+    """
+
+    def __init__(self, user_id, events, counts, lifetime):
+        self.user_id = user_id
+        self.events = events
+        self.counts = counts
+        self.lifetime = lifetime
+
+    def __iter__(self):
+        counts = dict(self.counts)
+        last_event = counts.pop('last_event')
+        deadline = time.monotonic() + self.lifetime
+        yield f"retry: {STREAM_RETRY_MS}\n" + _sse('counts', counts)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = self.events.get(timeout=min(STREAM_HEARTBEAT, remaining))
+            except queue.Empty:
+                # Keeps proxies from closing the connection, and finds out
+                # when the browser has gone away
+                yield ": keep-alive\n\n"
+                continue
+            if event['id'] <= last_event:
+                continue  # Already in the opening counts
+            last_event = event['id']
+            counts['friend_requests'] = max(counts['friend_requests'] + event['friend_requests'], 0)
+            counts['notifications'] = max(counts['notifications'] + event['notifications'], 0)
+            counts['count'] = counts['friend_requests'] + counts['notifications']
+            yield _sse('counts', counts)
+
+    def close(self):
+        _unsubscribe(self.user_id, self.events)
+
+
+def open_notification_stream(conn, user_id, poll_interval=DEFAULT_STREAM_POLL,
+                             lifetime=DEFAULT_STREAM_LIFETIME, max_streams=DEFAULT_STREAM_MAX):
+    """
+    Start a user's notification stream
+
+    The opening counts are read here, on the request's connection; the
+    stream itself doesn't use the database, so it can outlive the request
+    context.
+
+    Args:
+        conn: The request's database connection
+        user_id: User to stream counts for
+        poll_interval: Seconds between the broker's reads of notification_events
+        lifetime: Seconds before the stream ends and the browser reconnects
+        max_streams: Most streams this worker serves at once
+
+    Returns:
+        NotificationStream: Response body, or None if this worker already
+        serves max_streams streams
+    """
+    events = _subscribe(conn, user_id, poll_interval, max_streams)
+    if events is None:
+        return None
+    try:
+        counts = get_notification_counts(conn, user_id)
+    except Exception:
+        _unsubscribe(user_id, events)
+        raise
+    return NotificationStream(user_id, events, counts, lifetime)
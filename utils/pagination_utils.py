@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination for the book listings and the activity feed
+"""
+import base64
+import binascii
+import hashlib
+import json
+
+
+def _signature(query, params, sort_expr, sort_order):
+    """Fingerprint of a listing's filters and sort, so a cursor is only honoured for the listing that issued it"""
+    raw = f"{query}|{params!r}|{sort_expr}|{sort_order}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(data):
+    """Serialize cursor state into an opaque URL-safe token"""
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Parse a token produced by encode_cursor()
+
+    Returns:
+        dict: Cursor state, or None if the token is missing or malformed
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def _after_clause(sort_expr, sort_order, value, last_id):
+    """
+    WHERE fragment selecting rows that sort after (value, last_id).
+
+    SQLite sorts NULLs first ascending and last descending, so NULL sort
+    values need their own branches to keep the walk consistent with ORDER BY.
+    """
+    op = '>' if sort_order == 'asc' else '<'
+    if value is None:
+        if sort_order == 'asc':
+            return f"(({sort_expr} IS NULL AND b.id {op} ?) OR {sort_expr} IS NOT NULL)", [last_id]
+        return f"({sort_expr} IS NULL AND b.id {op} ?)", [last_id]
+
+    clause = f"{sort_expr} {op} ? OR ({sort_expr} = ? AND b.id {op} ?)"
+    if sort_order == 'desc':
+        clause += f" OR {sort_expr} IS NULL"
+    return f"({clause})", [value, value, last_id]
+
+
+def paginate_books(conn, query, params, sort_expr, sort_order, per_page, page=1, cursor=None):
+    """
+    Run a 'SELECT b.* FROM books b WHERE ...' listing query one page at a time.
+
+    With a cursor from a previous page the query seeks straight past the last
+    row seen using the (sort_expr, b.id) key, so every page costs the same as
+    the first, and the total count is carried in the cursor instead of being
+    recounted. Without a cursor the page number is used as an OFFSET, which
+    keeps plain ?page=N links working.
+
+    Args:
+        conn: Database connection
+        query: Listing query starting with 'SELECT b.*', without ORDER BY/LIMIT
+        params: Parameters for query
+        sort_expr: SQL expression to sort on (e.g. 'b.title')
+        sort_order: 'asc' or 'desc'
+        per_page: Page size
+        page: Page number, used when no valid cursor is given
+        cursor: Token from a previous page's next_cursor
+
+    Returns:
+        tuple: (books, total_count, has_more, next_cursor, page), where page
+        is the page actually served: 1 if a stale cursor made the listing
+        start over
+    """
+    signature = _signature(query, params, sort_expr, sort_order)
+    state = decode_cursor(cursor)
+    if state and (not {'v', 'id', 'n', 's'} <= state.keys() or state['s'] != signature):
+        # Filters or sort changed since the cursor was issued; start over
+        state = None
+        page = 1
+
+    params = list(params)
+    if state:
+        total_count = state['n']
+    else:
+        count_query = query.replace("SELECT b.*", "SELECT COUNT(b.id)")
+        total_count = conn.execute(count_query, params).fetchone()[0]
+
+    # Expose the sort key as a trailing column so the next cursor can be built
+    # from it; templates read book rows by position, so b.* must stay first
+    query = query.replace("SELECT b.*", f"SELECT b.*, {sort_expr} AS sort_key", 1)
+    if state:
+        clause, clause_params = _after_clause(sort_expr, sort_order, state['v'], state['id'])
+        query += f" AND {clause}"
+        params.extend(clause_params)
+        offset = 0
+    else:
+        offset = (max(page, 1) - 1) * per_page
+
+    # Fetch one extra row to find out whether there is another page
+    query += f" ORDER BY {sort_expr} {sort_order}, b.id {sort_order} LIMIT ? OFFSET ?"
+    params.extend([per_page + 1, offset])
+
+    books = conn.execute(query, params).fetchall()
+    has_more = len(books) > per_page
+    books = books[:per_page]
+
+    next_cursor = None
+    if has_more:
+        last = books[-1]
+        next_cursor = encode_cursor({
+            'v': last['sort_key'],
+            'id': last['id'],
+            'n': total_count,
+            's': signature
+        })
+
+    return books, total_count, has_more, next_cursor, page
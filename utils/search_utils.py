@@ -0,0 +1,43 @@
+"""
+Full-text search helpers for the books_fts index (see migrations/013_add_books_fts.sql)
+"""
+import re
+
+# bm25() column weights, in books_fts column order:
+# title, subtitle, author, publisher, description, genre, publish_year
+BM25_WEIGHTS = (10.0, 4.0, 8.0, 1.0, 1.0, 2.0, 1.0)
+BM25_RANK = f"bm25(books_fts, {', '.join(str(w) for w in BM25_WEIGHTS)})"
+
+
+def build_fts_query(search_term):
+    """
+    Turn free-form user input into a safe FTS5 MATCH expression.
+
+    Quoted text becomes a phrase query and every other word becomes a prefix
+    query, so "lord of" tolk matches 'The Lord of the Rings' by Tolkien. All
+    terms must match. Each term is quoted, so FTS5 operators typed by the
+    user (AND, NEAR, column filters, ...) are searched for as plain words.
+
+    Args:
+        search_term: Raw text from the search box
+
+    Returns:
+        str: MATCH expression, or None if the input has nothing searchable
+    """
+    if not search_term:
+        return None
+
+    parts = []
+
+    # Phrases in double quotes are matched exactly, in order
+    for phrase in re.findall(r'"([^"]*)"', search_term):
+        words = re.findall(r'\w+', phrase)
+        if words:
+            parts.append('"' + ' '.join(words) + '"')
+
+    # Everything else is matched word by word as a prefix
+    remainder = re.sub(r'"[^"]*"?', ' ', search_term)
+    for word in re.findall(r'\w+', remainder):
+        parts.append(f'"{word}"*')
+
+    return ' '.join(parts) if parts else None
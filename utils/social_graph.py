@@ -0,0 +1,127 @@
+"""
+Per-process cache of the social graph: friendships, pending friend requests
+and shared-library membership (see migrations/024_add_cache_versions.sql)
+
+Friendship and household checks run many times per page (the feed, book
+pages, profiles, privacy checks), so each worker keeps the whole graph in
+memory as adjacency sets and answers them without touching the database.
+Triggers bump cache_versions.social_graph whenever friendships,
+friend_requests or library_members change, whichever route or worker made
+the change; the version is read once per request, and the graph is
+reloaded when it has moved on. Routes that change the graph call
+invalidate_social_graph() after committing, so the rest of that same
+request sees the change too.
+"""
+import threading
+from flask import g, has_app_context
+from utils.database import get_db_connection
+
+_graph = None
+_load_lock = threading.Lock()
+
+
+class SocialGraph:
+    """
+    A snapshot of the social graph; never changed once loaded
+
+    Attributes:
+        version: cache_versions.social_graph the snapshot was loaded at
+        friends: user ID -> frozenset of friend IDs
+        requests: set of (sender ID, receiver ID) for pending friend requests
+        library_of: user ID -> library ID, for users in a shared library
+        libraries: library ID -> frozenset of member IDs
+    """
+
+    def __init__(self, version, friends, requests, library_of, libraries):
+        self.version = version
+        self.friends = friends
+        self.requests = requests
+        self.library_of = library_of
+        self.libraries = libraries
+
+    def friend_ids(self, user_id):
+        return self.friends.get(user_id, frozenset())
+
+    def are_friends(self, user_id, other_user_id):
+        return other_user_id in self.friends.get(user_id, ())
+
+    def request_between(self, sender_id, receiver_id):
+        return (sender_id, receiver_id) in self.requests
+
+    def library_members(self, user_id):
+        library_id = self.library_of.get(user_id)
+        if library_id is None:
+            return frozenset((user_id,))
+        return self.libraries[library_id]
+
+    def share_library(self, user_id, other_user_id):
+        library_id = self.library_of.get(user_id)
+        return library_id is not None and library_id == self.library_of.get(other_user_id)
+
+
+def _load_graph(conn, version):
+    friends = {}
+    for row in conn.execute('SELECT user_id_1, user_id_2 FROM friendships'):
+        friends.setdefault(row['user_id_1'], set()).add(row['user_id_2'])
+        friends.setdefault(row['user_id_2'], set()).add(row['user_id_1'])
+
+    requests = {
+        (row['sender_id'], row['receiver_id'])
+        for row in conn.execute("SELECT sender_id, receiver_id FROM friend_requests WHERE status = 'pending'")
+    }
+
+    library_of = {}
+    libraries = {}
+    for row in conn.execute('SELECT library_id, user_id FROM library_members'):
+        library_of[row['user_id']] = row['library_id']
+        libraries.setdefault(row['library_id'], set()).add(row['user_id'])
+
+    return SocialGraph(
+        version,
+        {user_id: frozenset(ids) for user_id, ids in friends.items()},
+        frozenset(requests),
+        library_of,
+        {library_id: frozenset(ids) for library_id, ids in libraries.items()}
+    )
+
+
+def get_social_graph():
+    """
+    Get this worker's social graph, reloading it if the database has changed
+
+    Within a request the version is only checked the first time.
+
+    Returns:
+        SocialGraph
+    """
+    global _graph
+    if has_app_context() and 'social_graph' in g:
+        return g.social_graph
+
+    conn = get_db_connection()
+    try:
+        # Read before the tables: a change that lands in between bumps the
+        # version again, so at worst the next check reloads once more
+        version = conn.execute(
+            "SELECT version FROM cache_versions WHERE name = 'social_graph'"
+        ).fetchone()[0]
+        graph = _graph
+        if graph is None or graph.version != version:
+            with _load_lock:
+                graph = _graph
+                if graph is None or graph.version != version:
+                    graph = _load_graph(conn, version)
+                    if _graph is None or _graph.version <= version:
+                        _graph = graph
+    finally:
+        conn.close()
+
+    if has_app_context():
+        g.social_graph = graph
+    return graph
+
+
+def invalidate_social_graph():
+    """Make the rest of this request reload the graph after committing a change to it"""
+    if has_app_context():
+        g.pop('social_graph', None)
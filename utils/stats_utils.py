@@ -0,0 +1,294 @@
+"""
+Cached reading statistics
+
+Per-user stats (migrations/015_add_user_stats.sql) aggregate a reader's whole
+history, so the result is stored in user_stats and only recomputed after
+triggers on read_data, reading_sessions, collections and books have bumped the
+row's version, or when the month rolls over.
+
+Whole-library stats (migrations/016_add_library_stats.sql) scan every book, so
+they are kept in library_stats and recomputed after a book write has called
+invalidate_library_stats(), or a trigger on collections has bumped the version.
+"""
+import json
+from datetime import datetime
+from utils.database import get_standalone_connection
+
+
+def compute_user_stats(conn, user_id):
+    """Calculate user reading statistics from scratch (everything except read_percentage)"""
+    query = '''
+        SELECT
+            COUNT(DISTINCT r.book_id) as books_read,
+            SUM(CAST(b.page_count AS INTEGER)) as pages_read,
+            AVG(r.rating) as avg_rating
+        FROM read_data r
+        JOIN books b ON r.book_id = b.id
+        WHERE r.user_id = ?
+    '''
+    stats = conn.execute(query, [user_id]).fetchone()
+
+    # Calculate year-to-date reading progress
+    current_year = datetime.now().year
+    ytd_query = '''
+        SELECT COUNT(DISTINCT rs.book_id) as books_read_this_year
+        FROM reading_sessions rs
+        WHERE rs.user_id = ?
+        AND rs.date_completed IS NOT NULL
+        AND strftime('%Y', rs.date_completed) = ?
+    '''
+    ytd_stats = conn.execute(ytd_query, [user_id, str(current_year)]).fetchone()
+
+    result = dict(stats) if stats else {}
+    if ytd_stats:
+        result['books_read_this_year'] = ytd_stats['books_read_this_year']
+    else:
+        result['books_read_this_year'] = 0
+
+    # Reading by month (last 12 months)
+    reading_by_month_query = '''
+        SELECT
+            strftime('%Y-%m', rs.date_completed) as month,
+            COUNT(DISTINCT rs.book_id) as books_count
+        FROM reading_sessions rs
+        WHERE rs.user_id = ?
+        AND rs.date_completed IS NOT NULL
+        AND rs.date_completed >= date('now', '-12 months')
+        GROUP BY month
+        ORDER BY month
+    '''
+    result['reading_by_month'] = [dict(row) for row in conn.execute(reading_by_month_query, [user_id]).fetchall()]
+
+    # Top genres
+    top_genres_query = '''
+        SELECT
+            b.genre,
+            COUNT(DISTINCT r.book_id) as count
+        FROM read_data r
+        JOIN books b ON r.book_id = b.id
+        WHERE r.user_id = ? AND b.genre IS NOT NULL AND b.genre != ''
+        GROUP BY b.genre
+        ORDER BY count DESC
+        LIMIT 5
+    '''
+    result['top_genres'] = [dict(row) for row in conn.execute(top_genres_query, [user_id]).fetchall()]
+
+    # Rating distribution
+    rating_dist_query = '''
+        SELECT
+            r.rating,
+            COUNT(*) as count
+        FROM read_data r
+        WHERE r.user_id = ? AND r.rating IS NOT NULL
+        GROUP BY r.rating
+        ORDER BY r.rating
+    '''
+    result['rating_distribution'] = [dict(row) for row in conn.execute(rating_dist_query, [user_id]).fetchall()]
+
+    # Collection status breakdown
+    collection_status_query = '''
+        SELECT
+            c.status,
+            COUNT(DISTINCT c.book_id) as count
+        FROM collections c
+        WHERE c.user_id = ?
+        GROUP BY c.status
+    '''
+    result['collection_status'] = [dict(row) for row in conn.execute(collection_status_query, [user_id]).fetchall()]
+
+    # Top authors
+    top_authors_query = '''
+        SELECT
+            b.author,
+            COUNT(DISTINCT r.book_id) as books_count,
+            ROUND(AVG(r.rating), 1) as avg_rating
+        FROM read_data r
+        JOIN books b ON r.book_id = b.id
+        WHERE r.user_id = ?
+        GROUP BY b.author
+        ORDER BY books_count DESC, avg_rating DESC
+        LIMIT 5
+    '''
+    result['top_authors'] = [dict(row) for row in conn.execute(top_authors_query, [user_id]).fetchall()]
+
+    # Reading streak stats
+    streak_query = '''
+        SELECT
+            MIN(date_completed) as first_read,
+            MAX(date_completed) as last_read,
+            COUNT(DISTINCT date(date_completed)) as unique_days
+        FROM reading_sessions
+        WHERE user_id = ? AND date_completed IS NOT NULL
+    '''
+    streak_stats = conn.execute(streak_query, [user_id]).fetchone()
+    if streak_stats:
+        result.update(dict(streak_stats))
+
+    return result
+
+
+def _current_period():
+    return datetime.now().strftime('%Y-%m')
+
+
+def refresh_user_stats(conn, user_id):
+    """
+    Recompute and store a user's stats.
+
+    The version is read before computing and stored alongside the result, so
+    a change committed while we were computing still leaves the row stale.
+    The row is written through a connection of its own, so the caller's
+    pending changes are never committed here; while the caller has any, the
+    stats are computed on conn and not stored, rather than wait for its lock.
+
+    Returns:
+        dict: The freshly computed stats
+    """
+    if conn.in_transaction:
+        return compute_user_stats(conn, user_id)
+
+    cache_conn = get_standalone_connection()
+    try:
+        # Commit the placeholder row straight away so the database isn't write-locked while computing
+        cache_conn.execute('INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)', (user_id,))
+        cache_conn.commit()
+        version = cache_conn.execute('SELECT version FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()['version']
+
+        stats = compute_user_stats(cache_conn, user_id)
+        cache_conn.execute('''
+            UPDATE user_stats
+            SET stats = ?, period = ?, computed_version = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        ''', (json.dumps(stats), _current_period(), version, user_id))
+        cache_conn.commit()
+    finally:
+        cache_conn.close()
+    return stats
+
+
+def get_user_stats(conn, user_id):
+    """
+    Get a user's reading statistics, recomputing them only if they are stale.
+
+    Returns:
+        dict: Stats as produced by compute_user_stats(), plus read_percentage
+    """
+    row = conn.execute('''
+        SELECT stats, period, version, computed_version
+        FROM user_stats
+        WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+    if row and row['stats'] and row['computed_version'] == row['version'] and row['period'] == _current_period():
+        result = json.loads(row['stats'])
+    else:
+        result = refresh_user_stats(conn, user_id)
+
+    # Read percentage (books user has read vs total books in library) depends
+    # on the whole library, so it comes from the library stats cache
+    books_read = result.get('books_read', 0) or 0
+    total_books = get_library_stats(conn)['total_books'] or 0
+
+    if total_books > 0:
+        result['read_percentage'] = round((books_read / total_books) * 100, 1)
+    else:
+        result['read_percentage'] = 0
+
+    return result
+
+
+def rebuild_user_stats(conn):
+    """
+    Recompute stats for every user.
+
+    Returns:
+        int: Number of users rebuilt
+    """
+    user_ids = [row['id'] for row in conn.execute('SELECT id FROM users').fetchall()]
+    for user_id in user_ids:
+        refresh_user_stats(conn, user_id)
+    return len(user_ids)
+
+
+def compute_library_stats(conn):
+    """Calculate whole-library statistics from scratch"""
+    query = '''
+        SELECT
+            COUNT(DISTINCT b.id) as total_books,
+            SUM(CAST(b.page_count AS INTEGER)) as total_pages,
+            COUNT(DISTINCT c.book_id) as read_books,
+            (SELECT COUNT(*) FROM (
+                SELECT DISTINCT author FROM books
+            )) as unique_authors,
+            (SELECT title FROM books
+             WHERE CAST(page_count AS INTEGER) = (
+                 SELECT MAX(CAST(page_count AS INTEGER)) FROM books
+             )) as longest_book,
+            (SELECT MAX(CAST(page_count AS INTEGER)) FROM books) as longest_pages,
+            (
+                SELECT genre
+                FROM (
+                    SELECT genre, COUNT(*) as count
+                    FROM books
+                    WHERE genre IS NOT NULL
+                    GROUP BY genre
+                    ORDER BY count DESC
+                    LIMIT 1
+                )
+            ) as most_common_genre
+        FROM books b
+        LEFT JOIN collections c ON b.id = c.book_id AND c.status = 'read'
+    '''
+    stats = dict(conn.execute(query).fetchone())
+    if stats['total_books']:
+        stats['read_percentage'] = round((stats['read_books'] / stats['total_books']) * 100)
+        stats['total_pages'] = "{:,}".format(int(stats['total_pages'] or 0))
+        stats['longest_pages'] = "{:,}".format(int(stats['longest_pages'] or 0))
+    return stats
+
+
+def invalidate_library_stats(conn):
+    """Mark the library stats stale; call after inserting, updating or deleting books (not committed here)"""
+    conn.execute('UPDATE library_stats SET version = version + 1 WHERE id = 1')
+
+
+def get_library_stats(conn):
+    """
+    Get whole-library statistics, recomputing them only after a book or collection write.
+
+    Stale stats are stored the same way as refresh_user_stats() stores a
+    user's: through a connection of its own, and not while the caller has
+    uncommitted changes.
+
+    Returns:
+        dict: Stats as produced by compute_library_stats()
+    """
+    row = conn.execute('''
+        SELECT stats, version, computed_version
+        FROM library_stats
+        WHERE id = 1
+    ''').fetchone()
+
+    if row and row['stats'] and row['computed_version'] == row['version']:
+        return json.loads(row['stats'])
+
+    if conn.in_transaction:
+        return compute_library_stats(conn)
+
+    cache_conn = get_standalone_connection()
+    try:
+        # Same versioning as refresh_user_stats(): a book written while we compute keeps the row stale
+        cache_conn.execute('INSERT OR IGNORE INTO library_stats (id) VALUES (1)')
+        cache_conn.commit()
+        version = cache_conn.execute('SELECT version FROM library_stats WHERE id = 1').fetchone()['version']
+
+        stats = compute_library_stats(cache_conn)
+        cache_conn.execute('''
+            UPDATE library_stats
+            SET stats = ?, computed_version = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1
+        ''', (json.dumps(stats), version))
+        cache_conn.commit()
+    finally:
+        cache_conn.close()
+    return stats
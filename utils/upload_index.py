@@ -0,0 +1,317 @@
+"""
+Index of the files under static/uploads (see migrations/021_add_upload_index.sql)
+
+Saving or deleting an image updates the index directly. rescan_uploads()
+catches everything else (files written by the CLI commands, copied in by
+hand, ...) with os.scandir, but only lists directories whose mtime has
+changed since the last scan and only stats files it hasn't seen before.
+
+An image and its thumbnails and alternative encodings share an image_key.
+refresh_references() marks every key that a book, avatar, ISBN cache entry
+or in-use stored cover points at as referenced, in a single UPDATE, so the
+orphan report is a query on the index. Cleanup runs as a background job.
+"""
+import logging
+import os
+import re
+import time
+from flask import current_app
+from utils.database import get_db_connection
+from utils.image_utils import THUMBNAIL_DIR, derived_paths, is_variant
+from utils.jobs import update_job, finish_job, is_cancel_requested
+
+RESCAN_JOB_TYPE = 'upload_rescan'
+CLEANUP_JOB_TYPE = 'orphan_cleanup'
+CLEANUP_BATCH_SIZE = 100
+DEFAULT_COVER_ORPHAN_GRACE = 3600
+
+logger = logging.getLogger(__name__)
+
+_THUMBNAIL_SUFFIX = re.compile(r'_\d+w$')
+
+
+def image_key(image_path):
+    """
+    Key shared by an image and the files generated from it
+
+    'uploads/cover_1.jpg', 'uploads/thumbs/cover_1_200w.jpg' and
+    'uploads/thumbs/cover_1_200w.jpg.webp' all have the key 'cover_1'.
+    """
+    name = os.path.basename(image_path)
+    if is_variant(name):
+        name = name.rsplit('.', 1)[0]
+    stem = name.rsplit('.', 1)[0]
+    if os.path.basename(os.path.dirname(image_path)) == THUMBNAIL_DIR:
+        stem = _THUMBNAIL_SUFFIX.sub('', stem)
+    return stem
+
+
+def _is_derived(image_path):
+    return is_variant(os.path.basename(image_path)) or \
+        os.path.basename(os.path.dirname(image_path)) == THUMBNAIL_DIR
+
+
+def _static_dir():
+    return os.path.join(current_app.root_path, 'static')
+
+
+def _upsert_files(conn, rows):
+    """rows: (path, dir, image_key, derived, size, mtime)"""
+    conn.executemany('''
+        INSERT INTO upload_files (path, dir, image_key, derived, size, mtime)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            size = excluded.size,
+            mtime = excluded.mtime,
+            indexed_at = CURRENT_TIMESTAMP
+    ''', rows)
+
+
+def index_image(image_path):
+    """
+    Add a newly saved image and its thumbnails/alternative encodings to the index
+
+    New files count as referenced until the next refresh_references(), so an
+    upload is never reported before the row pointing at it is saved.
+    """
+    rows = []
+    for path in [image_path] + derived_paths(image_path):
+        try:
+            st = os.stat(os.path.join(_static_dir(), path))
+        except FileNotFoundError:
+            continue
+        rows.append((path, os.path.dirname(path), image_key(path), int(_is_derived(path)),
+                     st.st_size, st.st_mtime_ns))
+    if rows:
+        conn = get_db_connection()
+        _upsert_files(conn, rows)
+        conn.commit()
+
+
+def unindex_paths(paths):
+    """Drop deleted files from the index"""
+    conn = get_db_connection()
+    conn.executemany('DELETE FROM upload_files WHERE path = ?', ((path,) for path in paths))
+    conn.commit()
+
+
+def rescan_uploads(conn, full=False):
+    """
+    Bring the index up to date with static/uploads
+
+    Args:
+        conn: Database connection (committed per directory)
+        full: List and stat every directory and file, not just changed ones
+
+    Returns:
+        dict: {'dirs_scanned', 'dirs_skipped', 'files_added', 'files_removed'}
+    """
+    static_dir = _static_dir()
+    known_dirs = {row['path']: row['mtime'] for row in conn.execute('SELECT path, mtime FROM upload_dirs')}
+    stats = {'dirs_scanned': 0, 'dirs_skipped': 0, 'files_added': 0, 'files_removed': 0}
+    seen_dirs = set()
+    pending = [('uploads', None)]
+
+    while pending:
+        rel_dir, parent = pending.pop()
+        try:
+            dir_mtime = os.stat(os.path.join(static_dir, rel_dir)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        seen_dirs.add(rel_dir)
+
+        if not full and known_dirs.get(rel_dir) == dir_mtime:
+            # Nothing added, removed or renamed here; subdirectories may still have changed
+            stats['dirs_skipped'] += 1
+            pending.extend((row['path'], rel_dir) for row in conn.execute(
+                'SELECT path FROM upload_dirs WHERE parent = ?', (rel_dir,)))
+            continue
+
+        indexed = {row['path'] for row in conn.execute(
+            'SELECT path FROM upload_files WHERE dir = ?', (rel_dir,))}
+        present = set()
+        new_rows = []
+        with os.scandir(os.path.join(static_dir, rel_dir)) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name.endswith('.tmp'):
+                    continue
+                path = f"{rel_dir}/{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((path, rel_dir))
+                elif entry.is_file(follow_symlinks=False):
+                    present.add(path)
+                    if full or path not in indexed:
+                        st = entry.stat()
+                        new_rows.append((path, rel_dir, image_key(path), int(_is_derived(path)),
+                                         st.st_size, st.st_mtime_ns))
+
+        removed = indexed - present
+        conn.executemany('DELETE FROM upload_files WHERE path = ?', ((path,) for path in removed))
+        _upsert_files(conn, new_rows)
+        conn.execute('''
+            INSERT INTO upload_dirs (path, parent, mtime) VALUES (?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, scanned_at = CURRENT_TIMESTAMP
+        ''', (rel_dir, parent, dir_mtime))
+        conn.commit()
+
+        stats['dirs_scanned'] += 1
+        stats['files_added'] += len([row for row in new_rows if row[0] not in indexed])
+        stats['files_removed'] += len(removed)
+
+    for gone in set(known_dirs) - seen_dirs:
+        cursor = conn.execute('DELETE FROM upload_files WHERE dir = ?', (gone,))
+        stats['files_removed'] += cursor.rowcount
+        conn.execute('DELETE FROM upload_dirs WHERE path = ?', (gone,))
+    conn.commit()
+
+    refresh_references(conn)
+    return stats
+
+
+def refresh_references(conn):
+    """Recompute upload_files.referenced from the rows that point at images (committed here)"""
+    grace = current_app.config.get('COVER_ORPHAN_GRACE', DEFAULT_COVER_ORPHAN_GRACE)
+    conn.execute('''
+        WITH live_keys(image_key) AS (
+            SELECT image_key FROM upload_files
+            WHERE derived = 0 AND path IN (
+                SELECT cover_image_url FROM books
+                UNION SELECT avatar_url FROM users
+                UNION SELECT local_cover_url FROM isbn_cache
+                UNION SELECT path FROM cover_files
+                      WHERE ref_count > 0 OR released_at > datetime('now', ?)
+            )
+        )
+        UPDATE upload_files
+        SET referenced = NOT referenced
+        WHERE referenced != (image_key IN (SELECT image_key FROM live_keys))
+    ''', (f'-{int(grace)} seconds',))
+    conn.commit()
+
+
+def get_orphan_report(conn):
+    """
+    Unreferenced images, grouped with their thumbnails and alternative encodings
+
+    Files modified within COVER_ORPHAN_GRACE seconds are left out, as they
+    may belong to an upload that hasn't been saved to its book yet.
+
+    Returns:
+        dict: {
+            'orphaned_files': list of dicts (path, image_key, files, size, size_kb, size_mb),
+            'total_size', 'total_size_mb', 'count',
+            'last_scan': when the index was last rescanned, or None if never
+        }
+    """
+    refresh_references(conn)
+    grace = current_app.config.get('COVER_ORPHAN_GRACE', DEFAULT_COVER_ORPHAN_GRACE)
+    cutoff = time.time_ns() - int(grace) * 1_000_000_000
+
+    rows = conn.execute('''
+        SELECT image_key,
+               COALESCE(MIN(CASE WHEN derived = 0 THEN path END), MIN(path)) AS path,
+               COUNT(*) AS files,
+               SUM(size) AS size
+        FROM upload_files
+        WHERE referenced = 0 AND mtime < ?
+        GROUP BY image_key
+        ORDER BY size DESC
+    ''', (cutoff,)).fetchall()
+
+    orphaned = [{
+        'path': row['path'],
+        'image_key': row['image_key'],
+        'files': row['files'],
+        'size': row['size'],
+        'size_kb': round(row['size'] / 1024, 2),
+        'size_mb': round(row['size'] / (1024 * 1024), 2)
+    } for row in rows]
+    total_size = sum(row['size'] for row in rows)
+    last_scan = conn.execute('SELECT MAX(scanned_at) FROM upload_dirs').fetchone()[0]
+
+    return {
+        'orphaned_files': orphaned,
+        'total_size': total_size,
+        'total_size_mb': round(total_size / (1024 * 1024), 2),
+        'count': len(orphaned),
+        'last_scan': last_scan
+    }
+
+
+def run_upload_rescan(job_id, full=False):
+    """Job target: rescan static/uploads"""
+    conn = get_db_connection()
+    stats = rescan_uploads(conn, full=full)
+    logger.info(f"Uploads rescan complete: {stats}")
+    finish_job(conn, job_id, result=stats)
+
+
+def _delete_orphan(conn, image_key_value):
+    """Delete one unreferenced image's files; returns (files_deleted, bytes_freed), or None if in use again"""
+    rows = conn.execute(
+        'SELECT path, size, referenced FROM upload_files WHERE image_key = ?', (image_key_value,)
+    ).fetchall()
+    if not rows or any(row['referenced'] for row in rows):
+        return None
+
+    # Stored covers are only removed while nothing references them
+    for row in rows:
+        cover = conn.execute(
+            'SELECT hash, ref_count FROM cover_files WHERE path = ?', (row['path'],)
+        ).fetchone()
+        if cover and cover['ref_count']:
+            return None
+        if cover:
+            conn.execute('DELETE FROM cover_files WHERE hash = ? AND ref_count = 0', (cover['hash'],))
+            conn.execute('DELETE FROM cover_sources WHERE hash = ?', (cover['hash'],))
+
+    static_dir = _static_dir()
+    deleted = 0
+    freed = 0
+    for row in rows:
+        try:
+            os.remove(os.path.join(static_dir, row['path']))
+            deleted += 1
+            freed += row['size']
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to delete {row['path']}: {e}")
+            continue
+        conn.execute('DELETE FROM upload_files WHERE path = ?', (row['path'],))
+    return deleted, freed
+
+
+def run_orphan_cleanup(job_id, image_keys):
+    """
+    Job target: delete the files of unreferenced images, CLEANUP_BATCH_SIZE
+    images per transaction
+
+    Args:
+        job_id: The cleanup's job ID
+        image_keys: Keys of the images to delete (from get_orphan_report)
+    """
+    conn = get_db_connection()
+    stats = {'images_deleted': 0, 'files_deleted': 0, 'bytes_freed': 0, 'skipped': 0}
+    update_job(conn, job_id, total=len(image_keys))
+
+    for start in range(0, len(image_keys), CLEANUP_BATCH_SIZE):
+        if is_cancel_requested(conn, job_id):
+            finish_job(conn, job_id, status='cancelled', result=stats)
+            return
+
+        # References may have changed since the report was shown
+        refresh_references(conn)
+        for key in image_keys[start:start + CLEANUP_BATCH_SIZE]:
+            outcome = _delete_orphan(conn, key)
+            if outcome is None:
+                stats['skipped'] += 1
+            else:
+                stats['images_deleted'] += 1
+                stats['files_deleted'] += outcome[0]
+                stats['bytes_freed'] += outcome[1]
+        conn.commit()
+        update_job(conn, job_id, processed=min(start + CLEANUP_BATCH_SIZE, len(image_keys)), result=stats)
+
+    logger.info(f"Orphan cleanup complete: {stats}")
+    finish_job(conn, job_id, result=stats)
@@ -0,0 +1,92 @@
+"""
+Per-process cache of the users behind Flask-Login's user_loader
+
+Every authenticated request (including the notification badge's poll) loads
+its user, so users are kept in a small LRU cache for USER_CACHE_TTL seconds
+and most requests never touch the database to authenticate. Routes that
+change a user's row call invalidate_user() so this worker sees the change
+straight away; other gunicorn workers see it when their entry expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from utils.database import get_db_connection
+from models import User
+
+DEFAULT_USER_CACHE_SIZE = 1024
+DEFAULT_USER_CACHE_TTL = 60
+
+_users = OrderedDict()  # user ID -> (expires at, User)
+_invalidations = 0  # Bumped by invalidate_user(), so a load that raced one isn't cached
+_lock = threading.Lock()
+
+
+def _load_user(user_id):
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+
+    user = dict(row)
+    return User(
+        id=user['id'],
+        username=user['username'],
+        email=user['email'],
+        is_active=user.get('is_active', 0) == 1,
+        is_admin=user.get('is_admin', 0) == 1,
+        avatar_url=user.get('avatar_url'),
+        email_verified=user.get('email_verified', 1) == 1,
+        bio=user.get('bio')
+    )
+
+
+def get_user(user_id):
+    """
+    Get a user for Flask-Login, from the cache if it holds a fresh entry
+
+    Args:
+        user_id: User ID (as stored in the session)
+
+    Returns:
+        User: The user, or None if there is no such user
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        entry = _users.get(user_id)
+        if entry and entry[0] > now:
+            _users.move_to_end(user_id)
+            return entry[1]
+        invalidations = _invalidations
+
+    # Missing users aren't cached, so a deleted user's session stops working at once
+    user = _load_user(user_id)
+    if user is None:
+        return None
+
+    ttl = current_app.config.get('USER_CACHE_TTL', DEFAULT_USER_CACHE_TTL)
+    size = current_app.config.get('USER_CACHE_SIZE', DEFAULT_USER_CACHE_SIZE)
+    with _lock:
+        if invalidations != _invalidations:
+            return user
+        _users[user_id] = (now + ttl, user)
+        _users.move_to_end(user_id)
+        while len(_users) > size:
+            _users.popitem(last=False)
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user from this worker's cache after their row changes"""
+    global _invalidations
+    with _lock:
+        _invalidations += 1
+        _users.pop(int(user_id), None)